@@ -45,7 +45,7 @@ def run_clean_file():
     """Step 4: Cleans the data by removing unnecessary information from individual JSON files."""
     display_details(4, "clean_files.py", 'data/processed', 'data/cleaned')
     if input().strip().lower() == 'y':
-        run_script("clean_files.py")
+        run_script("clean_files.py", "--parse_criteria")
 
 def run_json_to_csv_txt_parquet():
     """Step 5: Convert JSON files to CSV, TXT, and Parquet formats and condense files to >10Mgs."""
@@ -29,11 +29,13 @@ def main():
     if choice == '1':
         run_script("step_1_copy_files.py")
     elif choice == '2':
-        run_script("step_3_clean_files.py")
+        run_script("step_3_clean_files.py", "--parse_criteria")
     elif choice == '3':
         print("\033[33mChoose how to split the files:\033[0m")
         print("\033[34m1.\033[0m Split by a specific condition.")
         print("\033[34m2.\033[0m Split by all conditions in a file.")
+        print("\033[34m3.\033[0m Split by all conditions in a file using the condition index.")
+        print("\033[34m4.\033[0m Split by all conditions in a file in a single pass (trials can go to several conditions).")
         split_choice = input("Enter the number of the split option you want to run: ")
         if split_choice == '1':
             condition = input("Enter the condition to filter the trials by (e.g., 'Breast Cancer'): ")
@@ -41,8 +43,14 @@ def main():
         elif split_choice == '2':
             conditions_file = input("Enter the path to the conditions file (e.g., 'conditions.json'): ")
             run_script("step_2_split_by_condition.py", "--conditions_file", conditions_file)
+        elif split_choice == '3':
+            conditions_file = input("Enter the path to the conditions file (e.g., 'conditions.json'): ")
+            run_script("step_2_split_by_condition.py", "--conditions_file", conditions_file, "--use_index")
+        elif split_choice == '4':
+            conditions_file = input("Enter the path to the conditions file (e.g., 'conditions.json'): ")
+            run_script("step_2_split_by_condition.py", "--conditions_file", conditions_file, "--multi_match", "--all_buckets")
         else:
-            print("\033[91mInvalid choice. Please enter 1 or 2.\033[0m")
+            print("\033[91mInvalid choice. Please enter a number from 1 to 4.\033[0m")
     elif choice == '4':
         run_script("step_4_condense_files.py")
     elif choice == '5':
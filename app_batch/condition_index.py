@@ -0,0 +1,187 @@
+import os
+import re
+import json
+import bisect
+import hashlib
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONDITION_INDEX_PATH = os.path.join(BASE_DIR, 'app_batch', 'data_batch', 'condition_index.json')
+
+INDEXED_FIELDS = ["BriefTitle", "Conditions", "Keywords"]
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+GRAM_SIZE = 3  # Substrings of a term are looked up through its 3-character grams
+TERM_LOOKUP_KEY = "_term_lookup"  # Built on first query and never saved
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+def list_cleaned_files(directory):
+    json_files = []
+    for subdir, _, files in os.walk(directory):
+        for file in files:
+            if file.endswith('.json'):
+                json_files.append(os.path.join(subdir, file))
+    return sorted(json_files)
+
+def snapshot_key(directory):
+    """Fingerprint the cleaned tree from file names, sizes and mtimes only (no parsing)."""
+    digest = hashlib.sha256()
+    for file_path in list_cleaned_files(directory):
+        stat = os.stat(file_path)
+        digest.update(f"{os.path.relpath(file_path, directory)}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+def field_text(study, field):
+    value = study.get(field, "")
+    if isinstance(value, list):
+        return "\n".join(str(item) for item in value)
+    return str(value or "")
+
+def build_index(directory):
+    """Parse every cleaned file once and index BriefTitle, Conditions and Keywords tokens by document."""
+    files = []
+    nct_ids = []
+    texts = {field: [] for field in INDEXED_FIELDS}
+    postings = {}
+    for file_path in list_cleaned_files(directory):
+        try:
+            with open(file_path, 'r') as file:
+                data = json.load(file)
+        except json.JSONDecodeError as e:
+            print(f"\033[91mError decoding JSON from file: {file_path}\033[0m")
+            print(e)
+            continue
+        studies = data if isinstance(data, list) else [data]
+        doc_id = len(files)
+        files.append(os.path.relpath(file_path, directory))
+        nct_ids.append([study.get("NCTId", "") for study in studies if isinstance(study, dict)])
+        doc_tokens = set()
+        for field in INDEXED_FIELDS:
+            text = "\n".join(field_text(study, field) for study in studies if isinstance(study, dict)).lower()
+            texts[field].append(text)
+            doc_tokens.update(tokenize(text))
+        for token in doc_tokens:
+            postings.setdefault(token, []).append(doc_id)
+    return {
+        "snapshot": snapshot_key(directory),
+        "files": files,
+        "nct_ids": nct_ids,
+        "texts": texts,
+        "postings": postings,
+    }
+
+def save_index(index, index_path=CONDITION_INDEX_PATH):
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump({key: value for key, value in index.items() if key != TERM_LOOKUP_KEY}, file)
+    os.replace(tmp_path, index_path)
+
+def load_or_build_index(directory, index_path=CONDITION_INDEX_PATH):
+    """Reuse the saved index if it was built from the current cleaned snapshot, otherwise rebuild it."""
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as file:
+            index = json.load(file)
+        if index.get("snapshot") == snapshot_key(directory):
+            print(f"\033[92mUsing condition index {index_path} ({len(index['files'])} files)\033[0m")
+            return index
+    print(f"\033[33mBuilding condition index for {directory}...\033[0m")
+    index = build_index(directory)
+    save_index(index, index_path)
+    print(f"\033[92mIndexed {len(index['files'])} files, {len(index['postings'])} tokens\033[0m")
+    return index
+
+def term_lookup(index):
+    """Sorted terms, sorted reversed terms and a trigram -> term ids map over the index vocabulary, built once per index."""
+    lookup = index.get(TERM_LOOKUP_KEY)
+    if lookup is None:
+        terms = sorted(index["postings"])
+        grams = {}
+        for term_id, term in enumerate(terms):
+            for gram in {term[start:start + GRAM_SIZE] for start in range(len(term) - GRAM_SIZE + 1)}:
+                grams.setdefault(gram, []).append(term_id)
+        lookup = index[TERM_LOOKUP_KEY] = {
+            "terms": terms,
+            "reversed": sorted(term[::-1] for term in terms),
+            "grams": grams,
+        }
+    return lookup
+
+def prefixed(sorted_terms, prefix):
+    """Terms of a sorted list that start with prefix."""
+    start = bisect.bisect_left(sorted_terms, prefix)
+    end = bisect.bisect_left(sorted_terms, prefix + "\uffff")
+    return sorted_terms[start:end]
+
+def matching_terms(lookup, token, position):
+    """Index terms a query token can fall inside, given where it sits in the condition.
+
+    A substring match can start or end in the middle of a word: the only token may sit anywhere in a
+    term, the first of several must end a term and the last must start one.
+    """
+    if position == "last":
+        return prefixed(lookup["terms"], token)
+    if position == "first":
+        return [term[::-1] for term in prefixed(lookup["reversed"], token[::-1])]
+    terms = lookup["terms"]
+    if len(token) < GRAM_SIZE:
+        return [term for term in terms if token in term]
+    # Substring: intersect the term lists of the token's trigrams, then check the survivors
+    term_ids = None
+    for start in range(len(token) - GRAM_SIZE + 1):
+        ids = lookup["grams"].get(token[start:start + GRAM_SIZE], [])
+        term_ids = set(ids) if term_ids is None else term_ids.intersection(ids)
+        if not term_ids:
+            return []
+    return [terms[term_id] for term_id in term_ids if token in terms[term_id]]
+
+def candidate_documents(index, condition):
+    """Documents that contain every condition token inside one of their tokens.
+
+    Whole inner tokens are looked up directly, the first and last tokens by bisecting the sorted
+    (reversed) terms and a lone token through the trigram map; the result is a superset that
+    resolve_condition verifies.
+    """
+    tokens = tokenize(condition)
+    if not tokens:
+        return set(range(len(index["files"])))
+    lookup = term_lookup(index)
+    candidates = None
+    for position, token in enumerate(tokens):
+        if 0 < position < len(tokens) - 1:
+            # Tokens between two others are whole terms
+            docs = set(index["postings"].get(token, ()))
+        else:
+            where = "any" if len(tokens) == 1 else "first" if position == 0 else "last"
+            docs = set()
+            for term in matching_terms(lookup, token, where):
+                docs.update(index["postings"][term])
+        candidates = docs if candidates is None else candidates & docs
+        if not candidates:
+            return set()
+    return candidates
+
+def resolve_condition(index, condition, match_fields=("BriefTitle",)):
+    """Documents whose fields contain the condition as a case-insensitive substring."""
+    needle = condition.lower()
+    return {
+        doc_id for doc_id in candidate_documents(index, condition)
+        if any(needle in index["texts"][field][doc_id] for field in match_fields)
+    }
+
+def remove_documents(index, doc_ids, directory):
+    """Drop moved documents so the saved index matches what is left in the cleaned tree."""
+    keep = [doc_id for doc_id in range(len(index["files"])) if doc_id not in doc_ids]
+    remap = {old: new for new, old in enumerate(keep)}
+    index["files"] = [index["files"][doc_id] for doc_id in keep]
+    index["nct_ids"] = [index["nct_ids"][doc_id] for doc_id in keep]
+    index["texts"] = {field: [texts[doc_id] for doc_id in keep] for field, texts in index["texts"].items()}
+    postings = {}
+    for token, posting in index["postings"].items():
+        remaining = [remap[doc_id] for doc_id in posting if doc_id in remap]
+        if remaining:
+            postings[token] = remaining
+    index["postings"] = postings
+    index.pop(TERM_LOOKUP_KEY, None)
+    index["snapshot"] = snapshot_key(directory)
+    return index
@@ -1,9 +1,16 @@
 import os
+import sys
 import json
 import argparse
 import shutil
+from condition_index import load_or_build_index, resolve_condition, remove_documents, save_index, CONDITION_INDEX_PATH, INDEXED_FIELDS
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLEANED_DATA_DIR = os.path.join(BASE_DIR, 'app_batch', 'data_batch', 'cleaned')
+CATEGORIZED_CONDITIONS_DIR = os.path.join(BASE_DIR, 'app_batch', 'data_batch', 'categorized_conditions')
+
+sys.path.append(BASE_DIR)
+from condition_matcher import ConditionMatcher, MatchStats, collect_field_values
 
 def print_step(message, step):
     shades_of_green = [
@@ -85,8 +92,8 @@ def move_files_by_condition(source_dir, target_condition, destination_dir):
     return moved_files_count
 
 def process_condition(condition):
-    cleaned_data_dir = os.path.join(BASE_DIR, 'app_batch', 'data_batch', 'cleaned')
-    condition_dir = os.path.join(BASE_DIR, 'app_batch', 'data_batch', 'categorized_conditions', condition.replace(" ", "_").lower())
+    cleaned_data_dir = CLEANED_DATA_DIR
+    condition_dir = os.path.join(CATEGORIZED_CONDITIONS_DIR, condition.replace(" ", "_").lower())
 
     print_step("Counting files in the cleaned directory...", 1)
     initial_file_count = count_files(cleaned_data_dir)
@@ -100,19 +107,100 @@ def process_condition(condition):
 
     print_in_green(f"Number of files moved to {condition.replace(' ', '_').capitalize()} directory: {moved_files_count}")
 
+def split_with_index(conditions, match_fields=("BriefTitle",), cleaned_data_dir=CLEANED_DATA_DIR,
+                     categorized_dir=CATEGORIZED_CONDITIONS_DIR, index_path=CONDITION_INDEX_PATH):
+    """Resolve every condition against the condition index and move the matches in one pass.
+
+    Conditions are applied in order and a file goes to the first condition that matches it,
+    exactly as running process_condition once per condition would.
+    """
+    print_step("Loading the condition index...", 1)
+    index = load_or_build_index(cleaned_data_dir, index_path)
+    print_in_yellow(f"Number of files in cleaned directory before processing: {len(index['files'])}")
+
+    assigned = set()
+    moved_counts = {}
+    for condition in conditions:
+        condition_dir = os.path.join(categorized_dir, condition.replace(" ", "_").lower())
+        doc_ids = sorted(resolve_condition(index, condition, match_fields) - assigned)
+        for doc_id in doc_ids:
+            file_path = os.path.join(cleaned_data_dir, index["files"][doc_id])
+            dest_path = os.path.join(condition_dir, index["files"][doc_id])
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            shutil.move(file_path, dest_path)
+        assigned.update(doc_ids)
+        moved_counts[condition] = len(doc_ids)
+        print_in_green(f"Number of files moved to {condition.replace(' ', '_').capitalize()} directory: {len(doc_ids)}")
+
+    save_index(remove_documents(index, assigned, cleaned_data_dir), index_path)
+    print_in_yellow(f"Number of files in cleaned directory after processing: {len(index['files'])}")
+    return moved_counts
+
+def split_with_matcher(conditions, all_buckets=False, cleaned_data_dir=CLEANED_DATA_DIR, categorized_dir=CATEGORIZED_CONDITIONS_DIR):
+    """Read every cleaned file once and match its BriefTitle against all conditions at the same time.
+
+    By default a file moves to the first condition it matches, like running process_condition once per
+    condition. With all_buckets the file is copied to every condition it matches and then removed.
+    """
+    matcher = ConditionMatcher(conditions)
+    stats = MatchStats(conditions)
+    condition_dirs = [os.path.join(categorized_dir, condition.replace(" ", "_").lower()) for condition in conditions]
+
+    print_step(f"Matching {len(conditions)} conditions in a single pass...", 1)
+    for subdir, _, files in os.walk(cleaned_data_dir):
+        for file in files:
+            if not file.endswith('.json'):
+                continue
+            file_path = os.path.join(subdir, file)
+            data = read_json(file_path)
+            if not data:
+                continue
+            studies = len(data) if isinstance(data, list) else 1
+            condition_ids = sorted(matcher.find("\n".join(collect_field_values(data, "BriefTitle"))))
+            if not condition_ids:
+                stats.record(studies, [])
+                continue
+            if not all_buckets:
+                condition_ids = condition_ids[:1]
+            stats.record(studies, condition_ids)
+
+            relative_path = os.path.relpath(file_path, cleaned_data_dir)
+            for condition_id in condition_ids[1:]:
+                dest_path = os.path.join(condition_dirs[condition_id], relative_path)
+                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                shutil.copy2(file_path, dest_path)
+            dest_path = os.path.join(condition_dirs[condition_ids[0]], relative_path)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            shutil.move(file_path, dest_path)
+
+    print_in_green(stats.report())
+    return dict(zip(conditions, stats.counts))
+
+def load_conditions(conditions_file):
+    with open(conditions_file, 'r') as file:
+        conditions = json.load(file)
+    return list(conditions.values())
+
 def main():
     parser = argparse.ArgumentParser(description='Move files based on a condition.')
     parser.add_argument('--condition', type=str, help='The condition to filter the trials by (e.g., "Breast Cancer").')
     parser.add_argument('--conditions_file', type=str, help='Path to the JSON file containing a list of conditions.')
+    parser.add_argument('--use_index', action='store_true', help='Resolve conditions against the persistent condition index instead of re-reading every file.')
+    parser.add_argument('--match_fields', nargs='+', choices=INDEXED_FIELDS, default=["BriefTitle"], help='Fields a condition is matched against when using the index.')
+    parser.add_argument('--multi_match', action='store_true', help='Match all conditions in one pass over the cleaned files.')
+    parser.add_argument('--all_buckets', action='store_true', help='With --multi_match, place a trial in every condition it matches.')
 
     args = parser.parse_args()
 
-    if args.condition:
+    if args.use_index and (args.condition or args.conditions_file):
+        conditions = [args.condition] if args.condition else load_conditions(args.conditions_file)
+        split_with_index(conditions, args.match_fields)
+    elif args.multi_match and args.conditions_file:
+        split_with_matcher(load_conditions(args.conditions_file), args.all_buckets)
+    elif args.condition:
         process_condition(args.condition)
     elif args.conditions_file:
-        with open(args.conditions_file, 'r') as file:
-            conditions = json.load(file)
-        for key, condition in conditions.items():
+        for condition in load_conditions(args.conditions_file):
             process_condition(condition)
     else:
         parser.error("You must provide either a condition or a conditions file. Example usage: python3 step_2_split_by_condition.py --condition 'Breast Cancer' OR python3 step_2_split_by_condition.py --conditions_file 'conditions.json'")
@@ -1,66 +1,30 @@
 import json 
 import os
+import sys
 import datetime
+import argparse
+import hashlib
+import sqlite3
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 # Define the directories
 extracted_working_dir = os.path.join(BASE_DIR, 'app_batch', 'data_batch', 'extracted_working')
 cleaned_data_dir = os.path.join(BASE_DIR, 'app_batch', 'data_batch', 'cleaned')
+cleaned_shards_dir = os.path.join(BASE_DIR, 'app_batch', 'data_batch', 'cleaned_shards')
+clean_state_db = os.path.join(BASE_DIR, 'app_batch', 'data_batch', 'clean_state.sqlite')
+criteria_cache_dir = os.path.join(BASE_DIR, 'app_batch', 'data_batch', 'criteria_cache')
 
-# Function to read and parse JSON data from a file
-def read_json(file_path):
-    with open(file_path, 'r') as file:
-        try:
-            return json.load(file)
-        except json.JSONDecodeError as e:
-            print(f"\033[91mError decoding JSON from file: {file_path}\033[0m")
-            print(e)
-            return None
+sys.path.append(BASE_DIR)
+from study_schema import extract_batch_cleaned_study
+from parallel_clean import read_json, cleaned_path_for, list_json_files, clean_files_parallel, DEFAULT_BATCH_SIZE
 
-# Function to clean and extract necessary information from a single study
+# Function to clean and extract necessary information from a single study (fields: study_schema.BATCH_CLEANED_STUDY_FIELDS)
 def clean_study_data(study):
-    cleaned_study = {}
-    
     if not isinstance(study, dict):
         print(f"\033[91mInvalid study format: {type(study)}. Expected a dictionary.\033[0m")
-        return cleaned_study
-
-    study_info = study.get("ProtocolSection", {})
-    nct_id = study_info.get("IdentificationModule", {}).get("NCTId", "")
-    nct_id_link = f"clinicaltrials.gov/study/{nct_id}"
-
-    # Extract necessary fields
-    cleaned_study = {
-        "BriefTitle": study_info.get("IdentificationModule", {}).get("BriefTitle", ""),
-        "BriefSummary": study_info.get("DescriptionModule", {}).get("BriefSummary", ""),
-        "EligibilityCriteria": study_info.get("EligibilityModule", {}).get("EligibilityCriteria", ""),
-        "HealthyVolunteers": study_info.get("EligibilityModule", {}).get("HealthyVolunteers", ""),
-        "Gender": study_info.get("EligibilityModule", {}).get("Gender", ""),
-        "MinimumAge": study_info.get("EligibilityModule", {}).get("MinimumAge", ""),
-        "Location": [
-            {
-                "Facility": loc.get("LocationFacility", ""),
-                "City": loc.get("LocationCity", ""),
-                "State": loc.get("LocationState", ""),
-                "Zip": loc.get("LocationZip", ""),
-                "Country": loc.get("LocationCountry", "")
-            } for loc in study_info.get("ContactsLocationsModule", {}).get("LocationList", {}).get("Location", [])
-        ],
-        "Conditions": study_info.get("ConditionsModule", {}).get("ConditionList", {}).get("Condition", []),
-        "Keywords": study_info.get("ConditionsModule", {}).get("KeywordList", {}).get("Keyword", []),
-        "Intervention": [
-            {
-                "Type": intervention.get("InterventionType", ""),
-                "Name": intervention.get("InterventionName", "")
-            } for intervention in study_info.get("ArmsInterventionsModule", {}).get("InterventionList", {}).get("Intervention", [])
-        ],
-        "NCTId": nct_id,
-        "NCTId_link": nct_id_link,
-        "MoreInfoLink": study_info.get("IdentificationModule", {}).get("SecondaryIdInfoList", {}).get("SecondaryIdInfo", [])[0].get("SecondaryIdLink", "") if study_info.get("IdentificationModule", {}).get("SecondaryIdInfoList", {}).get("SecondaryIdInfo", []) else ""
-    }
-
-    return cleaned_study
+        return {}
+    return extract_batch_cleaned_study(study)
 
 # Function to clean and extract necessary information
 def clean_data(raw_data):
@@ -172,16 +136,123 @@ def process_all_files():
                     json.dump(cleaned_data, outfile, indent=4)
                 print(f"\033[92mSaved cleaned data to: {cleaned_file_path}\033[0m")
 
-# Ensure the cleaned data directory exists
-os.makedirs(cleaned_data_dir, exist_ok=True)
-print(f"\033[92mCreated cleaned data directory: {cleaned_data_dir}\033[0m")
+# Function to clean all files across a pool of worker processes (see parallel_clean.py)
+def process_all_files_parallel(workers=None, batch_size=DEFAULT_BATCH_SIZE, source_dir=extracted_working_dir, target_dir=cleaned_data_dir, shards_dir=cleaned_shards_dir):
+    return clean_files_parallel(clean_data, source_dir, target_dir, shards_dir, workers, batch_size)
+
+# Function to open (and create if needed) the incremental cleaning state database
+def open_state_db(db_path):
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cleaned_files (
+            source_path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            output_path TEXT NOT NULL,
+            nct_ids TEXT NOT NULL
+        )
+    """)
+    return conn
+
+# Delete the cleaned output of a source file and forget it, so it is cleaned again once it is fixed or re-added
+def forget_source(conn, target_dir, relative_path, output_relpath):
+    output_path = os.path.join(target_dir, output_relpath)
+    if os.path.exists(output_path):
+        os.remove(output_path)
+        print(f"\033[93mRemoved cleaned data: {output_path}\033[0m")
+    conn.execute("DELETE FROM cleaned_files WHERE source_path = ?", (relative_path,))
+
+# Function to re-clean only new or changed files and drop outputs of removed ones
+def process_changed_files(db_path=clean_state_db, source_dir=extracted_working_dir, target_dir=cleaned_data_dir):
+    conn = open_state_db(db_path)
+    known = {row[0]: row[1:] for row in conn.execute("SELECT source_path, mtime_ns, size, content_hash, output_path FROM cleaned_files")}
+    counts = {"new": 0, "changed": 0, "unchanged": 0, "removed": 0, "failed": 0}
+    seen = set()
+
+    for file_path in list_json_files(source_dir):
+        relative_path = os.path.relpath(file_path, source_dir)
+        seen.add(relative_path)
+        stat = os.stat(file_path)
+        previous = known.get(relative_path)
+        previous_output = os.path.join(target_dir, previous[3]) if previous else None
+
+        # Cheap check first: same size and mtime means the file was not touched
+        if previous and previous[0] == stat.st_mtime_ns and previous[1] == stat.st_size and os.path.exists(previous_output):
+            counts["unchanged"] += 1
+            continue
+
+        with open(file_path, 'rb') as file:
+            content = file.read()
+        content_hash = hashlib.sha256(content).hexdigest()
+        if previous and previous[2] == content_hash and os.path.exists(previous_output):
+            # Touched but identical: remember the new mtime so the next run skips it cheaply
+            conn.execute("UPDATE cleaned_files SET mtime_ns = ?, size = ? WHERE source_path = ?", (stat.st_mtime_ns, stat.st_size, relative_path))
+            counts["unchanged"] += 1
+            continue
+
+        try:
+            raw_json = json.loads(content)
+        except json.JSONDecodeError as e:
+            print(f"\033[91mError decoding JSON from file: {file_path}\033[0m")
+            print(e)
+            # Its previous output no longer matches the source, so it goes like a deleted file's
+            if previous:
+                forget_source(conn, target_dir, relative_path, previous[3])
+            counts["failed"] += 1
+            continue
+        cleaned_data = clean_data(raw_json)
+
+        cleaned_file_path = cleaned_path_for(file_path, source_dir, target_dir)
+        os.makedirs(os.path.dirname(cleaned_file_path), exist_ok=True)
+        with open(cleaned_file_path, 'w') as outfile:
+            json.dump(cleaned_data, outfile, indent=4)
+        print(f"\033[92mSaved cleaned data to: {cleaned_file_path}\033[0m")
+
+        conn.execute(
+            "INSERT OR REPLACE INTO cleaned_files (source_path, mtime_ns, size, content_hash, output_path, nct_ids) VALUES (?, ?, ?, ?, ?, ?)",
+            (relative_path, stat.st_mtime_ns, stat.st_size, content_hash, os.path.relpath(cleaned_file_path, target_dir),
+             json.dumps([study.get("NCTId", "") for study in cleaned_data]))
+        )
+        counts["changed" if previous else "new"] += 1
+
+    # Studies that disappeared upstream lose their cleaned output too
+    for relative_path in set(known) - seen:
+        forget_source(conn, target_dir, relative_path, known[relative_path][3])
+        counts["removed"] += 1
+
+    conn.commit()
+    conn.close()
+    print(f"\033[92mNew: {counts['new']}, changed: {counts['changed']}, unchanged: {counts['unchanged']}, removed: {counts['removed']}, failed: {counts['failed']}\033[0m")
+    return counts
 
 # Run the processing function
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Clean the JSON files in extracted_working.')
+    parser.add_argument('--parallel', action='store_true', help='Clean files across a pool of worker processes.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes (default: number of cores).')
+    parser.add_argument('--batch_size', type=int, default=DEFAULT_BATCH_SIZE, help='Number of files handed to a worker at a time.')
+    parser.add_argument('--incremental', action='store_true', help='Only clean new or changed files, tracked in clean_state.sqlite.')
+    parser.add_argument('--parse_criteria', action='store_true', help='Also store the parsed eligibility criteria in each cleaned record.')
+    args = parser.parse_args()
+
+    # Ensure the cleaned data directory exists
+    os.makedirs(cleaned_data_dir, exist_ok=True)
+    print(f"\033[92mCreated cleaned data directory: {cleaned_data_dir}\033[0m")
+
     print("\033[92mStarting to process all files...\033[0m")
     extracted_info = get_directory_info(extracted_working_dir)
     print_directory_info('Extracted Working', extracted_info)
-    process_all_files()
+    if args.incremental:
+        process_changed_files()
+    elif args.parallel:
+        process_all_files_parallel(args.workers, args.batch_size)
+    else:
+        process_all_files()
+    if args.parse_criteria:
+        from criteria_parser import annotate_directories
+        annotate_directories([cleaned_data_dir, cleaned_shards_dir], criteria_cache_dir)
     cleaned_info = get_directory_info(cleaned_data_dir)
     print_directory_info('Cleaned', cleaned_info)
     print("\033[92mFinished processing all files.\033[0m")
@@ -1,15 +1,22 @@
 import os
+import io
+import csv
+import sys
 import json
+import time
+import hashlib
+import argparse
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CATEGORIZED_CONDITIONS_DIR = os.path.join(BASE_DIR, 'app_batch', 'data_batch', 'categorized_conditions')
 TXT_OUTPUT_DIR = os.path.join(BASE_DIR, 'app_batch', 'data_batch', 'txt')
+sys.path.append(BASE_DIR)
+from manifests import nct_id_digest, snapshot_files, verify_group, load_manifest, write_manifest, MANIFEST_FILE
 MAX_SIZE_MB = 10
 MAX_SIZE_BYTES = MAX_SIZE_MB * 1024 * 1024
-
-# Ensure the TXT directory exists
-os.makedirs(TXT_OUTPUT_DIR, exist_ok=True)
+CONDENSE_MANIFEST_FILE = MANIFEST_FILE
 
 def json_to_txt(directory, condition):
     """Convert JSON files in a directory to multiple TXT files, each smaller than 10MB."""
@@ -58,40 +65,269 @@ def json_to_txt(directory, condition):
 
     return txt_file_path, file_count
 
-def check_trials_count():
-    """Check the number of trials listed in each file in both JSON and TXT directories."""
-    for subdir in next(os.walk(CATEGORIZED_CONDITIONS_DIR))[1]:
-        json_dir = os.path.join(CATEGORIZED_CONDITIONS_DIR, subdir)
-        txt_dir = os.path.join(TXT_OUTPUT_DIR, subdir)
-        
-        json_count = 0
-        for root, _, files in os.walk(json_dir):
-            for file in files:
-                if file.endswith('.json'):
-                    file_path = os.path.join(root, file)
-                    with open(file_path, 'r') as f:
-                        data = json.load(f)
-                        json_count += len(data) if isinstance(data, list) else 1
-
-        txt_count = 0
-        if os.path.exists(txt_dir):
-            for root, _, files in os.walk(txt_dir):
-                for file in files:
-                    if file.endswith('.txt'):
-                        file_path = os.path.join(root, file)
-                        df = pd.read_csv(file_path, sep='\t')
-                        txt_count += len(df)
-                        print(f"{os.path.basename(file_path)}: {len(df)} trials")
+def list_json_files(directory):
+    json_files = []
+    for root, _, files in os.walk(directory):
+        for file in files:
+            if file.endswith('.json'):
+                json_files.append(os.path.join(root, file))
+    return sorted(json_files)
+
+def iter_json_records(json_files):
+    for file_path in json_files:
+        with open(file_path, 'r') as f:
+            data = json.load(f)
+        for record in data if isinstance(data, list) else [data]:
+            yield record
+
+def flatten_record(record, prefix=""):
+    """Flatten nested dicts into dotted keys, the way pd.json_normalize names its columns."""
+    flat = {}
+    for key, value in record.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and value:
+            flat.update(flatten_record(value, f"{name}."))
+        else:
+            flat[name] = value
+    return flat
+
+def format_value(value):
+    # Matches DataFrame.to_csv: missing values are empty, everything else is str()
+    return "" if value is None else str(value)
+
+class PartWriter:
+    """Write TSV rows to {condition}_part_N.txt files, starting a new part before one would exceed max_bytes.
+
+    Every row is serialised on its own and its encoded length is added to the running total, so
+    the size check uses the exact bytes on disk. The SHA-256 of each part is computed as it is written.
+    """
+
+    def __init__(self, output_subdir, condition, columns, max_bytes=MAX_SIZE_BYTES):
+        self.output_subdir = output_subdir
+        self.condition = condition
+        self.columns = columns
+        self.max_bytes = max_bytes
+        self.header = self.encode_row(columns)
+        self.parts = []
+        self.nct_ids = set()
+        self.file = None
+        self.digest = None
+
+    def encode_row(self, values):
+        buffer = io.StringIO()
+        csv.writer(buffer, delimiter='\t', lineterminator='\n').writerow(values)
+        return buffer.getvalue().encode('utf-8')
+
+    def _open_next_part(self):
+        self.close()
+        txt_file_path = os.path.join(self.output_subdir, f"{self.condition}_part_{len(self.parts) + 1}.txt")
+        self.file = open(txt_file_path, 'wb')
+        self.file.write(self.header)
+        self.digest = hashlib.sha256(self.header)
+        self.parts.append({"file": txt_file_path, "rows": 0, "bytes": len(self.header)})
+
+    def write(self, record):
+        row = self.encode_row([format_value(record.get(column)) for column in self.columns])
+        if self.file is None or (self.parts[-1]["rows"] and self.parts[-1]["bytes"] + len(row) > self.max_bytes):
+            self._open_next_part()
+        if self.parts[-1]["bytes"] + len(row) > self.max_bytes:
+            print(f"\033[91mA single row in {self.condition} is larger than {self.max_bytes} bytes\033[0m")
+        self.file.write(row)
+        self.digest.update(row)
+        self.parts[-1]["rows"] += 1
+        self.parts[-1]["bytes"] += len(row)
+        self.nct_ids.add(format_value(record.get("NCTId")))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.parts[-1]["sha256"] = self.digest.hexdigest()
+            self.file = None
+
+def stream_json_to_txt(directory, condition, output_subdir=None, max_bytes=MAX_SIZE_BYTES):
+    """Condense the JSON files of a condition into TSV parts of at most max_bytes, one row at a time.
+
+    The first pass only collects the column names (in the order pd.json_normalize + pd.concat would
+    produce them); the second pass writes the rows. Only one source file is in memory at a time.
+    Returns the part files with their row counts, exact byte sizes and checksums, plus the record
+    count and NCTId digest of the source files for verification.
+    """
+    if output_subdir is None:
+        output_subdir = os.path.join(TXT_OUTPUT_DIR, os.path.relpath(directory, CATEGORIZED_CONDITIONS_DIR))
+    source_files = snapshot_files(directory)
+    json_files = list_json_files(directory)
+
+    columns = {}
+    source_records = 0
+    source_nct_ids = set()
+    for record in iter_json_records(json_files):
+        source_records += 1
+        source_nct_ids.add(format_value(record.get("NCTId")))
+        for column in flatten_record(record):
+            columns.setdefault(column, None)
+
+    os.makedirs(output_subdir, exist_ok=True)
+    # Remove parts left over from a previous run that needed more files
+    for name in os.listdir(output_subdir):
+        if name.startswith(f"{condition}_part_") and name.endswith('.txt'):
+            os.remove(os.path.join(output_subdir, name))
+
+    writer = PartWriter(output_subdir, condition, list(columns), max_bytes)
+    try:
+        for record in iter_json_records(json_files):
+            writer.write(flatten_record(record))
+    finally:
+        writer.close()
+
+    for part in writer.parts:
+        print(f"\033[32mConverted {directory} to {part['file']} ({part['rows']} rows, {part['bytes']} bytes)\033[0m")
+    return {
+        "condition": condition,
+        "source": {"records": source_records, "nct_digest": nct_id_digest(source_nct_ids), "files": source_files},
+        "rows": sum(part["rows"] for part in writer.parts),
+        "nct_digest": nct_id_digest(writer.nct_ids),
+        "bytes": sum(part["bytes"] for part in writer.parts),
+        "parts": writer.parts,
+    }
+
+def count_json_trials(json_dir):
+    json_count = 0
+    for root, _, files in os.walk(json_dir):
+        for file in files:
+            if file.endswith('.json'):
+                file_path = os.path.join(root, file)
+                with open(file_path, 'r') as f:
+                    data = json.load(f)
+                    json_count += len(data) if isinstance(data, list) else 1
+    return json_count
+
+def load_condense_manifest(txt_dir=TXT_OUTPUT_DIR):
+    return load_manifest(os.path.join(txt_dir, CONDENSE_MANIFEST_FILE))
+
+def write_condense_manifest(results, txt_dir=TXT_OUTPUT_DIR):
+    """Combined manifest of every condition: its source snapshot and its part files (relative to txt_dir)."""
+    conditions = []
+    for result in sorted(results, key=lambda result: result["condition"]):
+        parts = [{**part, "file": os.path.relpath(part["file"], txt_dir).replace(os.sep, '/')} for part in result["parts"]]
+        conditions.append({**result, "parts": parts})
+    manifest = {
+        "conditions": conditions,
+        "rows": sum(result["rows"] for result in conditions),
+        "bytes": sum(result["bytes"] for result in conditions),
+        "parts": sum(len(result["parts"]) for result in conditions),
+    }
+    return write_manifest(os.path.join(txt_dir, CONDENSE_MANIFEST_FILE), manifest)
+
+def check_trials_count(categorized_dir=CATEGORIZED_CONDITIONS_DIR, txt_dir=TXT_OUTPUT_DIR, checksums=False):
+    """Check the number of trials listed in each file in both JSON and TXT directories.
+
+    With a condense manifest nothing is parsed: the JSON count is the manifest's source count as long
+    as the source files are unchanged (by size and mtime), and the TXT count is the sum of the parts
+    whose size (or, with checksums=True, SHA-256) still matches. Without a manifest every file is
+    read as before.
+    """
+    manifest = load_condense_manifest(txt_dir)
+    manifest_conditions = {entry["condition"]: entry for entry in manifest["conditions"]} if manifest else {}
+    results = []
+    for subdir in next(os.walk(categorized_dir))[1]:
+        json_dir = os.path.join(categorized_dir, subdir)
+        subdir_txt_dir = os.path.join(txt_dir, subdir)
+        entry = manifest_conditions.get(subdir)
+
+        if entry is not None:
+            check = verify_group(entry, json_dir, txt_dir, checksums)
+            json_count = check["source_records"]
+            txt_count = check["output_rows"]
+            if check["stale_sources"]:
+                print(f"\033[91m{subdir}: {len(check['stale_sources'])} source files changed since condensing\033[0m")
+                json_count = count_json_trials(json_dir)
+            for part_file in check["bad_parts"]:
+                print(f"\033[91m{part_file} is missing or does not match the manifest\033[0m")
+            if not check["digest_match"]:
+                print(f"\033[91m{subdir}: NCTIds in TXT do not match the source\033[0m")
+            for part in entry["parts"]:
+                print(f"{os.path.basename(part['file'])}: {part['rows']} trials")
+        else:
+            json_count = count_json_trials(json_dir)
+            txt_count = 0
+            if os.path.exists(subdir_txt_dir):
+                for root, _, files in os.walk(subdir_txt_dir):
+                    for file in files:
+                        if file.endswith('.txt'):
+                            file_path = os.path.join(root, file)
+                            df = pd.read_csv(file_path, sep='\t')
+                            txt_count += len(df)
+                            print(f"{os.path.basename(file_path)}: {len(df)} trials")
 
         print(f"\033[94m{subdir}\033[0m: \033[96m{json_count} trials in JSON\033[0m | \033[96m{txt_count} trials in TXT\033[0m :: ({'same number' if json_count == txt_count else 'different numbers'})")
+        results.append((subdir, json_count, txt_count))
+    return results
+
+def condition_size(directory):
+    return sum(os.path.getsize(file_path) for file_path in list_json_files(directory))
+
+def condense_condition(directory, condition, output_subdir):
+    """Worker task: condense one condition and time it."""
+    start_time = time.time()
+    result = stream_json_to_txt(directory, condition, output_subdir)
+    result["seconds"] = round(time.time() - start_time, 3)
+    return result
+
+def condense_all_parallel(workers=None, categorized_dir=CATEGORIZED_CONDITIONS_DIR, txt_dir=TXT_OUTPUT_DIR):
+    """Condense every condition directory across a process pool, largest first.
 
-def process_all_directories():
+    The pool picks tasks up in submission order, so the biggest conditions start first and the
+    run does not end waiting on one large condition that was scheduled last.
+    """
+    workers = workers or os.cpu_count() or 1
+    subdirs = next(os.walk(categorized_dir))[1]
+    sizes = {subdir: condition_size(os.path.join(categorized_dir, subdir)) for subdir in subdirs}
+    ordered = sorted(subdirs, key=lambda subdir: (-sizes[subdir], subdir))
+    print(f"\033[33mCondensing {len(ordered)} conditions with {workers} workers\033[0m")
+
+    start_time = time.time()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(condense_condition, os.path.join(categorized_dir, subdir), subdir, os.path.join(txt_dir, subdir)): subdir
+            for subdir in ordered
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print(f"\033[32m{result['condition']}: {result['rows']} rows in {len(result['parts'])} parts, {result['seconds']:.2f}s\033[0m")
+
+    manifest = write_condense_manifest(results, txt_dir)
+    print(f"\033[33mCondensed {manifest['rows']} rows into {manifest['parts']} parts in {time.time() - start_time:.2f}s\033[0m")
+    return manifest
+
+def process_all_directories(use_pandas=False, parallel=False, workers=None):
     """Process all directories in the categorized conditions directory."""
     print("\033[33mStarting to condense files...\033[0m")
-    for subdir in next(os.walk(CATEGORIZED_CONDITIONS_DIR))[1]:
-        json_to_txt(os.path.join(CATEGORIZED_CONDITIONS_DIR, subdir), subdir)
+    if parallel:
+        condense_all_parallel(workers)
+    elif use_pandas:
+        # A manifest from an earlier streaming run would no longer describe the TXT files
+        manifest_path = os.path.join(TXT_OUTPUT_DIR, CONDENSE_MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        for subdir in next(os.walk(CATEGORIZED_CONDITIONS_DIR))[1]:
+            json_to_txt(os.path.join(CATEGORIZED_CONDITIONS_DIR, subdir), subdir)
+    else:
+        results = []
+        for subdir in next(os.walk(CATEGORIZED_CONDITIONS_DIR))[1]:
+            results.append(condense_condition(os.path.join(CATEGORIZED_CONDITIONS_DIR, subdir), subdir, os.path.join(TXT_OUTPUT_DIR, subdir)))
+        write_condense_manifest(results)
     check_trials_count()
     print("\033[33mFinished condensing files.\033[0m")
 
 if __name__ == "__main__":
-    process_all_directories()
+    parser = argparse.ArgumentParser(description='Condense the categorized conditions into TSV .txt files smaller than 10MB.')
+    parser.add_argument('--pandas', action='store_true', help='Use the previous DataFrame-based condenser instead of the streaming one.')
+    parser.add_argument('--parallel', action='store_true', help='Condense condition directories across a pool of worker processes, largest first.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes (default: number of cores).')
+    args = parser.parse_args()
+
+    # Ensure the TXT directory exists
+    os.makedirs(TXT_OUTPUT_DIR, exist_ok=True)
+    process_all_directories(args.pandas, args.parallel, args.workers)
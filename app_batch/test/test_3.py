@@ -1,4 +1,5 @@
 import os
+import sys
 import json
 import pandas as pd
 import random
@@ -6,6 +7,8 @@ import random
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CATEGORIZED_CONDITIONS_DIR = os.path.join(BASE_DIR, 'data_batch', 'categorized_conditions')
 TXT_DIR = os.path.join(BASE_DIR, 'data_batch', 'txt')
+sys.path.append(os.path.dirname(BASE_DIR))
+from manifests import verify_group, load_manifest, MANIFEST_FILE
 
 def count_json_trials(directory):
     trial_count = 0
@@ -22,17 +25,35 @@ def count_txt_trials(file_path):
     if not os.path.exists(file_path):
         print(f"\033[33mTXT file not found: {file_path}\033[0m")
         return 0
-    df = pd.read_csv(file_path, sep='\\t')
+    df = pd.read_csv(file_path, sep='\t')
     return len(df)
 
+def manifest_counts(subdir, manifest):
+    """(json_count, txt_count) from the condense manifest, or None if it cannot be trusted for subdir."""
+    entry = {entry["condition"]: entry for entry in manifest["conditions"]}.get(subdir) if manifest else None
+    if entry is None:
+        return None
+    check = verify_group(entry, os.path.join(CATEGORIZED_CONDITIONS_DIR, subdir), TXT_DIR)
+    if check["stale_sources"] or check["bad_parts"]:
+        print(f"\033[33m{subdir} changed since it was condensed; counting from the files\033[0m")
+        return None
+    if not check["digest_match"]:
+        print(f"\033[31m{subdir}: NCTIds in TXT do not match the source\033[0m")
+    return check["source_records"], check["output_rows"]
+
 def main():
     subdirs = [d for d in os.listdir(CATEGORIZED_CONDITIONS_DIR) if os.path.isdir(os.path.join(CATEGORIZED_CONDITIONS_DIR, d))]
-    random_subdirs = random.sample(subdirs, 4)
+    random_subdirs = random.sample(subdirs, min(4, len(subdirs)))
+    manifest = load_manifest(os.path.join(TXT_DIR, MANIFEST_FILE))
     
     for subdir in random_subdirs:
-        json_count = count_json_trials(os.path.join(CATEGORIZED_CONDITIONS_DIR, subdir))
-        txt_file = os.path.join(TXT_DIR, f"{subdir}_part_1.txt")
-        txt_count = count_txt_trials(txt_file)
+        counts = manifest_counts(subdir, manifest)
+        if counts is not None:
+            json_count, txt_count = counts
+        else:
+            json_count = count_json_trials(os.path.join(CATEGORIZED_CONDITIONS_DIR, subdir))
+            txt_file = os.path.join(TXT_DIR, subdir, f"{subdir}_part_1.txt")
+            txt_count = count_txt_trials(txt_file)
         
         color = "\033[32m" if json_count == txt_count else "\033[31m"
         reset = "\033[0m"
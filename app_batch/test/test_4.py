@@ -1,4 +1,5 @@
 import os
+import sys
 import json
 import pandas as pd
 import random
@@ -6,6 +7,8 @@ import random
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CATEGORIZED_CONDITIONS_DIR = os.path.join(BASE_DIR, 'data_batch', 'categorized_conditions')
 TXT_DIR = os.path.join(BASE_DIR, 'data_batch', 'txt')
+sys.path.append(os.path.dirname(BASE_DIR))
+from manifests import verify_group, load_manifest, MANIFEST_FILE
 
 def count_json_trials(directory):
     trial_count = 0
@@ -32,6 +35,34 @@ def find_txt_files(directory):
                 txt_files.append(os.path.join(root, file))
     return txt_files
 
+def txt_files_by_condition(directory):
+    """Walk the TXT directory once and group the part files by condition (their subdirectory)."""
+    grouped = {}
+    for txt_file in sorted(find_txt_files(directory)):
+        condition = os.path.basename(os.path.dirname(txt_file))
+        grouped.setdefault(condition, []).append(txt_file)
+    return grouped
+
+def condition_counts(subdir, manifest_conditions, txt_files):
+    """(json_count, txt_count, first TXT file) for a condition.
+
+    The counts come from the condense manifest while the source and part files still match it
+    (sizes and mtimes only); otherwise the files are parsed.
+    """
+    source_dir = os.path.join(CATEGORIZED_CONDITIONS_DIR, subdir)
+    entry = manifest_conditions.get(subdir)
+    if entry is not None:
+        check = verify_group(entry, source_dir, TXT_DIR)
+        if not check["stale_sources"] and not check["bad_parts"]:
+            if not check["digest_match"]:
+                print(f"\033[91m{subdir}: NCTIds in TXT do not match the source\033[0m")
+            first_part = os.path.join(TXT_DIR, entry["parts"][0]["file"]) if entry["parts"] else None
+            return check["source_records"], check["output_rows"], first_part
+        print(f"\033[33m{subdir} changed since it was condensed; counting from the files\033[0m")
+    json_count = count_json_trials(source_dir)
+    txt_count = sum(count_txt_trials(txt_file) for txt_file in txt_files)
+    return json_count, txt_count, txt_files[0] if txt_files else None
+
 def print_colored(subdir, json_count, txt_count, txt_file_path=None):
     key_color = "\033[95m"  # Light magenta
     value_color = "\033[96m"  # Light cyan
@@ -55,21 +86,17 @@ def main():
         print(f"\033[91mError: No subdirectories found in {CATEGORIZED_CONDITIONS_DIR}.\033[0m")
         return
 
+    manifest = load_manifest(os.path.join(TXT_DIR, MANIFEST_FILE))
+    manifest_conditions = {entry["condition"]: entry for entry in manifest["conditions"]} if manifest else {}
+    if not manifest_conditions:
+        print("\033[33mNo condense manifest found; counting trials from the files.\033[0m")
+    grouped_txt_files = txt_files_by_condition(TXT_DIR)
+
     discrepancies = []
     results = []
 
     for subdir in subdirs:
-        json_count = count_json_trials(os.path.join(CATEGORIZED_CONDITIONS_DIR, subdir))
-        txt_files = find_txt_files(TXT_DIR)
-        txt_count = 0
-        txt_file_path = None
-        
-        for txt_file in txt_files:
-            if os.path.basename(txt_file).startswith(subdir):
-                txt_file_path = txt_file
-                txt_count = count_txt_trials(txt_file_path)
-                break
-
+        json_count, txt_count, txt_file_path = condition_counts(subdir, manifest_conditions, grouped_txt_files.get(subdir, []))
         results.append((subdir, json_count, txt_count, txt_file_path))
 
         if json_count != txt_count:
@@ -90,38 +117,16 @@ def main():
     choice = input("Do you want to check all clinical trials or just a random one? (all/random): ").strip().lower()
 
     if choice == "random":
-        # Pick a random txt file and print details
-        txt_files = find_txt_files(TXT_DIR)
-        existing_txt_files = [file for file in txt_files if os.path.exists(file)]
-        
-        if existing_txt_files:
-            random_txt_file = random.choice(existing_txt_files)
-            random_subdir = os.path.basename(random_txt_file).split('_part_1.txt')[0]
-            json_count = count_json_trials(os.path.join(CATEGORIZED_CONDITIONS_DIR, random_subdir))
-            txt_count = count_txt_trials(random_txt_file)
-            print_colored(random_subdir, json_count, txt_count, random_txt_file)
+        # Pick a random condition that has TXT files and print details
+        condensed = [result for result in results if result[3]]
+        if condensed:
+            print_colored(*random.choice(condensed))
         else:
             print("\033[91mNo TXT files found in the TXT directory.\033[0m")
     elif choice == "all":
         # Print details for all clinical trials
-        for subdir in subdirs:
-            source_dir = os.path.join(CATEGORIZED_CONDITIONS_DIR, subdir)
-            txt_files = find_txt_files(TXT_DIR)
-            txt_file_path = None
-            txt_count = 0
-
-            for txt_file in txt_files:
-                if os.path.basename(txt_file).startswith(subdir):
-                    txt_file_path = txt_file
-                    txt_count = count_txt_trials(txt_file_path)
-                    break
-
-            if txt_file_path:
-                json_count = count_json_trials(source_dir)
-                print_colored(subdir, json_count, txt_count, txt_file_path)
-            else:
-                json_count = count_json_trials(source_dir)
-                print_colored(subdir, json_count, 0)
+        for subdir, json_count, txt_count, txt_file_path in results:
+            print_colored(subdir, json_count, txt_count, txt_file_path)
     else:
         print("\033[91mInvalid choice. Please enter 'all' or 'random'.\033[0m")
 
@@ -1,9 +1,12 @@
 import os
+import sys
 import pandas as pd
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 TXT_DIR = os.path.join(BASE_DIR, 'data_batch', 'txt')
 MAX_SIZE_MB = 10
+sys.path.append(os.path.dirname(BASE_DIR))
+from manifests import load_manifest, MANIFEST_FILE
 
 def find_txt_files(directory):
     txt_files = []
@@ -29,19 +32,36 @@ def count_trials_in_txt(file_path):
         print(f"\033[91mError reading {file_path}: {e}\033[0m")
         return 0
 
+def manifest_rows(txt_dir):
+    """Recorded size and row count of every part in the condense manifest, keyed by path."""
+    manifest = load_manifest(os.path.join(txt_dir, MANIFEST_FILE))
+    rows = {}
+    for entry in (manifest or {}).get("conditions", []):
+        for part in entry["parts"]:
+            rows[os.path.normpath(os.path.join(txt_dir, part["file"]))] = (part["bytes"], part["rows"])
+    return rows
+
+def trials_in(file_path, file_size, rows):
+    # Trust the manifest only while the file still has the size it was written with
+    recorded = rows.get(os.path.normpath(file_path))
+    if recorded is not None and recorded[0] == file_size:
+        return recorded[1]
+    return count_trials_in_txt(file_path)
+
 def main():
     if not os.path.exists(TXT_DIR):
         print(f"\033[91mError: Directory {TXT_DIR} does not exist.\033[0m")
         return
     
     txt_files = find_txt_files(TXT_DIR)
+    rows = manifest_rows(TXT_DIR)
     large_files = [f for f in txt_files if f[1] > MAX_SIZE_MB * 1024 * 1024]
     
     print("\033[93mAll .txt files and their sizes:\033[0m")
     for file_path, file_size in txt_files:
         relative_path = os.path.relpath(file_path, BASE_DIR)
         formatted_size = format_size(file_size)
-        trials_count = count_trials_in_txt(file_path)
+        trials_count = trials_in(file_path, file_size, rows)
         print(f"\033[94m{relative_path}\033[0m: \033[96m{formatted_size}\033[0m, \033[92m{trials_count} trials\033[0m")
     
     if large_files:
@@ -49,7 +69,7 @@ def main():
         for file_path, file_size in large_files:
             relative_path = os.path.relpath(file_path, BASE_DIR)
             formatted_size = format_size(file_size)
-            trials_count = count_trials_in_txt(file_path)
+            trials_count = trials_in(file_path, file_size, rows)
             print(f"\033[94m{relative_path}\033[0m: \033[96m{formatted_size}\033[0m, \033[92m{trials_count} trials\033[0m")
     else:
         print(f"\n\033[92mNo files larger than {MAX_SIZE_MB}MB found.\033[0m")
@@ -0,0 +1,79 @@
+# ******** Part of Tools ******
+import os
+import hashlib
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_PERSIST_DIR = os.path.join(BASE_DIR, 'data', 'vector_store')
+COLLECTION_NAME = "clinical_trials"
+ADD_BATCH_SIZE = 500  # Documents per add_texts call (one embedding request batch each)
+GET_BATCH_SIZE = 5000  # Ids per existence lookup
+TEXT_HASH_KEY = "text_sha256"  # Metadata key holding the hash of the stored text
+
+# ANSI escape codes
+GREEN = "\033[92m"
+RESET = "\033[0m"
+
+def document_id(nct_id, text):
+    """Stable Chroma id: the NCTId, or a hash of the text for a document without one."""
+    return nct_id or "sha256:" + text_hash(text)
+
+def clean_metadata(metadata):
+    """Chroma metadata values must be str, int, float or bool; lists are joined and None is dropped."""
+    cleaned = {}
+    for key, value in metadata.items():
+        if hasattr(value, "tolist"):  # NumPy arrays from Parquet columns
+            value = value.tolist()
+        if isinstance(value, (list, tuple)):
+            value = "; ".join(str(item) for item in value)
+        if value is not None:
+            cleaned[key] = value
+    return cleaned
+
+def open_collection(embedding_function, persist_directory=None, collection_name=COLLECTION_NAME):
+    """Chroma store persisted under persist_directory (reopened if it exists), or in memory when it is None."""
+    from langchain_community.vectorstores import Chroma
+    if persist_directory:
+        os.makedirs(persist_directory, exist_ok=True)
+    return Chroma(collection_name=collection_name, embedding_function=embedding_function,
+                  persist_directory=persist_directory)
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def stored_hashes(store, ids, batch_size=GET_BATCH_SIZE):
+    """{id: text hash} of the ids already in the collection; the hash is None for documents stored without one."""
+    found = {}
+    for start in range(0, len(ids), batch_size):
+        result = store.get(ids=ids[start:start + batch_size], include=["metadatas"])
+        for doc_id, metadata in zip(result["ids"], result["metadatas"]):
+            found[doc_id] = (metadata or {}).get(TEXT_HASH_KEY)
+    return found
+
+def add_missing_documents(store, documents, batch_size=ADD_BATCH_SIZE):
+    """Add the documents that are not in the collection yet and replace those whose text changed, batch_size at a time.
+
+    documents: dicts with "id", "text" and "metadata". The hash of each text is stored in its metadata, so a
+    changed document is deleted and added again. Returns the number of documents added or replaced.
+    """
+    unique = {}
+    for document in documents:
+        unique.setdefault(document["id"], document)
+    present = stored_hashes(store, list(unique))
+    changed = [doc_id for doc_id, stored_hash in present.items() if stored_hash != text_hash(unique[doc_id]["text"])]
+    missing = [document for doc_id, document in unique.items() if doc_id not in present]
+    print(f"{GREEN}{len(present) - len(changed)} documents unchanged, replacing {len(changed)}, adding {len(missing)}{RESET}")
+    pending = missing + [unique[doc_id] for doc_id in changed]
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        # Delete the old versions right before their batch is added, so an interrupted run loses at most one batch
+        stale = [document["id"] for document in batch if document["id"] in present]
+        if stale:
+            store.delete(ids=stale)
+        store.add_texts(
+            texts=[document["text"] for document in batch],
+            metadatas=[dict(clean_metadata(document["metadata"]), **{TEXT_HASH_KEY: text_hash(document["text"])}) for document in batch],
+            ids=[document["id"] for document in batch],
+        )
+        print(f"Added {min(start + batch_size, len(pending))}/{len(pending)} documents")
+    return len(pending)
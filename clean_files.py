@@ -1,63 +1,23 @@
 # ******** Part of Process (required) ******
 import json
 import os
+import argparse
+from study_schema import extract_cleaned_study
+from parallel_clean import read_json, clean_files_parallel, DEFAULT_BATCH_SIZE
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # Define the directories
 processed_data_dir = os.path.join(BASE_DIR, 'data', 'processed')
 cleaned_data_dir = os.path.join(BASE_DIR, 'data', 'cleaned')
+cleaned_shards_dir = os.path.join(BASE_DIR, 'data', 'cleaned_shards')
 
-# Function to read and parse JSON data from a file
-def read_json(file_path):
-    with open(file_path, 'r') as file:
-        try:
-            return json.load(file)
-        except json.JSONDecodeError as e:
-            print(f"\033[91mError decoding JSON from file: {file_path}\033[0m")
-            print(e)
-            return None
-
-# Function to clean and extract necessary information from a single study
+# Function to clean and extract necessary information from a single study (fields: study_schema.CLEANED_STUDY_FIELDS)
 def clean_study_data(study):
-    cleaned_study = {}
-    
     if not isinstance(study, dict):
         print(f"\033[91mInvalid study format: {type(study)}. Expected a dictionary.\033[0m")
-        return cleaned_study
-
-    study_info = study.get("ProtocolSection", {})
-
-    # Extract necessary fields
-    cleaned_study = {
-        "BriefTitle": study_info.get("IdentificationModule", {}).get("BriefTitle", ""),
-        "BriefSummary": study_info.get("DescriptionModule", {}).get("BriefSummary", ""),
-        "EligibilityCriteria": study_info.get("EligibilityModule", {}).get("EligibilityCriteria", ""),
-        "HealthyVolunteers": study_info.get("EligibilityModule", {}).get("HealthyVolunteers", ""),
-        "Gender": study_info.get("EligibilityModule", {}).get("Gender", ""),
-        "MinimumAge": study_info.get("EligibilityModule", {}).get("MinimumAge", ""),
-        "Location": [
-            {
-                "Facility": loc.get("LocationFacility", ""),
-                "City": loc.get("LocationCity", ""),
-                "State": loc.get("LocationState", ""),
-                "Zip": loc.get("LocationZip", ""),
-                "Country": loc.get("LocationCountry", "")
-            } for loc in study_info.get("ContactsLocationsModule", {}).get("LocationList", {}).get("Location", [])
-        ],
-        "Conditions": study_info.get("ConditionsModule", {}).get("ConditionList", {}).get("Condition", []),
-        "Keywords": study_info.get("ConditionsModule", {}).get("KeywordList", {}).get("Keyword", []),
-        "Intervention": [
-            {
-                "Type": intervention.get("InterventionType", ""),
-                "Name": intervention.get("InterventionName", "")
-            } for intervention in study_info.get("ArmsInterventionsModule", {}).get("InterventionList", {}).get("Intervention", [])
-        ],
-        "NCTId": study_info.get("IdentificationModule", {}).get("NCTId", ""),
-        "MoreInfoLink": study_info.get("IdentificationModule", {}).get("SecondaryIdInfoList", {}).get("SecondaryIdInfo", [])[0].get("SecondaryIdLink", "") if study_info.get("IdentificationModule", {}).get("SecondaryIdInfoList", {}).get("SecondaryIdInfo", []) else ""
-    }
-
-    return cleaned_study
+        return {}
+    return extract_cleaned_study(study)
 
 # Function to clean and extract necessary information
 def clean_data(raw_data):
@@ -115,12 +75,28 @@ def process_all_files():
                     json.dump(cleaned_data, outfile, indent=4)
                 print(f"\033[92mSaved cleaned data to: {cleaned_file_path}\033[0m")
 
-# Ensure the cleaned data directory exists
-os.makedirs(cleaned_data_dir, exist_ok=True)
-print(f"\033[92mCreated cleaned data directory: {cleaned_data_dir}\033[0m")
+# Function to clean all files across a pool of worker processes (see parallel_clean.py)
+def process_all_files_parallel(workers=None, batch_size=DEFAULT_BATCH_SIZE, source_dir=processed_data_dir, target_dir=cleaned_data_dir, shards_dir=cleaned_shards_dir):
+    return clean_files_parallel(clean_data, source_dir, target_dir, shards_dir, workers, batch_size)
 
 # Run the processing function
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Clean the JSON files in data/processed.')
+    parser.add_argument('--parallel', action='store_true', help='Clean files across a pool of worker processes.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes (default: number of cores).')
+    parser.add_argument('--batch_size', type=int, default=DEFAULT_BATCH_SIZE, help='Number of files handed to a worker at a time.')
+    parser.add_argument('--parse_criteria', action='store_true', help='Also store the parsed eligibility criteria in each cleaned record.')
+    args = parser.parse_args()
+
+    # Ensure the cleaned data directory exists
+    os.makedirs(cleaned_data_dir, exist_ok=True)
+    print(f"\033[92mCreated cleaned data directory: {cleaned_data_dir}\033[0m")
     print("\033[92mStarting to process all files...\033[0m")
-    process_all_files()
+    if args.parallel:
+        process_all_files_parallel(args.workers, args.batch_size)
+    else:
+        process_all_files()
+    if args.parse_criteria:
+        from criteria_parser import annotate_directories
+        annotate_directories([cleaned_data_dir, cleaned_shards_dir])
     print("\033[92mFinished processing all files.\033[0m")
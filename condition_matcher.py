@@ -0,0 +1,99 @@
+# ******** Part of Tools ******
+import os
+import time
+from collections import deque
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class ConditionMatcher:
+    """Aho-Corasick automaton that finds every condition occurring in a text in a single pass.
+
+    Matching is a case-insensitive substring test, the same as `condition.lower() in text.lower()`
+    for each condition, but the cost no longer grows with the number of conditions.
+    """
+
+    def __init__(self, conditions):
+        self.conditions = list(conditions)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for condition_id, condition in enumerate(self.conditions):
+            self._add(condition.lower(), condition_id)
+        self._link()
+
+    def _add(self, pattern, condition_id):
+        node = 0
+        for char in pattern:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][char] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = next_node
+        self.output[node].append(condition_id)
+
+    def _link(self):
+        # Breadth-first so every failure target is finished before it is used
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, text):
+        """Return the set of condition indexes found in text."""
+        found = set()
+        node = 0
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        for char in text.lower():
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.update(output[node])
+        # An empty condition matches everything, like `"" in text`
+        found.update(output[0])
+        return found
+
+def collect_field_values(d, field):
+    """Gather every string stored under `field` anywhere in a nested dict/list."""
+    values = []
+    if isinstance(d, dict):
+        for key, value in d.items():
+            if key == field and isinstance(value, str):
+                values.append(value)
+            elif isinstance(value, (dict, list)):
+                values.extend(collect_field_values(value, field))
+    elif isinstance(d, list):
+        for item in d:
+            values.extend(collect_field_values(item, field))
+    return values
+
+class MatchStats:
+    """Per-condition match counts and throughput for a single-pass split."""
+
+    def __init__(self, conditions):
+        self.conditions = list(conditions)
+        self.counts = [0] * len(self.conditions)
+        self.studies = 0
+        self.start_time = time.time()
+
+    def record(self, studies, condition_ids):
+        self.studies += studies
+        for condition_id in condition_ids:
+            self.counts[condition_id] += 1
+
+    def report(self):
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        lines = [f"{condition}: {count}" for condition, count in zip(self.conditions, self.counts)]
+        lines.append(f"Scanned {self.studies} studies in {elapsed:.2f}s ({self.studies / elapsed:.0f} studies/sec)")
+        return "\n".join(lines)
@@ -1,8 +1,12 @@
 # ******** Part of Tools ******
 import os
 import json
+import argparse
+import textwrap
 import config
-import openai
+from embedding_engine import EmbeddingEngine
+from embedding_cache import EmbeddingCache
+from embedding_store import EmbeddingStoreWriter, DTYPES
 
 # Set your OpenAI API key here
 os.environ["OPENAI_API_KEY"] = config.APIKEY
@@ -15,6 +19,7 @@ embeddings_output_dir = os.path.join(BASE_DIR, 'data', 'embeddings')
 os.makedirs(embeddings_output_dir, exist_ok=True)
 
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 20 MB in bytes
+EMBEDDED_FIELDS = ["BriefTitle", "BriefSummary", "Conditions", "Keywords"]
 
 # Function to read and parse JSON data from a file
 def read_json(file_path):
@@ -26,35 +31,42 @@ def read_json(file_path):
             print(e)
             return None
 
-# Function to generate embeddings
-def generate_embedding(text):
-    try:
-        response = openai.Embedding.create(
-            model="text-embedding-ada-002",
-            input=text
-        )
-        embedding = response['data'][0]['embedding']
-        return embedding
-    except Exception as e:
-        print(f"Error generating embedding for text: {text}")
-        print(e)
-        return None
-
-# Function to recursively search for BriefTitle in nested dictionaries
-def find_brief_title(data):
+# Function to collect the studies (dicts with a BriefTitle) in a cleaned file
+def find_studies(data):
     if isinstance(data, dict):
         if 'BriefTitle' in data:
-            return data['BriefTitle']
-        for key, value in data.items():
-            result = find_brief_title(value)
-            if result:
-                return result
-    elif isinstance(data, list):
+            return [data]
+        studies = []
+        for value in data.values():
+            studies.extend(find_studies(value))
+        return studies
+    if isinstance(data, list):
+        studies = []
         for item in data:
-            result = find_brief_title(item)
-            if result:
-                return result
-    return None
+            studies.extend(find_studies(item))
+        return studies
+    return []
+
+# Function to build the text that is embedded for a study
+def build_embedding_text(study):
+    parts = []
+    for field in EMBEDDED_FIELDS:
+        value = study.get(field)
+        if isinstance(value, list):
+            value = ", ".join(str(item) for item in value)
+        if value:
+            parts.append(f"{field}: {value}")
+    return "\n".join(parts)
+
+# Function to save one JSON file of embeddings and report its size
+def save_embeddings_json(output_file_path, serialized_embeddings):
+    with open(output_file_path, 'w') as outfile:
+        outfile.write("[\n" + ",\n".join(serialized_embeddings) + "\n]")
+    file_size = os.path.getsize(output_file_path)
+    print(f"Saved embeddings to: {output_file_path}")
+    print(f"File size: {file_size} bytes")
+    if file_size > MAX_FILE_SIZE:
+        print(f"Error: File size {file_size} exceeds 20 MB for {output_file_path}")
 
 # Function to write embeddings to file ensuring no file exceeds the maximum size
 def write_embeddings_to_file(directory_name, filename_suffix, embeddings):
@@ -63,43 +75,47 @@ def write_embeddings_to_file(directory_name, filename_suffix, embeddings):
     current_size = 0
 
     for embedding in embeddings:
-        embedding_size = len(json.dumps(embedding).encode('utf-8'))
+        # Serialise each entry once (as json.dump(..., indent=4) would lay it out) and reuse it for the write
+        serialized = textwrap.indent(json.dumps(embedding, indent=4), "    ")
+        embedding_size = len(serialized.encode('utf-8')) + 2
         
-        if current_size + embedding_size > MAX_FILE_SIZE:
+        if current_embeddings and current_size + embedding_size > MAX_FILE_SIZE:
             output_file_path = os.path.join(embeddings_output_dir, f'{directory_name}_embeddings_{filename_suffix}_{file_count}.json')
-            with open(output_file_path, 'w') as outfile:
-                json.dump(current_embeddings, outfile, indent=4)
-            print(f"Saved embeddings to: {output_file_path}")
-            print(f"File size: {os.path.getsize(output_file_path)} bytes")
-
-            if os.path.getsize(output_file_path) > MAX_FILE_SIZE:
-                print(f"Error: File size {os.path.getsize(output_file_path)} exceeds 20 MB for {output_file_path}")
-
+            save_embeddings_json(output_file_path, current_embeddings)
             file_count += 1
             current_embeddings = []
             current_size = 0
         
-        current_embeddings.append(embedding)
+        current_embeddings.append(serialized)
         current_size += embedding_size
 
     if current_embeddings:
         output_file_path = os.path.join(embeddings_output_dir, f'{directory_name}_embeddings_{filename_suffix}_{file_count}.json')
-        with open(output_file_path, 'w') as outfile:
-            json.dump(current_embeddings, outfile, indent=4)
-        print(f"Saved embeddings to: {output_file_path}")
-        print(f"File size: {os.path.getsize(output_file_path)} bytes")
-
-        if os.path.getsize(output_file_path) > MAX_FILE_SIZE:
-            print(f"Error: File size {os.path.getsize(output_file_path)} exceeds 20 MB for {output_file_path}")
+        save_embeddings_json(output_file_path, current_embeddings)
+
+# Function to write embeddings to a binary store: .npy shards plus a Parquet sidecar of NCTId/file/title
+def write_embeddings_to_store(directory_name, filename_suffix, records, embeddings, dtype="float32"):
+    store_dir = os.path.join(embeddings_output_dir, f'{directory_name}_embeddings_{filename_suffix}')
+    writer = EmbeddingStoreWriter(store_dir, dtype)
+    writer.add(records, embeddings)
+    info = writer.close()
+    store_size = sum(os.path.getsize(os.path.join(store_dir, name)) for name in os.listdir(store_dir))
+    print(f"Saved {info['rows']} {dtype} embeddings to: {store_dir} ({store_size} bytes)")
+    return store_dir
 
 # Function to process all files in the processed data directory
-def process_all_files(limit_files):
+def process_all_files(limit_files, engine=None, cache=None, output_format="npy", dtype="float32"):
+    engine = engine or EmbeddingEngine()
+    # Only text that is not in the cache yet is sent to the API
+    cache = cache or EmbeddingCache()
     for subdir, _, files in os.walk(processed_data_dir):
-        all_embeddings = []
         directory_name = os.path.basename(subdir)
         
         files_to_process = files[:10] if limit_files else files
         
+        # Gather every study in the directory first so the engine can pack them into large batches
+        records = []
+        texts = []
         for file in files_to_process:
             file_path = os.path.join(subdir, file)
             if file.endswith('.json'):  # Ensure the file is a JSON file
@@ -108,31 +124,57 @@ def process_all_files(limit_files):
                 if raw_json is None:
                     continue
 
-                brief_title = find_brief_title(raw_json)
-                if brief_title:
-                    print(f"Found BriefTitle: {brief_title}")
-                    
-                    embedding = generate_embedding(brief_title)
-                    if embedding:
-                        all_embeddings.append({
-                            "file": file_path,
-                            "BriefTitle": brief_title,
-                            "embedding": embedding
-                        })
-                else:
+                studies = find_studies(raw_json)
+                if not studies:
                     print(f"No BriefTitle found in file: {file_path}")
+                for study in studies:
+                    records.append({
+                        "file": file_path,
+                        "NCTId": study.get("NCTId"),
+                        "BriefTitle": study.get("BriefTitle"),
+                    })
+                    texts.append(build_embedding_text(study))
+
+        if not records:
+            continue
+
+        print(f"Embedding {len(texts)} studies from {directory_name}...")
+        try:
+            embeddings = cache.embed(texts, engine.embed, engine.model)
+        except Exception as e:
+            print(f"Error generating embeddings for directory: {subdir}")
+            print(e)
+            continue
+        print(f"Embedding cache: {cache.stats['hits']} hits, {cache.stats['misses']} misses")
+        # Studies of a failed request have no embedding; keep the rest of the directory
+        kept = [index for index, embedding in enumerate(embeddings) if embedding is not None]
+        if len(kept) < len(records):
+            print(f"\033[91mSkipped {len(records) - len(kept)} studies from {directory_name} whose embedding request failed\033[0m")
+            records = [records[index] for index in kept]
+            embeddings = [embeddings[index] for index in kept]
+        if not records:
+            continue
+        filename_suffix = "first10" if limit_files else "all"
+        if output_format == "npy":
+            write_embeddings_to_store(directory_name, filename_suffix, records, embeddings, dtype)
+            continue
 
         # Write embeddings to file, ensuring no file exceeds the maximum size
-        filename_suffix = "first10" if limit_files else "all"
+        all_embeddings = [dict(record, embedding=embedding.tolist()) for record, embedding in zip(records, embeddings)]
         write_embeddings_to_file(directory_name, filename_suffix, all_embeddings)
 
 # Run the processing function
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate embeddings for the cleaned clinical trials.')
+    parser.add_argument('--format', choices=['npy', 'json'], default='npy', help='Binary .npy shards with a Parquet sidecar (default) or the previous JSON files.')
+    parser.add_argument('--dtype', choices=DTYPES, default='float32', help='Storage type of the .npy shards; float16 and int8 trade precision for size.')
+    args = parser.parse_args()
+
     print("Do you want to process the first 10 files or all files?")
     choice = input("Enter '10' for first 10 files or 'all' for all files: ").strip().lower()
     
     limit_files = (choice == '10')
     
     print("Starting to process all files...")
-    process_all_files(limit_files)
+    process_all_files(limit_files, output_format=args.format, dtype=args.dtype)
     print("Finished processing all files.")
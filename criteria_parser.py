@@ -0,0 +1,320 @@
+# ******** Part of Process ******
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SOURCE_DIR = os.path.join(BASE_DIR, 'data', 'cleaned')
+DEFAULT_CACHE_DIR = os.path.join(BASE_DIR, 'data', 'criteria_cache')
+CACHE_FILE = "criteria.sqlite"
+PARSED_FIELD = "EligibilityParsed"
+RENDERED_FIELD = "criteria_text"  # criteria_text() of the parse, stored with it so documents read it as a column
+PARSER_VERSION = 2  # Part of the content hash, so a parser change re-parses every trial
+LOOKUP_CHUNK = 500  # Hashes per SQLite IN (...) query
+WINDOW = 80  # Characters after a measure that its comparison is looked for in
+
+HEADER_PATTERN = re.compile(r"^\s*(?:key\s+|main\s+|major\s+)?(inclusion|exclusion)\s+criteri(?:a|on)\b[^:\n]{0,40}?(?::|$)", re.IGNORECASE)
+BULLET_PATTERN = re.compile(r"^\s*(?:[-*•·▪◦–]|\(?\d{1,2}[.)]|\(?[a-z][.)](?=\s))\s*", re.IGNORECASE)
+NUMBER = r"(?<![\w.])(\d+(?:\.\d+)?)"  # Not the digits of a unit or name such as kg/m2 or HbA1c
+NUMBER_PATTERN = re.compile(NUMBER)
+TIME_UNIT_PATTERN = re.compile(r"\s*(day|week|month|year)s?\b", re.IGNORECASE)
+DAYS_PER_UNIT = {"day": 1, "week": 7, "month": 30.4375, "year": 365.25}
+UNIT = r"(?:\s*(?:%|kg/m2|kg/m²|ml/min(?:/1\.73\s?m2)?|(?:day|week|month|year)s?))?"
+# A measure's regex and its unit; ages and life expectancies written in other time units are converted
+MEASURES = {
+    "age": (r"\bage[ds]?\b|\byears? of age\b|\byears? old\b|\byears? (?:or|and) (?:older|over|above|younger)\b", "years"),
+    "bmi": (r"\bbmi\b|\bbody mass index\b", "kg/m2"),
+    "hba1c": (r"\bhb\s?a1c\b|\bh(?:a)?emoglobin a1c\b|\bglycated h(?:a)?emoglobin\b|\ba1c\b", "%"),
+    "egfr": (r"\begfr\b|\bestimated glomerular filtration rate\b", "mL/min/1.73m2"),
+    "creatinine_clearance": (r"\bcreatinine clearance\b|\bcrcl\b", "mL/min"),
+    "ecog": (r"\becog\b", ""),
+    "karnofsky": (r"\bkarnofsky\b|\bkps\b", "%"),
+    "life_expectancy": (r"\blife expectancy\b", "months"),
+}
+MEASURE_PATTERNS = {name: re.compile(pattern, re.IGNORECASE) for name, (pattern, _) in MEASURES.items()}
+ANY_MEASURE_PATTERN = re.compile("|".join(pattern for pattern, _ in MEASURES.values()), re.IGNORECASE)
+# Where a measure's comparison ends: the mention of any other measure
+OTHER_MEASURE_PATTERNS = {
+    name: re.compile("|".join(pattern for other, (pattern, _) in MEASURES.items() if other != name), re.IGNORECASE)
+    for name in MEASURES
+}
+# (bound, inclusive, pattern); a range or list ("18 to 65", "0, 1 or 2") gives both bounds
+COMPARISONS = [
+    ("range", True, re.compile(rf"(?:between\s+|from\s+)?{NUMBER}{UNIT}(?:\s*(?:-|–|to|and|or|,)\s*{NUMBER}{UNIT})+", re.IGNORECASE)),
+    ("min", True, re.compile(rf"(?:>=|≥|=>|≧|at least|greater than or equal to|no less than|not less than|minimum(?: of)?)\s*{NUMBER}", re.IGNORECASE)),
+    ("min", False, re.compile(rf"(?:>|greater than|more than|above|over|exceeding|older than)\s*{NUMBER}", re.IGNORECASE)),
+    ("max", True, re.compile(rf"(?:<=|≤|=<|≦|at most|less than or equal to|no more than|not more than|up to|maximum(?: of)?)\s*{NUMBER}", re.IGNORECASE)),
+    ("max", False, re.compile(rf"(?:<|less than|below|under|younger than)\s*{NUMBER}", re.IGNORECASE)),
+    ("min", True, re.compile(rf"{NUMBER}{UNIT}(?:\s+of age|\s+old)?\s*(?:or|and)\s+(?:older|over|above|greater|higher|more)\b", re.IGNORECASE)),
+    ("max", True, re.compile(rf"{NUMBER}{UNIT}(?:\s+of age|\s+old)?\s*(?:or|and)\s+(?:younger|under|below|less|lower|fewer)\b", re.IGNORECASE)),
+]
+
+def criteria_hash(text):
+    """Content hash of a criteria text, including the parser version."""
+    return hashlib.sha256(f"{PARSER_VERSION}\n{text or ''}".encode('utf-8')).hexdigest()
+
+def split_criteria(text):
+    """(section, item) pairs: one per bullet or paragraph, under the latest Inclusion/Exclusion header.
+
+    Items before any header count as inclusion criteria.
+    """
+    items = []
+    section = "inclusion"
+    current = None
+    blank = False
+    for line in (text or "").splitlines():
+        header = HEADER_PATTERN.match(line)
+        if header:
+            section = header.group(1).lower()
+            line = line[header.end():]
+            current = None
+        if not line.strip():
+            blank = True
+            continue
+        bullet = BULLET_PATTERN.match(line)
+        if bullet or current is None or blank or not (line[0].isspace() or line.lstrip()[0].islower()):
+            # A bullet, a new paragraph or an unindented line starts an item; indented or lower-case lines continue it
+            current = [section, line[bullet.end():].strip() if bullet else line.strip()]
+            items.append(current)
+        else:
+            current[1] += " " + line.strip()
+        blank = False
+    return [(section, item) for section, item in items if item]
+
+def comparison(window):
+    """The first comparison in window as [min, max, min_inclusive, max_inclusive, min_end, max_end], or None.
+
+    min_end and max_end are where the number of each bound ends, so its unit can be read after it.
+    """
+    found = [(match.start(), bound, inclusive, match) for bound, inclusive, pattern in COMPARISONS
+             for match in [pattern.search(window)] if match]
+    if not found:
+        return None
+    _, bound, inclusive, match = min(found, key=lambda item: item[0])
+    if bound == "range":
+        numbers = [(float(number.group(1)), number.end() + match.start()) for number in NUMBER_PATTERN.finditer(match.group(0))]
+        low, high = numbers[0], numbers[-1]
+        return [low[0], high[0], True, True, low[1], high[1]]
+    if bound == "min":
+        return [float(match.group(1)), None, inclusive, None, match.end(1), None]
+    return [None, float(match.group(1)), None, inclusive, None, match.end(1)]
+
+def time_in_unit(value, text, position, unit, default_unit):
+    """value converted to unit ('years' or 'months') from the time unit written after position (else default_unit)."""
+    written = TIME_UNIT_PATTERN.match(text, position) if position is not None else None
+    written = written.group(1).lower() if written else default_unit
+    return round(value * DAYS_PER_UNIT[written] / DAYS_PER_UNIT[unit.rstrip("s")], 4)
+
+def extract_constraints(item, section):
+    """Numeric constraints (age, BMI, HbA1c, eGFR, ECOG, ...) stated in one criteria item."""
+    constraints = []
+    if not ANY_MEASURE_PATTERN.search(item):
+        # Most items mention no measure; one combined search skips them
+        return constraints
+    for name, pattern in MEASURE_PATTERNS.items():
+        mention = pattern.search(item)
+        if not mention:
+            continue
+        after = item[mention.end():mention.end() + WINDOW]
+        # Stop at the next clause or the next measure, so "age >= 18; BMI < 30" gives age no upper bound
+        stop = re.search(r";", after)
+        other = OTHER_MEASURE_PATTERNS[name].search(after)
+        end = min(match.start() for match in (stop, other, re.search(r"$", after)) if match)
+        window = after[:end]
+        if name == "age" and "year" in mention.group(0).lower():
+            # "18 to 65 years of age": the numbers come before the measure
+            start = max(item.rfind(";", 0, mention.start()) + 1, mention.start() - 40)
+            window = item[start:mention.end()] + window
+        result = comparison(window)
+        if result is None:
+            continue
+        low, high, low_inclusive, high_inclusive, low_end, high_end = result
+        if low is None or high is None:
+            # "HbA1c >= 7.0% and <= 10.5%": a second one-sided comparison adds the other bound
+            end = low_end if high is None else high_end
+            second = comparison(window[end:])
+            if second and low is None and second[0] is not None and second[1] is None:
+                low, low_inclusive, low_end = second[0], second[2], second[4] + end
+            elif second and high is None and second[1] is not None and second[0] is None:
+                high, high_inclusive, high_end = second[1], second[3], second[5] + end
+        unit = MEASURES[name][1]
+        if name in ("age", "life_expectancy"):
+            # A unit written only after the upper bound ("18 to 65 years") applies to both
+            high_unit = TIME_UNIT_PATTERN.match(window, high_end) if high is not None else None
+            default_unit = high_unit.group(1).lower() if high_unit else unit.rstrip("s")
+            if low is not None:
+                low = time_in_unit(low, window, low_end, unit, default_unit)
+            if high is not None:
+                high = time_in_unit(high, window, high_end, unit, default_unit)
+        constraints.append({
+            "measure": name, "min": low, "max": high, "min_inclusive": low_inclusive, "max_inclusive": high_inclusive,
+            "unit": unit, "section": section, "text": item,
+        })
+    return constraints
+
+def parse_criteria(text):
+    """Inclusion and exclusion items of an EligibilityCriteria text and the numeric constraints they state."""
+    parsed = {"inclusion": [], "exclusion": [], "constraints": []}
+    for section, item in split_criteria(text):
+        parsed[section].append(item)
+        parsed["constraints"].extend(extract_constraints(item, section))
+    return parsed
+
+class CriteriaCache:
+    """Parsed criteria keyed by content hash in SQLite, so a text is parsed once whichever trial or file it is in."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(cache_dir, CACHE_FILE))
+        self.db.execute("CREATE TABLE IF NOT EXISTS criteria (content_hash TEXT PRIMARY KEY, parsed TEXT NOT NULL)")
+        self.db.commit()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def parse_many(self, texts):
+        """Parsed structure for each text, parsing and storing only the texts not cached yet."""
+        texts = list(texts)
+        hashes = [criteria_hash(text) for text in texts]
+        found = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique_hashes), LOOKUP_CHUNK):
+            chunk = unique_hashes[start:start + LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            for key, parsed in self.db.execute(f"SELECT content_hash, parsed FROM criteria WHERE content_hash IN ({placeholders})", chunk):
+                found[key] = json.loads(parsed)
+        new = {}
+        for key, text in zip(hashes, texts):
+            if key not in found and key not in new:
+                new[key] = parse_criteria(text)
+        self.stats["hits"] += len(texts) - len(new)
+        self.stats["misses"] += len(new)
+        if new:
+            self.db.executemany("INSERT OR IGNORE INTO criteria (content_hash, parsed) VALUES (?, ?)",
+                                [(key, json.dumps(parsed)) for key, parsed in new.items()])
+            self.db.commit()
+            found.update(new)
+        return [found[key] for key in hashes]
+
+    def close(self):
+        self.db.close()
+
+def parsed_criteria(study, cache=None):
+    """The study's parsed criteria: the stored parse while it matches the text, else parsed now (through cache if given)."""
+    text = study.get("EligibilityCriteria") or ""
+    stored = study.get(PARSED_FIELD)
+    if stored and stored.get("hash") == criteria_hash(text):
+        return stored
+    return stored_parse(cache.parse_many([text])[0] if cache else parse_criteria(text), text)
+
+def format_constraint(constraint):
+    """'age 18-65 years', 'egfr > 45 mL/min/1.73m2', 'ecog <= 2'."""
+    low, high = constraint["min"], constraint["max"]
+    if low is not None and high is not None:
+        bounds = f"{low:g}-{high:g}"
+    elif low is not None:
+        bounds = f"{'>' if constraint['min_inclusive'] is False else '>='} {low:g}"
+    else:
+        bounds = f"{'<' if constraint['max_inclusive'] is False else '<='} {high:g}"
+    return " ".join(part for part in (constraint["measure"].replace("_", " "), bounds, constraint["unit"]) if part)
+
+def criteria_text(parsed, max_items=None):
+    """Compact text of a parse for prompts and documents: the numeric limits, then the inclusion and exclusion items."""
+    lines = []
+    for label, section in (("Requires", "inclusion"), ("Excludes", "exclusion")):
+        limits = [format_constraint(c) for c in parsed["constraints"] if c["section"] == section]
+        if limits:
+            lines.append(f"{label}: " + "; ".join(limits))
+    for label, section in (("Inclusion", "inclusion"), ("Exclusion", "exclusion")):
+        items = parsed[section][:max_items]
+        if items:
+            more = len(parsed[section]) - len(items)
+            lines.append(f"{label}: " + "; ".join(items) + (f"; (+{more} more)" if more else ""))
+    return "\n".join(lines)
+
+def stored_parse(parsed, text):
+    """The parse as it is stored in a record: with the hash of its text and its full criteria_text rendering."""
+    return dict(parsed, hash=criteria_hash(text), **{RENDERED_FIELD: criteria_text(parsed)})
+
+def rendered_criteria(study, cache=None):
+    """criteria_text() of the study's parse, taken from the stored parse while it is current."""
+    return parsed_criteria(study, cache)[RENDERED_FIELD]
+
+def annotate_studies(studies, cache):
+    """Add or refresh the parsed criteria of each study in place; returns how many studies changed."""
+    stale = [study for study in studies
+             if (study.get(PARSED_FIELD) or {}).get("hash") != criteria_hash(study.get("EligibilityCriteria") or "")]
+    for study, parsed in zip(stale, cache.parse_many(study.get("EligibilityCriteria") or "" for study in stale)):
+        study[PARSED_FIELD] = stored_parse(parsed, study.get("EligibilityCriteria") or "")
+    return len(stale)
+
+def annotate_directory(source_dir=DEFAULT_SOURCE_DIR, cache=None):
+    """Store parsed criteria next to the text in every cleaned record (_cleaned.json files and JSONL shards).
+
+    Files whose records are all up to date are not rewritten.
+    """
+    cache = cache or CriteriaCache()
+    counts = {"files": 0, "rewritten": 0, "studies": 0, "parsed": 0}
+    for root, _, files in os.walk(source_dir):
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            if file.endswith('.jsonl'):
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    studies = [json.loads(line) for line in f if line.strip()]
+            elif file.endswith('_cleaned.json'):
+                with open(file_path, 'r') as f:
+                    try:
+                        studies = json.load(f)
+                    except json.JSONDecodeError as e:
+                        print(f"\033[91mError decoding JSON from file: {file_path}\033[0m")
+                        print(e)
+                        continue
+                if not isinstance(studies, list):
+                    continue
+            else:
+                continue
+            counts["files"] += 1
+            counts["studies"] += len(studies)
+            changed = annotate_studies(studies, cache)
+            if not changed:
+                continue
+            counts["parsed"] += changed
+            counts["rewritten"] += 1
+            with open(file_path + ".tmp", 'w', encoding='utf-8') as f:
+                if file.endswith('.jsonl'):
+                    f.writelines(json.dumps(study) + "\n" for study in studies)
+                else:
+                    json.dump(studies, f, indent=4)
+            os.replace(file_path + ".tmp", file_path)
+    return counts
+
+def annotate_directories(directories, cache_dir=DEFAULT_CACHE_DIR):
+    """Pipeline stage: annotate the cleaned files and shards of one pipeline, sharing one parse cache."""
+    cache = CriteriaCache(cache_dir)
+    try:
+        for directory in directories:
+            counts = annotate_directory(directory, cache)
+            print(f"\033[92mParsed criteria for {counts['parsed']} of {counts['studies']} studies in {directory}\033[0m")
+    finally:
+        cache.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Parse the eligibility criteria of the cleaned studies into inclusion/exclusion items and numeric constraints.')
+    parser.add_argument('--source_dir', default=DEFAULT_SOURCE_DIR, help='Cleaned studies to annotate in place.')
+    parser.add_argument('--cache_dir', default=DEFAULT_CACHE_DIR, help='Directory of the parse cache.')
+    parser.add_argument('--text', help='Print the parse of this criteria text instead of annotating files.')
+    args = parser.parse_args()
+
+    if args.text:
+        print(json.dumps(parse_criteria(args.text.replace("\\n", "\n")), indent=4))
+    else:
+        cache = CriteriaCache(args.cache_dir)
+        start_time = time.time()
+        counts = annotate_directory(args.source_dir, cache)
+        cache.close()
+        print(f"\033[92mParsed criteria for {counts['parsed']} of {counts['studies']} studies "
+              f"({cache.stats['misses']} new texts), rewrote {counts['rewritten']} of {counts['files']} files "
+              f"in {time.time() - start_time:.1f}s\033[0m")
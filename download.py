@@ -1,9 +1,22 @@
 # ******** Part of Process (not required) ******
 import os
+import sys
+import json
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 from tqdm import tqdm  # tqdm is a progress bar library
 
+DEFAULT_SEGMENTS = 8
+SEGMENT_SIZE = 16 * 1024 * 1024  # 16 MB per ranged request
+CHUNK_SIZE = 1024 * 1024  # 1 MB reads from the socket
+NOT_MODIFIED_EXIT_CODE = 100  # Lets scripts/cronjob.sh skip the later stages
+
 def download_zip(zip_url, dest_dir):
     # Ensure the destination directory exists
     os.makedirs(dest_dir, exist_ok=True)
@@ -15,16 +28,16 @@ def download_zip(zip_url, dest_dir):
         # Stream the download to avoid loading the entire file into memory
         response = requests.get(zip_url, stream=True)
         response.raise_for_status()  # Raise an error if the request was unsuccessful
-        
+
         # Get the total file size from the headers
         total_size = int(response.headers.get('content-length', 0))
-        
+
         # Create a progress bar using tqdm
         with tqdm(total=total_size, unit='B', unit_scale=True, desc=zip_file_path, ascii=True) as pbar:
             # Open the file to write the downloaded content
             with open(zip_file_path, 'wb') as file:
                 # Download the file in chunks
-                for chunk in response.iter_content(chunk_size=1024):
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
                     if chunk:  # Filter out keep-alive chunks
                         file.write(chunk)
                         # Update the progress bar
@@ -36,12 +49,275 @@ def download_zip(zip_url, dest_dir):
 
     return zip_file_path
 
+def create_session(pool_size=DEFAULT_SEGMENTS):
+    """Create a requests session whose connection pool can serve one connection per segment."""
+    session = requests.Session()
+    retries = Retry(total=5, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("HEAD", "GET"))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def manifest_path_for(zip_file_path):
+    return zip_file_path + ".parts.json"
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, 'r') as file:
+            return json.load(file)
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"Ignoring unreadable manifest {manifest_path}: {e}")
+        return None
+
+def save_manifest(manifest, manifest_path):
+    # Write to a temporary file first so an interrupted run never leaves a half-written manifest
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=4)
+    os.replace(tmp_path, manifest_path)
+
+def metadata_path_for(zip_file_path):
+    return zip_file_path + ".meta.json"
+
+def load_metadata(zip_file_path):
+    """Return the validators saved for the last complete download, or None."""
+    return load_manifest(metadata_path_for(zip_file_path))
+
+def save_metadata(zip_file_path, remote):
+    metadata = {
+        "url": remote["url"],
+        "etag": remote["etag"],
+        "last_modified": remote["last_modified"],
+        "content_length": remote["size"],
+    }
+    save_manifest(metadata, metadata_path_for(zip_file_path))
+    return metadata
+
+def remote_unchanged(remote, metadata):
+    """Decide whether the upstream archive matches the one we already have."""
+    if remote["not_modified"]:
+        return True
+    # Some servers ignore conditional headers on HEAD, so compare the validators ourselves
+    if remote["etag"] and metadata.get("etag"):
+        return remote["etag"] == metadata["etag"]
+    if remote["last_modified"] and metadata.get("last_modified"):
+        return remote["last_modified"] == metadata["last_modified"] and remote["size"] == metadata.get("content_length")
+    return False
+
+def plan_segments(total_size, segment_size=SEGMENT_SIZE):
+    """Split [0, total_size) into inclusive (start, end) byte ranges."""
+    return [(start, min(start + segment_size, total_size) - 1) for start in range(0, total_size, segment_size)]
+
+def probe_remote(session, zip_url, metadata=None):
+    """Return the size, validators and range support advertised by the server.
+
+    When metadata from a previous download is given the HEAD request is made conditional.
+    """
+    headers = {}
+    if metadata:
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
+    response = session.head(zip_url, headers=headers, allow_redirects=True)
+    response.raise_for_status()
+    return {
+        "not_modified": response.status_code == 304,
+        "url": response.url,
+        "size": int(response.headers.get('content-length', 0)),
+        "etag": response.headers.get('etag', ""),
+        "last_modified": response.headers.get('last-modified', ""),
+        "accept_ranges": response.headers.get('accept-ranges', "").lower() == "bytes",
+    }
+
+def fetch_segment(session, zip_url, zip_file_path, start, end, etag, pbar):
+    """Download one byte range into place and return its SHA-256."""
+    headers = {"Range": f"bytes={start}-{end}"}
+    if etag:
+        # If the archive changes under us the server answers 200 with the full body instead of 206
+        headers["If-Range"] = etag
+    digest = hashlib.sha256()
+    with session.get(zip_url, headers=headers, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise IOError(f"Server ignored range {start}-{end} (status {response.status_code})")
+        written = 0
+        with open(zip_file_path, 'r+b') as file:
+            file.seek(start)
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if chunk:
+                    file.write(chunk)
+                    digest.update(chunk)
+                    written += len(chunk)
+                    pbar.update(len(chunk))
+    if written != end - start + 1:
+        raise IOError(f"Segment {start}-{end} is short: got {written} bytes")
+    return digest.hexdigest()
+
+def verify_segments(zip_file_path, manifest):
+    """Re-hash every segment on disk; return the bad segment indexes and the whole-file SHA-256."""
+    whole = hashlib.sha256()
+    bad_segments = []
+    with open(zip_file_path, 'rb') as file:
+        for index, (start, end) in enumerate(manifest["segments"]):
+            segment = hashlib.sha256()
+            remaining = end - start + 1
+            file.seek(start)
+            while remaining > 0:
+                chunk = file.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                segment.update(chunk)
+                whole.update(chunk)
+                remaining -= len(chunk)
+            if remaining or manifest["completed"].get(str(index)) != segment.hexdigest():
+                bad_segments.append(index)
+    return bad_segments, whole.hexdigest()
+
+def download_zip_ranged(zip_url, dest_dir, segments=DEFAULT_SEGMENTS, segment_size=SEGMENT_SIZE, expected_sha256=None, session=None):
+    """Download AllAPIJSON.zip as parallel HTTP Range requests, resuming from the sidecar manifest.
+
+    Falls back to download_zip when the server does not support byte ranges.
+    Returns the path to the zip file, or None if the download could not be completed.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    zip_file_path = os.path.join(dest_dir, "AllAPIJSON.zip")
+    manifest_path = manifest_path_for(zip_file_path)
+    session = session or create_session(segments)
+
+    try:
+        remote = probe_remote(session, zip_url)
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to download: {e}")
+        return None
+
+    if not remote["accept_ranges"] or remote["size"] == 0:
+        print("Server does not support range requests; falling back to a single stream.")
+        download_zip(zip_url, dest_dir)
+        if not os.path.exists(zip_file_path) or (remote["size"] and os.path.getsize(zip_file_path) != remote["size"]):
+            return None
+        save_metadata(zip_file_path, remote)
+        return zip_file_path
+
+    manifest = load_manifest(manifest_path)
+    if (manifest is None or manifest.get("size") != remote["size"] or manifest.get("etag") != remote["etag"]
+            or manifest.get("segment_size") != segment_size or not os.path.exists(zip_file_path)
+            or os.path.getsize(zip_file_path) != remote["size"]):
+        # Nothing usable to resume from: start a fresh manifest and preallocate the file
+        manifest = {
+            "url": zip_url,
+            "size": remote["size"],
+            "etag": remote["etag"],
+            "last_modified": remote["last_modified"],
+            "segment_size": segment_size,
+            "segments": plan_segments(remote["size"], segment_size),
+            "completed": {},
+        }
+        with open(zip_file_path, 'wb') as file:
+            file.truncate(remote["size"])
+        save_manifest(manifest, manifest_path)
+    else:
+        print(f"Resuming download: {len(manifest['completed'])}/{len(manifest['segments'])} segments already complete.")
+
+    manifest_lock = threading.Lock()
+
+    def run_pending(pbar):
+        pending = [index for index in range(len(manifest["segments"])) if str(index) not in manifest["completed"]]
+        failures = 0
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            futures = {
+                executor.submit(fetch_segment, session, remote["url"], zip_file_path, *manifest["segments"][index], remote["etag"], pbar): index
+                for index in pending
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    segment_digest = future.result()
+                except (requests.exceptions.RequestException, IOError) as e:
+                    failures += 1
+                    print(f"Segment {index} failed: {e}")
+                    continue
+                with manifest_lock:
+                    manifest["completed"][str(index)] = segment_digest
+                    save_manifest(manifest, manifest_path)
+        return failures
+
+    print(f"Starting download from {zip_url} to {zip_file_path} using {segments} connections")
+    done_bytes = sum(manifest["segments"][int(index)][1] - manifest["segments"][int(index)][0] + 1 for index in manifest["completed"])
+    with tqdm(total=remote["size"], initial=done_bytes, unit='B', unit_scale=True, desc=zip_file_path, ascii=True) as pbar:
+        if run_pending(pbar):
+            print(f"Download incomplete; rerun to resume from {manifest_path}")
+            return None
+
+        # Check the assembled file; re-fetch any segment whose bytes on disk do not match once
+        bad_segments, file_sha256 = verify_segments(zip_file_path, manifest)
+        if bad_segments:
+            print(f"Checksum mismatch in segments {bad_segments}; downloading them again.")
+            for index in bad_segments:
+                manifest["completed"].pop(str(index), None)
+            save_manifest(manifest, manifest_path)
+            if run_pending(pbar):
+                print(f"Download incomplete; rerun to resume from {manifest_path}")
+                return None
+            bad_segments, file_sha256 = verify_segments(zip_file_path, manifest)
+            if bad_segments:
+                print(f"Segments {bad_segments} still fail verification.")
+                return None
+
+    if expected_sha256 and file_sha256 != expected_sha256.lower():
+        print(f"SHA-256 mismatch: expected {expected_sha256}, got {file_sha256}")
+        os.remove(manifest_path)
+        return None
+
+    with open(zip_file_path + ".sha256", 'w') as file:
+        file.write(f"{file_sha256}  {os.path.basename(zip_file_path)}\n")
+    os.remove(manifest_path)
+    save_metadata(zip_file_path, remote)
+    print(f"Downloaded {zip_file_path} (sha256 {file_sha256})")
+    return zip_file_path
+
+def refresh_zip(zip_url, dest_dir, segments=DEFAULT_SEGMENTS, expected_sha256=None, force=False, session=None):
+    """Download AllAPIJSON.zip only if the upstream copy differs from the one on disk.
+
+    Returns (zip_file_path, changed); zip_file_path is None if a needed download failed.
+    """
+    zip_file_path = os.path.join(dest_dir, "AllAPIJSON.zip")
+    session = session or create_session(segments)
+    metadata = load_metadata(zip_file_path)
+    have_local_copy = (metadata is not None and os.path.exists(zip_file_path)
+                       and os.path.getsize(zip_file_path) == metadata.get("content_length"))
+
+    if have_local_copy and not force:
+        try:
+            remote = probe_remote(session, zip_url, metadata)
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to check for updates: {e}")
+            return None, False
+        if remote_unchanged(remote, metadata):
+            print(f"{zip_file_path} is up to date (ETag {metadata.get('etag') or 'n/a'}, Last-Modified {metadata.get('last_modified') or 'n/a'}).")
+            return zip_file_path, False
+
+    zip_file_path = download_zip_ranged(zip_url, dest_dir, segments=segments, expected_sha256=expected_sha256, session=session)
+    return zip_file_path, zip_file_path is not None
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Download the ClinicalTrials.gov ZIP archive.')
     # URL of the ZIP file to download
-    zip_url = "https://classic.clinicaltrials.gov/AllAPIJSON.zip"
+    parser.add_argument('--url', default="https://classic.clinicaltrials.gov/AllAPIJSON.zip", help='URL of the ZIP file to download.')
     # Destination directory to save the downloaded file
-    dest_dir = "data/raw"
+    parser.add_argument('--dest_dir', default="data/raw", help='Directory to save the downloaded file.')
+    parser.add_argument('--segments', type=int, default=DEFAULT_SEGMENTS, help='Number of parallel range requests.')
+    parser.add_argument('--sha256', help='Expected SHA-256 of the archive, if known.')
+    parser.add_argument('--force', action='store_true', help='Download even if the upstream archive is unchanged.')
+    args = parser.parse_args()
+
     print("Executing download script...")
     # Call the download function
-    download_zip(zip_url, dest_dir)
+    zip_file_path, changed = refresh_zip(args.url, args.dest_dir, segments=args.segments, expected_sha256=args.sha256, force=args.force)
+    if zip_file_path is None:
+        sys.exit(1)
     print("Download script finished.")
+    if not changed:
+        sys.exit(NOT_MODIFIED_EXIT_CODE)
@@ -0,0 +1,288 @@
+# ******** Part of Tools ******
+import os
+import re
+import json
+import time
+import argparse
+import numpy as np
+from manifests import nct_id_digest, study_digest, combine_digests
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_INDEX_DIR = os.path.join(BASE_DIR, 'data', 'eligibility_index')
+INDEX_INFO_FILE = "_index.json"
+DAYS_PER_UNIT = {"year": 365.25, "month": 30.4375, "week": 7, "day": 1, "hour": 1 / 24, "minute": 1 / 1440}
+AGE_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*(year|month|week|day|hour|minute)s?", re.IGNORECASE)
+# Low-cardinality fields get one packed bitmap per value; states and zips get sorted row lists
+BITMAP_FIELDS = ("gender", "healthy_volunteers", "country")
+POSTING_FIELDS = ("state", "zip")
+# Study fields the bitmaps and postings are built from
+INDEXED_FIELDS = ("Gender", "MinimumAge", "HealthyVolunteers", "Location")
+MAX_AGE_YEARS = 120  # Whole-year age bitmaps are kept for 0..MAX_AGE_YEARS
+ACCEPTS_HEALTHY_VOLUNTEERS = {"accepts healthy volunteers", "yes", "true"}
+COUNTRY_ALIASES = {"us": "united states", "usa": "united states", "u.s.": "united states", "u.s.a.": "united states",
+                   "uk": "united kingdom", "u.k.": "united kingdom"}
+US_STATES = {
+    "al": "alabama", "ak": "alaska", "az": "arizona", "ar": "arkansas", "ca": "california", "co": "colorado",
+    "ct": "connecticut", "de": "delaware", "dc": "district of columbia", "fl": "florida", "ga": "georgia",
+    "hi": "hawaii", "id": "idaho", "il": "illinois", "in": "indiana", "ia": "iowa", "ks": "kansas",
+    "ky": "kentucky", "la": "louisiana", "me": "maine", "md": "maryland", "ma": "massachusetts", "mi": "michigan",
+    "mn": "minnesota", "ms": "mississippi", "mo": "missouri", "mt": "montana", "ne": "nebraska", "nv": "nevada",
+    "nh": "new hampshire", "nj": "new jersey", "nm": "new mexico", "ny": "new york", "nc": "north carolina",
+    "nd": "north dakota", "oh": "ohio", "ok": "oklahoma", "or": "oregon", "pa": "pennsylvania", "pr": "puerto rico",
+    "ri": "rhode island", "sc": "south carolina", "sd": "south dakota", "tn": "tennessee", "tx": "texas",
+    "ut": "utah", "vt": "vermont", "va": "virginia", "wa": "washington", "wv": "west virginia", "wi": "wisconsin",
+    "wy": "wyoming",
+}
+
+def parse_age_days(text):
+    """'18 Years' -> 6574; None when the age is missing or 'N/A' (no limit)."""
+    match = AGE_PATTERN.search(text or "")
+    if not match:
+        return None
+    return int(float(match.group(1)) * DAYS_PER_UNIT[match.group(2).lower()])
+
+def normalize_country(country):
+    country = " ".join((country or "").lower().split())
+    return COUNTRY_ALIASES.get(country, country)
+
+def normalize_state(country, state):
+    """States are keyed within their country ('united states/california'); US abbreviations are expanded."""
+    country = normalize_country(country)
+    state = " ".join((state or "").lower().split())
+    if country == "united states":
+        state = US_STATES.get(state, state)
+    return f"{country}/{state}" if state else ""
+
+def normalize_zip(zip_code):
+    """US-style ZIP+4 codes are reduced to the five-digit ZIP."""
+    zip_code = (zip_code or "").strip().upper()
+    return zip_code[:5] if re.fullmatch(r"\d{5}-\d{4}", zip_code) else zip_code
+
+def study_keys(study):
+    """The value(s) of every indexed field for one study."""
+    locations = study.get("Location") or []
+    healthy_volunteers = study.get("HealthyVolunteers")  # "Accepts Healthy Volunteers"/"No", or a bool in newer exports
+    return {
+        "gender": [(study.get("Gender") or "").strip().lower()],
+        "healthy_volunteers": ["" if healthy_volunteers is None else str(healthy_volunteers).strip().lower()],
+        "country": sorted({normalize_country(loc.get("Country")) for loc in locations} - {""}),
+        "state": sorted({normalize_state(loc.get("Country"), loc.get("State")) for loc in locations} - {""}),
+        "zip": sorted({normalize_zip(loc.get("Zip")) for loc in locations} - {""}),
+    }
+
+def build_eligibility_index(studies, index_dir=DEFAULT_INDEX_DIR):
+    """Index the structured eligibility fields of studies (deduplicated by NCTId) into index_dir."""
+    nct_ids, min_age_days = [], []
+    rows = {field: {} for field in BITMAP_FIELDS + POSTING_FIELDS}
+    seen = set()
+    study_digests = []
+    for study in studies:
+        study_digests.append(study_digest(study, INDEXED_FIELDS))
+        nct_id = study.get("NCTId")
+        if nct_id in seen:
+            continue
+        seen.add(nct_id)
+        row = len(nct_ids)
+        nct_ids.append(nct_id or "")
+        age = parse_age_days(study.get("MinimumAge"))
+        min_age_days.append(0 if age is None else age)
+        for field, values in study_keys(study).items():
+            for value in values:
+                rows[field].setdefault(value, []).append(row)
+
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, "nct_ids.npy"), np.array(nct_ids, dtype=str))
+    min_age_days = np.array(min_age_days, dtype=np.int32)
+    np.save(os.path.join(index_dir, "min_age_days.npy"), min_age_days)
+    # Bitmap y holds the trials open to someone y years old; the sorted ages resolve the part-year remainder
+    age_bitmaps = np.stack([np.packbits(min_age_days <= years * DAYS_PER_UNIT["year"]) for years in range(MAX_AGE_YEARS + 1)])
+    np.save(os.path.join(index_dir, "age_bitmaps.npy"), age_bitmaps)
+    age_order = np.argsort(min_age_days, kind='stable').astype(np.int32)
+    np.save(os.path.join(index_dir, "age_order.npy"), age_order)
+    np.save(os.path.join(index_dir, "sorted_min_age_days.npy"), min_age_days[age_order])
+    info = {"documents": len(nct_ids), "nct_digest": nct_id_digest(nct_ids), "content_digest": combine_digests(study_digests), "values": {}}
+    for field in BITMAP_FIELDS:
+        values = sorted(rows[field])
+        bitmaps = np.zeros((len(values), (len(nct_ids) + 7) // 8), dtype=np.uint8)
+        for position, value in enumerate(values):
+            mask = np.zeros(len(nct_ids), dtype=bool)
+            mask[rows[field][value]] = True
+            bitmaps[position] = np.packbits(mask)
+        np.save(os.path.join(index_dir, f"{field}.npy"), bitmaps)
+        info["values"][field] = values
+    for field in POSTING_FIELDS:
+        values = sorted(rows[field])
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum([len(rows[field][value]) for value in values], out=offsets[1:])
+        postings = np.array([row for value in values for row in rows[field][value]], dtype=np.int32)
+        np.save(os.path.join(index_dir, f"{field}_offsets.npy"), offsets)
+        np.save(os.path.join(index_dir, f"{field}_rows.npy"), postings)
+        info["values"][field] = values
+    info_path = os.path.join(index_dir, INDEX_INFO_FILE)
+    with open(info_path + ".tmp", 'w') as file:
+        json.dump(info, file)
+    os.replace(info_path + ".tmp", info_path)
+    return info
+
+class EligibilityIndex:
+    """Narrow trials by patient profile with bitmap ANDs; all arrays are memory-mapped.
+
+    Missing gender, age or healthy-volunteer data never excludes a trial, but a location filter
+    only keeps trials with at least one site in that country, state or zip.
+    """
+
+    def __init__(self, index_dir=DEFAULT_INDEX_DIR):
+        with open(os.path.join(index_dir, INDEX_INFO_FILE), 'r') as file:
+            self.info = json.load(file)
+        load = lambda name: np.load(os.path.join(index_dir, name), mmap_mode='r')
+        self.nct_ids = load("nct_ids.npy")
+        self.min_age_days = load("min_age_days.npy")
+        self.age_bitmaps = load("age_bitmaps.npy")
+        self.age_order = load("age_order.npy")
+        self.sorted_min_age_days = load("sorted_min_age_days.npy")
+        self.bitmaps = {field: load(f"{field}.npy") for field in BITMAP_FIELDS}
+        self.postings = {field: (load(f"{field}_offsets.npy"), load(f"{field}_rows.npy")) for field in POSTING_FIELDS}
+        self.value_ids = {field: {value: position for position, value in enumerate(values)}
+                          for field, values in self.info["values"].items()}
+        self._aligned = {}
+
+    def __len__(self):
+        return self.info["documents"]
+
+    def _bitmap(self, field, values):
+        """OR of the bitmaps of the given values (all zeros when none are indexed)."""
+        result = np.zeros((len(self) + 7) // 8, dtype=np.uint8)
+        for value in values:
+            position = self.value_ids[field].get(value)
+            if position is not None:
+                result |= self.bitmaps[field][position]
+        return result
+
+    def _posting_rows(self, field, value):
+        position = self.value_ids[field].get(value)
+        if position is None:
+            return np.empty(0, dtype=np.int32)
+        offsets, rows = self.postings[field]
+        return rows[offsets[position]:offsets[position + 1]]
+
+    def candidate_mask(self, gender=None, age_years=None, healthy_volunteer=None, country=None, state=None, zip_code=None):
+        """Bool mask over the index rows of trials a patient with this profile could join."""
+        bits = np.full((len(self) + 7) // 8, 0xFF, dtype=np.uint8)
+        if gender:
+            bits &= self._bitmap("gender", {gender.strip().lower(), "all", ""})
+        if healthy_volunteer:
+            bits &= self._bitmap("healthy_volunteers", ACCEPTS_HEALTHY_VOLUNTEERS | {""})
+        if country:
+            bits &= self._bitmap("country", {normalize_country(country)})
+        min_age_days = None if age_years is None else age_years * DAYS_PER_UNIT["year"]
+
+        rows = None
+        if state:
+            rows = self._posting_rows("state", normalize_state(country or "united states", state))
+        if zip_code:
+            zip_rows = self._posting_rows("zip", normalize_zip(zip_code))
+            rows = zip_rows if rows is None else np.intersect1d(rows, zip_rows, assume_unique=True)
+        if rows is not None:
+            # A state or zip leaves few rows, so only their bits and ages are checked
+            rows = rows[self._bits_set(bits, rows)]
+            if min_age_days is not None:
+                rows = rows[self.min_age_days[rows] <= min_age_days]
+            mask = np.zeros(len(self), dtype=bool)
+            mask[rows] = True
+            return mask
+        if min_age_days is None:
+            return np.unpackbits(bits, count=len(self)).view(bool)
+
+        years = min(int(age_years), MAX_AGE_YEARS)
+        # Trials whose minimum age falls between the whole year and the exact age, checked one by one
+        # Ages are whole days, so integer keys (a float key would make searchsorted convert the whole array)
+        start = np.searchsorted(self.sorted_min_age_days, np.int32(years * DAYS_PER_UNIT["year"]), side='right')
+        end = np.searchsorted(self.sorted_min_age_days, np.int32(min_age_days), side='right')
+        extra_rows = self.age_order[start:end]
+        extra_rows = extra_rows[self._bits_set(bits, extra_rows)]
+        mask = np.unpackbits(bits & self.age_bitmaps[years], count=len(self)).view(bool)
+        mask[extra_rows] = True
+        return mask
+
+    @staticmethod
+    def _bits_set(bits, rows):
+        """Whether each row's bit is set in a packed bitmap."""
+        return (bits[rows >> 3] >> (7 - (rows & 7))) & 1 == 1
+
+    def candidates(self, **profile):
+        """NCTIds of the trials matching candidate_mask(**profile)."""
+        return [str(nct_id) for nct_id in self.nct_ids[np.flatnonzero(self.candidate_mask(**profile))]]
+
+    def search_mask(self, search_index, **profile):
+        """candidate_mask(**profile) translated to the rows of a search_index.SearchIndex.
+
+        The row mapping is computed once per search index, so each query stays a few array operations.
+        """
+        positions = self._aligned.get(id(search_index))
+        if positions is None:
+            positions = self._aligned[id(search_index)] = search_index.positions_of(self.nct_ids)
+        rows = positions[self.candidate_mask(**profile)]
+        mask = np.zeros(len(search_index), dtype=bool)
+        mask[rows[rows >= 0]] = True
+        return mask
+
+def open_eligibility_index(index_dir=DEFAULT_INDEX_DIR):
+    if not os.path.exists(os.path.join(index_dir, INDEX_INFO_FILE)):
+        raise FileNotFoundError(f"No eligibility index found at {index_dir}. Run eligibility_index.py to build it.")
+    return EligibilityIndex(index_dir)
+
+def load_or_build_eligibility_index(studies, index_dir=DEFAULT_INDEX_DIR):
+    """Open the saved index, rebuilding it first when it is missing or any indexed field of any study changed."""
+    info_path = os.path.join(index_dir, INDEX_INFO_FILE)
+    if os.path.exists(info_path):
+        with open(info_path, 'r') as file:
+            if json.load(file).get("content_digest") == combine_digests(study_digest(study, INDEXED_FIELDS) for study in studies):
+                return EligibilityIndex(index_dir)
+    print(f"\033[33mBuilding the eligibility index in {index_dir}...\033[0m")
+    build_eligibility_index(studies, index_dir)
+    return EligibilityIndex(index_dir)
+
+def add_profile_arguments(parser):
+    """Patient profile options shared by the scripts that filter trials by eligibility."""
+    parser.add_argument('--gender', help='Patient gender (Female or Male).')
+    parser.add_argument('--age', type=float, help='Patient age in years.')
+    parser.add_argument('--healthy_volunteer', action='store_true', help='Only trials that accept healthy volunteers.')
+    parser.add_argument('--country', help='Only trials with a site in this country (e.g. "United States" or US).')
+    parser.add_argument('--state', help='Only trials with a site in this state (e.g. California or CA; in --country, US by default).')
+    parser.add_argument('--zip', dest='zip_code', help='Only trials with a site at this zip code.')
+
+def profile_from_args(args):
+    return {
+        "gender": args.gender,
+        "age_years": args.age,
+        "healthy_volunteer": args.healthy_volunteer,
+        "country": args.country,
+        "state": args.state,
+        "zip_code": args.zip_code,
+    }
+
+if __name__ == "__main__":
+    from trial_store import iter_cleaned_studies, open_store, DEFAULT_SOURCE_DIR, DEFAULT_STORE_DIR, STORE_INFO_FILE
+
+    parser = argparse.ArgumentParser(description='Build or query the eligibility pre-filter index over the cleaned studies.')
+    parser.add_argument('--source_dir', default=DEFAULT_SOURCE_DIR, help='Cleaned studies to index (used when there is no trial store).')
+    parser.add_argument('--store_dir', default=DEFAULT_STORE_DIR, help='Consolidated trial store to index when it exists.')
+    parser.add_argument('--index_dir', default=DEFAULT_INDEX_DIR, help='Directory of the saved index.')
+    parser.add_argument('--query', action='store_true', help='Count the trials matching the profile options instead of building.')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    if args.query:
+        index = open_eligibility_index(args.index_dir)
+        start_time = time.perf_counter()
+        mask = index.candidate_mask(**profile_from_args(args))
+        print(f"\033[92m{int(mask.sum())} of {len(index)} trials match in {(time.perf_counter() - start_time) * 1e6:.0f} µs\033[0m")
+    else:
+        columns = ["NCTId", "Gender", "MinimumAge", "HealthyVolunteers", "Location"]
+        if os.path.exists(os.path.join(args.store_dir, STORE_INFO_FILE)):
+            studies = open_store(args.store_dir).scan(columns=columns)
+        else:
+            studies = iter_cleaned_studies(args.source_dir)
+        info = build_eligibility_index(studies, args.index_dir)
+        print(f"\033[92mIndexed eligibility of {info['documents']} trials\033[0m")
@@ -0,0 +1,145 @@
+# ******** Part of Tools ******
+import os
+import re
+import sqlite3
+import hashlib
+import unicodedata
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_CACHE_DIR = os.path.join(BASE_DIR, 'data', 'embedding_cache')
+INDEX_FILE = "index.sqlite"
+LOOKUP_CHUNK = 500  # Hashes per SQLite IN (...) query
+
+def normalize_text(text):
+    """Text as it is keyed in the cache: NFC-normalised with runs of whitespace collapsed."""
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+def text_hash(text):
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+class EmbeddingCache:
+    """Persistent embedding cache keyed by (model, hash of the normalised text).
+
+    Vectors live in append-only float32 files, one per model and dimension, that are read through
+    np.memmap; a SQLite index maps each key to its row. Writing the vectors before committing the
+    index means a crash can leave unused rows behind but never an index entry without a vector.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(cache_dir, INDEX_FILE))
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, dim INTEGER NOT NULL, row INTEGER NOT NULL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        self.db.commit()
+        self.maps = {}
+        self.stats = {"hits": 0, "misses": 0}
+
+    def vectors_path(self, model, dim):
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model)
+        return os.path.join(self.cache_dir, f"{slug}_{dim}.f32")
+
+    def _vectors(self, model, dim, rows_needed):
+        """Memmap of the model's vectors, re-opened when rows were appended after it was mapped."""
+        vectors = self.maps.get((model, dim))
+        if vectors is None or len(vectors) < rows_needed:
+            path = self.vectors_path(model, dim)
+            rows = os.path.getsize(path) // (dim * 4)
+            vectors = np.memmap(path, dtype=np.float32, mode='r', shape=(rows, dim))
+            self.maps[(model, dim)] = vectors
+        return vectors
+
+    def get_many(self, model, texts):
+        """Cached vector for each text, or None where there is none."""
+        hashes = [text_hash(text) for text in texts]
+        found = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique_hashes), LOOKUP_CHUNK):
+            chunk = unique_hashes[start:start + LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.db.execute(
+                f"SELECT text_hash, dim, row FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [model, *chunk],
+            )
+            for key, dim, row in rows:
+                found[key] = (dim, row)
+        results = []
+        for key in hashes:
+            if key in found:
+                dim, row = found[key]
+                results.append(self._vectors(model, dim, row + 1)[row])
+            else:
+                results.append(None)
+        return results
+
+    def put_many(self, model, texts, vectors):
+        """Store vectors for texts; texts that are already cached keep their existing vector."""
+        new = {}
+        for text, vector in zip(texts, vectors):
+            new.setdefault(text_hash(text), vector)
+        if not new:
+            return
+        matrix = np.asarray(list(new.values()), dtype=np.float32)
+        dim = matrix.shape[1]
+        path = self.vectors_path(model, dim)
+        with open(path, 'ab') as file:
+            # Drop a partial row left by an interrupted write so new rows stay aligned
+            rows_before = file.tell() // (dim * 4)
+            file.truncate(rows_before * dim * 4)
+            file.seek(rows_before * dim * 4)
+            file.write(matrix.tobytes())
+        self.db.executemany(
+            "INSERT OR IGNORE INTO embeddings (model, text_hash, dim, row) VALUES (?, ?, ?, ?)",
+            [(model, key, dim, rows_before + offset) for offset, key in enumerate(new)],
+        )
+        self.db.commit()
+
+    def embed(self, texts, embed_fn, model):
+        """Vectors for texts, calling embed_fn only for texts that are not cached yet.
+
+        Texts that normalise to the same string are embedded once. When embed_fn returns None for a
+        text (its request failed), nothing is cached and the result stays None.
+        """
+        texts = list(texts)
+        results = self.get_many(model, texts)
+        missing = {}
+        for index, vector in enumerate(results):
+            if vector is None:
+                missing.setdefault(text_hash(texts[index]), []).append(index)
+        self.stats["hits"] += len(texts) - sum(len(indexes) for indexes in missing.values())
+        self.stats["misses"] += len(missing)
+        if missing:
+            missing_texts = [texts[indexes[0]] for indexes in missing.values()]
+            vectors = embed_fn(missing_texts)
+            embedded = [(text, vector) for text, vector in zip(missing_texts, vectors) if vector is not None]
+            self.put_many(model, [text for text, _ in embedded], [vector for _, vector in embedded])
+            for indexes, vector in zip(missing.values(), vectors):
+                if vector is None:
+                    continue
+                vector = np.asarray(vector, dtype=np.float32)
+                for index in indexes:
+                    results[index] = vector
+        return results
+
+    def close(self):
+        self.maps = {}
+        self.db.close()
+
+class CachedEmbeddings:
+    """Wraps a LangChain embeddings object (embed_documents / embed_query) with an EmbeddingCache."""
+
+    def __init__(self, embeddings, cache=None, model="text-embedding-ada-002"):
+        self.embeddings = embeddings
+        self.cache = cache or EmbeddingCache()
+        self.model = model
+
+    def embed_documents(self, texts):
+        return [vector.tolist() for vector in self.cache.embed(texts, self.embeddings.embed_documents, self.model)]
+
+    def embed_query(self, text):
+        return self.cache.embed([text], lambda texts: [self.embeddings.embed_query(texts[0])], self.model)[0].tolist()
@@ -0,0 +1,197 @@
+# ******** Part of Tools ******
+import os
+import time
+import random
+import asyncio
+from openai import AsyncOpenAI, RateLimitError, APIStatusError, APIConnectionError, APITimeoutError
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+MAX_TOKENS_PER_INPUT = 8191  # Model limit for a single input; longer texts are truncated
+MAX_TOKENS_PER_REQUEST = 8000  # Token budget for all inputs packed into one request
+MAX_INPUTS_PER_REQUEST = 2048  # API limit on the number of inputs per request
+REQUESTS_PER_MINUTE = 3000
+TOKENS_PER_MINUTE = 1000000
+CONCURRENCY = 16
+MAX_RETRIES = 6
+BASE_DELAY = 1.0  # Seconds before the first retry; doubled on every attempt
+
+# ANSI escape codes
+GREEN = "\033[92m"
+YELLOW = "\033[33m"
+RED = "\033[91m"
+RESET = "\033[0m"
+
+def count_tokens(text, model=EMBEDDING_MODEL):
+    """Tokens in text; uses tiktoken when it is installed, otherwise ~4 characters per token."""
+    if tiktoken is not None:
+        return len(tiktoken.encoding_for_model(model).encode(text))
+    return len(text) // 4 + 1
+
+def truncate_text(text, max_tokens=MAX_TOKENS_PER_INPUT, model=EMBEDDING_MODEL):
+    """text cut to its first max_tokens tokens (about 4 characters per token without tiktoken)."""
+    if tiktoken is not None:
+        encoding = tiktoken.encoding_for_model(model)
+        tokens = encoding.encode(text)
+        return encoding.decode(tokens[:max_tokens]) if len(tokens) > max_tokens else text
+    return text[:(max_tokens - 1) * 4]
+
+def pack_batches(token_counts, max_tokens=MAX_TOKENS_PER_REQUEST, max_inputs=MAX_INPUTS_PER_REQUEST,
+                 max_input_tokens=MAX_TOKENS_PER_INPUT):
+    """Group input indexes into requests of at most max_tokens tokens and max_inputs inputs.
+
+    Inputs are kept in order; an input larger than the budget gets a request of its own. Inputs over
+    max_input_tokens are counted at the limit, since embed_async truncates them to it.
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for index, tokens in enumerate(token_counts):
+        tokens = min(tokens, max_input_tokens)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_inputs):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+class TokenBucket:
+    """Async token bucket: `rate_per_minute` units refill continuously, up to `capacity`."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        # A request larger than the bucket waits for a full bucket instead of forever
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+def retry_delay(error, attempt, base_delay=BASE_DELAY):
+    """Seconds to wait before retrying: the server's Retry-After if it sent one, else exponential backoff with jitter."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return base_delay * (2 ** attempt) * (0.5 + random.random() / 2)
+
+def is_retryable(error):
+    if isinstance(error, (RateLimitError, APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+class EmbeddingEngine:
+    """Embed many texts with few requests: texts are packed into token-budgeted batches that are sent
+    concurrently, throttled by requests-per-minute and tokens-per-minute buckets, and retried with
+    backoff on 429 and 5xx responses. A batch that still fails is reported and skipped; its texts get
+    None instead of an embedding.
+    """
+
+    def __init__(self, client=None, model=EMBEDDING_MODEL, requests_per_minute=REQUESTS_PER_MINUTE,
+                 tokens_per_minute=TOKENS_PER_MINUTE, max_tokens_per_request=MAX_TOKENS_PER_REQUEST,
+                 max_inputs_per_request=MAX_INPUTS_PER_REQUEST, concurrency=CONCURRENCY,
+                 max_retries=MAX_RETRIES, base_delay=BASE_DELAY, max_tokens_per_input=MAX_TOKENS_PER_INPUT):
+        self.client = client
+        self.model = model
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_tokens_per_input = max_tokens_per_input
+        self.max_tokens_per_request = max_tokens_per_request
+        self.max_inputs_per_request = max_inputs_per_request
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.stats = {"requests": 0, "retries": 0, "tokens": 0, "truncated": 0, "failed_batches": 0, "failed_texts": 0}
+
+    async def _embed_batch(self, client, texts, tokens, request_bucket, token_bucket, semaphore):
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                await request_bucket.acquire(1)
+                await token_bucket.acquire(tokens)
+                try:
+                    response = await client.embeddings.create(model=self.model, input=texts)
+                except Exception as e:
+                    if not is_retryable(e) or attempt == self.max_retries:
+                        raise
+                    delay = retry_delay(e, attempt, self.base_delay)
+                    self.stats["retries"] += 1
+                    print(f"{YELLOW}Embedding request failed ({e.__class__.__name__}); retrying in {delay:.1f}s{RESET}")
+                    await asyncio.sleep(delay)
+                    continue
+                self.stats["requests"] += 1
+                self.stats["tokens"] += tokens
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    async def embed_async(self, texts):
+        """Return one embedding per text, in the same order; None for the texts of batches that failed."""
+        texts = [text if text else " " for text in texts]  # The API rejects empty strings
+        token_counts = [count_tokens(text, self.model) for text in texts]
+        for index, tokens in enumerate(token_counts):
+            if tokens > self.max_tokens_per_input:
+                texts[index] = truncate_text(texts[index], self.max_tokens_per_input, self.model)
+                token_counts[index] = count_tokens(texts[index], self.model)
+                self.stats["truncated"] += 1
+        batches = pack_batches(token_counts, self.max_tokens_per_request, self.max_inputs_per_request, self.max_tokens_per_input)
+        request_bucket = TokenBucket(self.requests_per_minute)
+        token_bucket = TokenBucket(self.tokens_per_minute)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        # An async client belongs to the event loop it was first used on, so a default client is
+        # created (and closed) per call; retries are handled here, so its own retry loop is off
+        client = self.client or AsyncOpenAI(max_retries=0)
+        start_time = time.time()
+        try:
+            results = await asyncio.gather(*(
+                self._embed_batch(client, [texts[index] for index in batch], sum(token_counts[index] for index in batch),
+                                  request_bucket, token_bucket, semaphore)
+                for batch in batches
+            ), return_exceptions=True)
+        finally:
+            if self.client is None:
+                await client.close()
+        embeddings = [None] * len(texts)
+        failed = 0
+        for batch, vectors in zip(batches, results):
+            if isinstance(vectors, Exception):
+                failed += len(batch)
+                self.stats["failed_batches"] += 1
+                self.stats["failed_texts"] += len(batch)
+                print(f"{RED}Skipped a batch of {len(batch)} texts (inputs {batch[0]}-{batch[-1]}): "
+                      f"{vectors.__class__.__name__}: {vectors}{RESET}")
+                continue
+            for index, vector in zip(batch, vectors):
+                embeddings[index] = vector
+        if texts:
+            elapsed = max(time.time() - start_time, 1e-9)
+            print(f"{GREEN}Embedded {len(texts) - failed} of {len(texts)} texts in {len(batches)} requests "
+                  f"({len(texts) / elapsed:.0f} texts/sec){RESET}")
+        return embeddings
+
+    def embed(self, texts):
+        """Synchronous wrapper around embed_async for scripts."""
+        return asyncio.run(self.embed_async(list(texts)))
@@ -0,0 +1,174 @@
+# ******** Part of Tools ******
+import os
+import json
+import shutil
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STORE_INFO_FILE = "_store.json"
+METADATA_FILE = "metadata.parquet"
+SHARD_ROWS = 16384  # Vectors per .npy shard (~100 MB of 1536-d float32)
+DTYPES = ("float32", "float16", "int8")
+
+METADATA_SCHEMA = pa.schema([
+    ("NCTId", pa.string()),
+    ("file", pa.string()),
+    ("BriefTitle", pa.string()),
+    ("shard", pa.int32()),
+    ("row", pa.int32()),
+    ("scale", pa.float32()),  # int8 only: vector = codes * scale
+])
+
+def quantize(matrix, dtype):
+    """Convert float32 vectors to the storage dtype; int8 uses one symmetric scale per vector."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if dtype == "float32":
+        return matrix, None
+    if dtype == "float16":
+        return matrix.astype(np.float16), None
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+class EmbeddingStoreWriter:
+    """Write vectors to numbered .npy shards and their NCTId/file/title to a Parquet sidecar.
+
+    Only the current shard is buffered, so the writer can be fed one directory at a time.
+    """
+
+    def __init__(self, store_dir, dtype="float32", shard_rows=SHARD_ROWS):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype}; expected one of {', '.join(DTYPES)}")
+        self.store_dir = store_dir
+        self.dtype = dtype
+        self.shard_rows = shard_rows
+        self.dim = None
+        self.shards = []
+        self.pending_vectors = []
+        self.pending_records = []
+        self.metadata = {name: [] for name in METADATA_SCHEMA.names}
+        if os.path.exists(store_dir):
+            shutil.rmtree(store_dir)
+        os.makedirs(store_dir)
+
+    def add(self, records, vectors):
+        """records: dicts with NCTId, file and BriefTitle; vectors: one per record."""
+        for record, vector in zip(records, vectors):
+            vector = np.asarray(vector, dtype=np.float32)
+            if self.dim is None:
+                self.dim = len(vector)
+            elif len(vector) != self.dim:
+                raise ValueError(f"Vector of length {len(vector)} does not match the store dimension {self.dim}")
+            self.pending_vectors.append(vector)
+            self.pending_records.append(record)
+            if len(self.pending_vectors) >= self.shard_rows:
+                self._flush_shard()
+
+    def _flush_shard(self):
+        if not self.pending_vectors:
+            return
+        shard = len(self.shards)
+        codes, scales = quantize(np.stack(self.pending_vectors), self.dtype)
+        shard_name = f"embeddings_{shard:05d}.npy"
+        np.save(os.path.join(self.store_dir, shard_name), codes)
+        for row, record in enumerate(self.pending_records):
+            self.metadata["NCTId"].append(record.get("NCTId"))
+            self.metadata["file"].append(record.get("file"))
+            self.metadata["BriefTitle"].append(record.get("BriefTitle"))
+            self.metadata["shard"].append(shard)
+            self.metadata["row"].append(row)
+            self.metadata["scale"].append(float(scales[row]) if scales is not None else None)
+        self.shards.append({"file": shard_name, "rows": len(self.pending_vectors)})
+        self.pending_vectors = []
+        self.pending_records = []
+
+    def close(self):
+        self._flush_shard()
+        pq.write_table(pa.table(self.metadata, schema=METADATA_SCHEMA), os.path.join(self.store_dir, METADATA_FILE),
+                       compression="zstd")
+        info = {
+            "dim": self.dim,
+            "dtype": self.dtype,
+            "rows": sum(shard["rows"] for shard in self.shards),
+            "shards": self.shards,
+        }
+        with open(os.path.join(self.store_dir, STORE_INFO_FILE), 'w') as file:
+            json.dump(info, file, indent=4)
+        return info
+
+def write_embedding_store(store_dir, records, vectors, dtype="float32", shard_rows=SHARD_ROWS):
+    writer = EmbeddingStoreWriter(store_dir, dtype, shard_rows)
+    writer.add(records, vectors)
+    return writer.close()
+
+class EmbeddingStore:
+    """Read access to a store written by EmbeddingStoreWriter.
+
+    Shards are opened with np.load(mmap_mode='r'), so nothing is read until a vector is used and
+    float32/float16 shards are returned without copying.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, STORE_INFO_FILE), 'r') as file:
+            self.info = json.load(file)
+        self.dim = self.info["dim"]
+        self.dtype = self.info["dtype"]
+        self.shards = [np.load(os.path.join(store_dir, shard["file"]), mmap_mode='r') for shard in self.info["shards"]]
+        self.metadata = pq.read_table(os.path.join(store_dir, METADATA_FILE))
+        self._scales = None
+        self._rows_by_nct_id = None
+
+    def __len__(self):
+        return self.info["rows"]
+
+    def scales(self, shard):
+        """Per-vector int8 scales of a shard (None for float stores)."""
+        if self.dtype != "int8":
+            return None
+        if self._scales is None:
+            # Metadata rows are in shard order, so each shard's scales are one contiguous slice
+            scales = self.metadata.column("scale").to_numpy()
+            offsets = np.cumsum([0] + [info["rows"] for info in self.info["shards"]])
+            self._scales = [scales[offsets[index]:offsets[index + 1]].astype(np.float32) for index in range(len(self.shards))]
+        return self._scales[shard]
+
+    def shard_vectors(self, shard, dtype=None):
+        """Vectors of one shard: the memmap itself when dtype is None, otherwise a float copy."""
+        codes = self.shards[shard]
+        if dtype is None:
+            return codes
+        if self.dtype == "int8":
+            return codes.astype(dtype) * self.scales(shard)[:, None].astype(dtype)
+        return codes.astype(dtype)
+
+    def vectors(self, dtype=np.float32):
+        """All vectors as one float matrix (this copies; use shard_vectors to stay zero-copy)."""
+        if not self.shards:
+            return np.empty((0, self.dim or 0), dtype=dtype)
+        return np.concatenate([self.shard_vectors(index, dtype) for index in range(len(self.shards))])
+
+    def vector(self, position, dtype=np.float32):
+        """Vector at a global row position (its index in the metadata table)."""
+        shard = self.metadata.column("shard")[position].as_py()
+        row = self.metadata.column("row")[position].as_py()
+        vector = self.shards[shard][row].astype(dtype)
+        if self.dtype == "int8":
+            vector *= self.metadata.column("scale")[position].as_py()
+        return vector
+
+    def lookup(self, nct_id, dtype=np.float32):
+        """Vector stored for an NCTId, or None."""
+        if self._rows_by_nct_id is None:
+            self._rows_by_nct_id = {value: position for position, value in enumerate(self.metadata.column("NCTId").to_pylist())}
+        position = self._rows_by_nct_id.get(nct_id)
+        return None if position is None else self.vector(position, dtype)
+
+def open_embedding_store(store_dir):
+    if not os.path.exists(os.path.join(store_dir, STORE_INFO_FILE)):
+        raise FileNotFoundError(f"No embedding store found at {store_dir}. Run create_embeddings.py to build it.")
+    return EmbeddingStore(store_dir)
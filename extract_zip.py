@@ -1,6 +1,8 @@
 # ******** Part of Process ******
 import zipfile
 import os
+import json
+import argparse
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -8,6 +10,8 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 YELLOW = "\033[93m"
 RESET = "\033[0m"
 
+STAMP_FILE = ".source.json"
+
 def is_valid_zip(zip_path):
     print(f"{YELLOW}********** Starting Zip Validation **********{RESET}")
     try:
@@ -17,14 +21,41 @@ def is_valid_zip(zip_path):
     except zipfile.BadZipFile:
         return False
 
-def extract_zip(zip_path, extract_to):
+def zip_fingerprint(zip_path):
+    """Identify a downloaded archive by its size, mtime and the validators saved by download.py."""
+    stat = os.stat(zip_path)
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    meta_path = zip_path + ".meta.json"
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r') as file:
+            meta = json.load(file)
+        fingerprint["etag"] = meta.get("etag", "")
+        fingerprint["last_modified"] = meta.get("last_modified", "")
+    return fingerprint
+
+def is_already_extracted(zip_path, specific_extract_to):
+    stamp_path = os.path.join(specific_extract_to, STAMP_FILE)
+    if not os.path.exists(stamp_path):
+        return False
+    with open(stamp_path, 'r') as file:
+        try:
+            return json.load(file) == zip_fingerprint(zip_path)
+        except json.JSONDecodeError:
+            return False
+
+def extract_zip(zip_path, extract_to, force=False):
     print(f"{YELLOW}********** Starting Zip Extraction **********{RESET}")
     if not is_valid_zip(zip_path):
         print(f"{YELLOW}{zip_path} is not a valid zip file.{RESET}")
-        return
+        return False
     
     zip_filename = os.path.splitext(os.path.basename(zip_path))[0]
     specific_extract_to = os.path.join(extract_to, zip_filename)
+
+    # Skip the extraction when this exact archive has already been unpacked
+    if not force and is_already_extracted(zip_path, specific_extract_to):
+        print(f"{YELLOW}{zip_path} is unchanged since the last extraction; skipping.{RESET}")
+        return False
     
     os.makedirs(specific_extract_to, exist_ok=True)
     os.chmod(specific_extract_to, 0o777)
@@ -40,15 +71,24 @@ def extract_zip(zip_path, extract_to):
                 print(f"{YELLOW}Progress: {progress:.2f}%{RESET}")
         print(f"{YELLOW}Extracted {extracted_files}/{total_files} files.{RESET}")
 
+    with open(os.path.join(specific_extract_to, STAMP_FILE), 'w') as file:
+        json.dump(zip_fingerprint(zip_path), file, indent=4)
     print(f"{YELLOW}Extracted {zip_path} to {specific_extract_to}{RESET}")
+    return True
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Extract the downloaded ClinicalTrials.gov ZIP archive.')
+    parser.add_argument('--force', action='store_true', help='Extract even if this archive was already extracted.')
+    args = parser.parse_args()
+
     print(f"{YELLOW}********** Starting Zip Extraction **********{RESET}")
     zip_path = os.path.join(BASE_DIR, 'data', 'raw', 'AllAPIJSON.zip')
     extract_to = os.path.join(BASE_DIR, 'data', 'extracted')
     print(f"{YELLOW}zip_path: {os.path.abspath(zip_path)}{RESET}")
     print(f"{YELLOW}extract_to: {os.path.abspath(extract_to)}{RESET}")   
-    extract_zip(zip_path, extract_to)
+    if not extract_zip(zip_path, extract_to, force=args.force):
+        print(f"{YELLOW}Nothing extracted{RESET}")
+        raise SystemExit(0)
     print(f"{YELLOW}Finished extraction{RESET}")
     print(f"{YELLOW}Files in {extract_to}:{RESET}")
     for root, dirs, files in os.walk(extract_to):
@@ -0,0 +1,379 @@
+# ******** Part of Tools ******
+import os
+import re
+import json
+import gzip
+import math
+import time
+import argparse
+from array import array
+import numpy as np
+from manifests import nct_id_digest, study_digest, combine_digests
+from eligibility_index import normalize_country, normalize_zip, US_STATES
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_INDEX_DIR = os.path.join(BASE_DIR, 'data', 'geo_index')
+# Bundled US zip code centroids in GeoNames postal code format (CC BY 4.0, see data/geonames/README.md).
+# Pass a full dump (e.g. allCountries.txt from download.geonames.org/export/zip/) with --centroids for other countries.
+DEFAULT_CENTROIDS_FILE = os.path.join(BASE_DIR, 'data', 'geonames', 'US.txt.gz')
+INDEX_INFO_FILE = "_index.json"
+INDEXED_FIELDS = ("Location",)
+EARTH_RADIUS_MILES = 3958.8
+DEFAULT_RADIUS_MILES = 50
+CELL_DEGREES = 0.5  # Grid cell size: about 35 miles north-south, so a 50-mile query reads a handful of cells
+LAT_CELLS = int(180 / CELL_DEGREES)
+LON_CELLS = int(360 / CELL_DEGREES)
+# Registry country names -> ISO 3166 alpha-2 codes used by the GeoNames postal code files
+COUNTRY_CODES = {
+    "united states": "US", "canada": "CA", "mexico": "MX", "puerto rico": "PR", "brazil": "BR", "argentina": "AR",
+    "chile": "CL", "colombia": "CO", "peru": "PE", "united kingdom": "GB", "ireland": "IE", "france": "FR",
+    "germany": "DE", "netherlands": "NL", "belgium": "BE", "luxembourg": "LU", "switzerland": "CH", "austria": "AT",
+    "italy": "IT", "spain": "ES", "portugal": "PT", "denmark": "DK", "norway": "NO", "sweden": "SE",
+    "finland": "FI", "iceland": "IS", "poland": "PL", "czechia": "CZ", "czech republic": "CZ", "slovakia": "SK",
+    "hungary": "HU", "romania": "RO", "bulgaria": "BG", "greece": "GR", "turkey": "TR", "türkiye": "TR",
+    "russian federation": "RU", "ukraine": "UA", "israel": "IL", "egypt": "EG", "south africa": "ZA",
+    "india": "IN", "pakistan": "PK", "china": "CN", "japan": "JP", "korea, republic of": "KR",
+    "south korea": "KR", "taiwan": "TW", "hong kong": "HK", "singapore": "SG", "malaysia": "MY",
+    "thailand": "TH", "philippines": "PH", "australia": "AU", "new zealand": "NZ",
+}
+
+def normalize_name(name):
+    return " ".join((name or "").lower().split())
+
+def country_code(country):
+    """'United States' -> 'US'; two-letter codes are kept and unknown countries give ''."""
+    name = normalize_country(country)
+    if len(name) == 2:
+        return name.upper()
+    return COUNTRY_CODES.get(name, "")
+
+def region_key(code, state):
+    """Lower-case state name, with US abbreviations expanded so 'CA' and 'California' match."""
+    state = normalize_name(state)
+    return US_STATES.get(state, state) if code == "US" else state
+
+def postal_lookup_keys(code, zip_code):
+    """Keys to try for a postal code, most specific first.
+
+    GeoNames keeps only the outward part of the code for some countries (Canada 'T2N', UK 'SW1A').
+    """
+    zip_code = normalize_zip(zip_code)
+    return [f"{code}:{key}" for key in dict.fromkeys([zip_code, re.split(r"[\s-]", zip_code)[0]]) if key]
+
+def site_fields(location):
+    """(zip, city, state, country) of a cleaned ('Zip') or raw ('LocationZip') site."""
+    get = lambda name: location.get(name) or location.get("Location" + name) or ""
+    return get("Zip"), get("City"), get("State"), get("Country")
+
+def trial_locations(trial):
+    """Site dicts of a cleaned study (Location) or of a raw downloaded study (...LocationList.Location)."""
+    if isinstance(trial, dict):
+        for key, value in trial.items():
+            if key == "Location" and isinstance(value, list):
+                yield from (item for item in value if isinstance(item, dict))
+            elif isinstance(value, (dict, list)):
+                yield from trial_locations(value)
+    elif isinstance(trial, list):
+        for item in trial:
+            yield from trial_locations(item)
+
+def read_centroids(path):
+    """Yield (country code, postal code, place, admin1 name, admin1 code, lat, lon) from a GeoNames postal code file (plain or .gz)."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as file:
+        for line in file:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 11:
+                continue
+            try:
+                lat, lon = float(fields[9]), float(fields[10])
+            except ValueError:
+                continue
+            yield fields[0].strip().upper(), fields[1].strip().upper(), fields[2], fields[3], fields[4], lat, lon
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(value) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+def grid_cells(lat, lon):
+    """Row-major grid cell of each point; rows run south to north and columns west to east from -180."""
+    lat_cells = np.clip(np.floor((np.asarray(lat, dtype=np.float64) + 90) / CELL_DEGREES), 0, LAT_CELLS - 1).astype(np.int64)
+    lon_cells = np.floor((np.asarray(lon, dtype=np.float64) + 180) / CELL_DEGREES).astype(np.int64) % LON_CELLS
+    return lat_cells * LON_CELLS + lon_cells
+
+class Geocoder:
+    """Offline site geocoding from postal code centroids (GeoNames postal code format); no network.
+
+    A site is placed at its postal code, or else at the mean of its city's postal code centroids. A city given
+    without a known state is only placed when its name is unique within the country (there are many Springfields).
+    """
+
+    def __init__(self, centroids):
+        self.postal = {}
+        cities = {}
+        regions = {}
+        for code, postal_code, place, admin_name, admin_code, lat, lon in centroids:
+            if postal_code:
+                self.postal.setdefault(f"{code}:{postal_code}", (lat, lon))
+            city = normalize_name(place)
+            if not city:
+                continue
+            # A city is found with its state name or code
+            for region in {region_key(code, admin_name), region_key(code, admin_code)}:
+                total = cities.setdefault((code, region, city), [0.0, 0.0, 0])
+                total[0] += lat
+                total[1] += lon
+                total[2] += 1
+            regions.setdefault((code, city), set()).add(region_key(code, admin_name) or region_key(code, admin_code))
+        self.cities = {key: (lat / count, lon / count) for key, (lat, lon, count) in cities.items()}
+        # ... or by name alone, but only when no other state of the country has a city of that name
+        for (code, city), names in regions.items():
+            if len(names) == 1:
+                self.cities.setdefault((code, "", city), self.cities[(code, names.pop(), city)])
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_CENTROIDS_FILE):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No postal code centroids at {path}. Download a GeoNames postal code file "
+                                    f"(download.geonames.org/export/zip/) and pass it with --centroids.")
+        return cls(read_centroids(path))
+
+    def locate_zip(self, zip_code, country="US"):
+        code = country_code(country)
+        for key in postal_lookup_keys(code, zip_code):
+            if key in self.postal:
+                return self.postal[key]
+        return None
+
+    def locate(self, location):
+        """(lat, lon) of a site, or None when neither its postal code nor its city is known."""
+        zip_code, city, state, country = site_fields(location)
+        code = country_code(country)
+        if not code:
+            return None
+        point = self.locate_zip(zip_code, code) if zip_code else None
+        if point is None and city:
+            point = self.cities.get((code, region_key(code, state), normalize_name(city))) or self.cities.get((code, "", normalize_name(city)))
+        return point
+
+def build_geo_index(studies, geocoder, index_dir=DEFAULT_INDEX_DIR):
+    """Geocode every site of studies (deduplicated by NCTId) and save a grid index of the sites to index_dir.
+
+    Sites are sorted by grid cell, so the sites of cell c are site_*[cell_offsets[c]:cell_offsets[c + 1]].
+    The postal centroids are saved too, so a patient's zip is located without the centroid file.
+    """
+    nct_ids, site_lat, site_lon, site_rows = [], array('d'), array('d'), array('i')
+    seen = set()
+    sites = located = 0
+    study_digests = []
+    for study in studies:
+        study_digests.append(study_digest(study, INDEXED_FIELDS))
+        nct_id = study.get("NCTId")
+        if nct_id in seen:
+            continue
+        seen.add(nct_id)
+        row = len(nct_ids)
+        nct_ids.append(nct_id or "")
+        points = set()
+        for location in study.get("Location") or []:
+            sites += 1
+            point = geocoder.locate(location)
+            if point is not None:
+                located += 1
+                points.add(point)
+        for lat, lon in sorted(points):
+            site_lat.append(lat)
+            site_lon.append(lon)
+            site_rows.append(row)
+
+    site_lat = np.frombuffer(site_lat, dtype=np.float64)
+    site_lon = np.frombuffer(site_lon, dtype=np.float64)
+    cells = grid_cells(site_lat, site_lon)
+    order = np.argsort(cells, kind='stable')
+    cell_offsets = np.zeros(LAT_CELLS * LON_CELLS + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cells, minlength=LAT_CELLS * LON_CELLS), out=cell_offsets[1:])
+
+    postal_keys = sorted(geocoder.postal)
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, "nct_ids.npy"), np.array(nct_ids, dtype=str))
+    np.save(os.path.join(index_dir, "site_lat.npy"), site_lat[order])
+    np.save(os.path.join(index_dir, "site_lon.npy"), site_lon[order])
+    np.save(os.path.join(index_dir, "site_rows.npy"), np.frombuffer(site_rows, dtype=np.int32)[order])
+    np.save(os.path.join(index_dir, "cell_offsets.npy"), cell_offsets)
+    np.save(os.path.join(index_dir, "postal_keys.npy"), np.array([key.encode('utf-8') for key in postal_keys], dtype=bytes))
+    np.save(os.path.join(index_dir, "postal_points.npy"), np.array([geocoder.postal[key] for key in postal_keys], dtype=np.float64).reshape(-1, 2))
+    info = {
+        "documents": len(nct_ids),
+        "sites": sites,
+        "located_sites": located,
+        "indexed_points": len(order),
+        "located_trials": len(np.unique(site_rows)) if len(site_rows) else 0,
+        "postal_codes": len(postal_keys),
+        "cell_degrees": CELL_DEGREES,
+        "nct_digest": nct_id_digest(nct_ids),
+        "content_digest": combine_digests(study_digests),
+    }
+    info_path = os.path.join(index_dir, INDEX_INFO_FILE)
+    with open(info_path + ".tmp", 'w') as file:
+        json.dump(info, file, indent=4)
+    os.replace(info_path + ".tmp", info_path)
+    return info
+
+class GeoIndex:
+    """Radius queries over geocoded trial sites; all arrays are memory-mapped."""
+
+    def __init__(self, index_dir=DEFAULT_INDEX_DIR):
+        with open(os.path.join(index_dir, INDEX_INFO_FILE), 'r') as file:
+            self.info = json.load(file)
+        load = lambda name: np.load(os.path.join(index_dir, name), mmap_mode='r')
+        self.nct_ids = load("nct_ids.npy")
+        self.site_lat = load("site_lat.npy")
+        self.site_lon = load("site_lon.npy")
+        self.site_rows = load("site_rows.npy")
+        self.cell_offsets = load("cell_offsets.npy")
+        self.postal_keys = load("postal_keys.npy")
+        self.postal_points = load("postal_points.npy")
+        self._aligned = {}
+
+    def __len__(self):
+        return self.info["documents"]
+
+    def locate_zip(self, zip_code, country="US"):
+        """(lat, lon) of a postal code from the saved centroids, or None when it is unknown."""
+        for key in postal_lookup_keys(country_code(country), zip_code):
+            encoded = key.encode('utf-8')
+            position = int(np.searchsorted(self.postal_keys, encoded))
+            if position < len(self.postal_keys) and self.postal_keys[position] == encoded:
+                return tuple(float(value) for value in self.postal_points[position])
+        return None
+
+    def _cell_slices(self, lat, lon, radius_miles):
+        """(start, end) ranges of the sorted sites covering every grid cell within radius_miles of the point."""
+        angle = radius_miles / EARTH_RADIUS_MILES
+        lat_low = max(lat - math.degrees(angle), -90)
+        lat_high = min(lat + math.degrees(angle), 90)
+        # Widest longitude offset of the circle; it wraps all the way round when it contains a pole
+        if lat_low <= -90 or lat_high >= 90 or math.sin(angle) >= math.cos(math.radians(lat)):
+            column_spans = [(0, LON_CELLS - 1)]
+        else:
+            lon_offset = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(lat))))
+            first = math.floor((lon - lon_offset + 180) / CELL_DEGREES)
+            last = math.floor((lon + lon_offset + 180) / CELL_DEGREES)
+            if last - first + 1 >= LON_CELLS:
+                column_spans = [(0, LON_CELLS - 1)]
+            elif first % LON_CELLS <= last % LON_CELLS:
+                column_spans = [(first % LON_CELLS, last % LON_CELLS)]
+            else:
+                column_spans = [(first % LON_CELLS, LON_CELLS - 1), (0, last % LON_CELLS)]
+        first_row = min(int((lat_low + 90) // CELL_DEGREES), LAT_CELLS - 1)
+        last_row = min(int((lat_high + 90) // CELL_DEGREES), LAT_CELLS - 1)
+        slices = []
+        for row in range(first_row, last_row + 1):
+            # Cells of one row are adjacent in the sorted sites, so each span is a single slice
+            for first_column, last_column in column_spans:
+                start = self.cell_offsets[row * LON_CELLS + first_column]
+                end = self.cell_offsets[row * LON_CELLS + last_column + 1]
+                if end > start:
+                    slices.append((start, end))
+        return slices
+
+    def _sites_within(self, lat, lon, radius_miles):
+        """(index row, miles) of every site within radius_miles, unordered; a trial appears once per site."""
+        slices = self._cell_slices(lat, lon, radius_miles)
+        if not slices:
+            return np.empty(0, dtype=np.int32), np.empty(0)
+        site_lat = np.concatenate([self.site_lat[start:end] for start, end in slices])
+        site_lon = np.concatenate([self.site_lon[start:end] for start, end in slices])
+        rows = np.concatenate([self.site_rows[start:end] for start, end in slices])
+        miles = haversine_miles(lat, lon, site_lat, site_lon)
+        inside = miles <= radius_miles
+        return rows[inside], miles[inside]
+
+    def nearest_sites(self, lat, lon, radius_miles=DEFAULT_RADIUS_MILES):
+        """(index rows, miles) of the trials with a site within radius_miles, nearest first."""
+        rows, miles = self._sites_within(lat, lon, radius_miles)
+        # Keep each trial's nearest site: after sorting by distance, its first occurrence
+        order = np.lexsort((rows, miles))
+        rows, first = np.unique(rows[order], return_index=True)
+        miles = miles[order][first]
+        order = np.lexsort((rows, miles))
+        return rows[order], miles[order]
+
+    def within(self, lat, lon, radius_miles=DEFAULT_RADIUS_MILES):
+        """(NCTId, miles to the nearest site) of the trials with a site within radius_miles, nearest first."""
+        rows, miles = self.nearest_sites(lat, lon, radius_miles)
+        return [(str(self.nct_ids[row]), float(distance)) for row, distance in zip(rows, miles)]
+
+    def candidate_mask(self, lat, lon, radius_miles=DEFAULT_RADIUS_MILES):
+        """Bool mask over the index rows of trials with a site within radius_miles."""
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self._sites_within(lat, lon, radius_miles)[0]] = True
+        return mask
+
+    def search_mask(self, search_index, lat, lon, radius_miles=DEFAULT_RADIUS_MILES):
+        """candidate_mask translated to the rows of a search_index.SearchIndex."""
+        positions = self._aligned.get(id(search_index))
+        if positions is None:
+            positions = self._aligned[id(search_index)] = search_index.positions_of(self.nct_ids)
+        rows = positions[self._sites_within(lat, lon, radius_miles)[0]]
+        mask = np.zeros(len(search_index), dtype=bool)
+        mask[rows[rows >= 0]] = True
+        return mask
+
+def open_geo_index(index_dir=DEFAULT_INDEX_DIR):
+    if not os.path.exists(os.path.join(index_dir, INDEX_INFO_FILE)):
+        raise FileNotFoundError(f"No geo index found at {index_dir}. Run geo_index.py to build it.")
+    return GeoIndex(index_dir)
+
+def load_or_build_geo_index(studies, index_dir=DEFAULT_INDEX_DIR, centroids_file=DEFAULT_CENTROIDS_FILE):
+    """Open the saved index, rebuilding it when any study's sites changed.
+
+    Returns None when it has to be built but there is no centroid file, so radius search is simply unavailable.
+    """
+    info_path = os.path.join(index_dir, INDEX_INFO_FILE)
+    if os.path.exists(info_path):
+        with open(info_path, 'r') as file:
+            if json.load(file).get("content_digest") == combine_digests(study_digest(study, INDEXED_FIELDS) for study in studies):
+                return GeoIndex(index_dir)
+    if not os.path.exists(centroids_file):
+        print(f"\033[33mNo postal code centroids at {centroids_file}; radius search is disabled.\033[0m")
+        return None
+    print(f"\033[33mBuilding the geo index in {index_dir}...\033[0m")
+    build_geo_index(studies, Geocoder.from_file(centroids_file), index_dir)
+    return GeoIndex(index_dir)
+
+if __name__ == "__main__":
+    from trial_store import iter_cleaned_studies, open_store, DEFAULT_SOURCE_DIR, DEFAULT_STORE_DIR, STORE_INFO_FILE
+
+    parser = argparse.ArgumentParser(description='Build or query the geospatial index of trial sites.')
+    parser.add_argument('--source_dir', default=DEFAULT_SOURCE_DIR, help='Cleaned studies to index (used when there is no trial store).')
+    parser.add_argument('--store_dir', default=DEFAULT_STORE_DIR, help='Consolidated trial store to index when it exists.')
+    parser.add_argument('--index_dir', default=DEFAULT_INDEX_DIR, help='Directory of the saved index.')
+    parser.add_argument('--centroids', default=DEFAULT_CENTROIDS_FILE, help='GeoNames postal code file used to geocode sites.')
+    parser.add_argument('--near', help='Query the saved index: list trials near this zip code instead of building.')
+    parser.add_argument('--country', default='US', help='Country of --near.')
+    parser.add_argument('--radius', type=float, default=DEFAULT_RADIUS_MILES, help='Search radius in miles.')
+    args = parser.parse_args()
+
+    if args.near:
+        index = open_geo_index(args.index_dir)
+        center = index.locate_zip(args.near, args.country)
+        if center is None:
+            parser.error(f"Unknown zip code {args.near} ({args.country}).")
+        start_time = time.perf_counter()
+        results = index.within(*center, args.radius)
+        print(f"\033[92m{len(results)} of {len(index)} trials within {args.radius:g} miles in {(time.perf_counter() - start_time) * 1000:.2f} ms\033[0m")
+        for nct_id, miles in results[:20]:
+            print(f"{nct_id}\t{miles:.1f} mi")
+    else:
+        geocoder = Geocoder.from_file(args.centroids)
+        if os.path.exists(os.path.join(args.store_dir, STORE_INFO_FILE)):
+            studies = open_store(args.store_dir).scan(columns=["NCTId", "Location"])
+        else:
+            studies = iter_cleaned_studies(args.source_dir)
+        start_time = time.time()
+        info = build_geo_index(studies, geocoder, args.index_dir)
+        print(f"\033[92mLocated {info['located_sites']} of {info['sites']} sites ({info['located_trials']} of "
+              f"{info['documents']} trials) in {time.time() - start_time:.1f}s\033[0m")
@@ -1,17 +1,38 @@
 import json
 import os
+import argparse
 from openai import OpenAI
+from trial_store import open_store, DEFAULT_STORE_DIR, STORE_INFO_FILE
+from search_index import load_or_build_search_index, DEFAULT_INDEX_DIR
+from eligibility_index import load_or_build_eligibility_index, add_profile_arguments, profile_from_args
+from geo_index import load_or_build_geo_index, DEFAULT_CENTROIDS_FILE
+from criteria_parser import parsed_criteria, criteria_text
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-# Load your OpenAI API key from an environment variable
-api_key = os.getenv('OPENAI_API_KEY')
-if not api_key:
-    raise ValueError("The OPENAI_API_KEY environment variable is not set.")
+CHAT_MODEL = "gpt-4o"
+MAX_TOKENS = 150
+PROMPT_CRITERIA_ITEMS = 5  # Inclusion/exclusion items per trial in the prompt
+SYSTEM_PROMPT = "You are a helpful assistant."
+NO_MATCHES = "Sorry, no clinical trials found matching your query."
 
-# Initialize the OpenAI client
-client = OpenAI(api_key=api_key)
+client = None
+
+def get_client():
+    """The OpenAI client, created on first use so the module can be imported without an API key."""
+    global client
+    if client is None:
+        # Load your OpenAI API key from an environment variable
+        api_key = os.getenv('OPENAI_API_KEY')
+        if not api_key:
+            raise ValueError("The OPENAI_API_KEY environment variable is not set.")
+        client = OpenAI(api_key=api_key)
+    return client
+
+def load_cleaned_data(cleaned_data_dir, store_dir=None):
+    # Prefer the consolidated trial store when it has been built
+    if store_dir and os.path.exists(os.path.join(store_dir, STORE_INFO_FILE)):
+        return list(open_store(store_dir).scan())
 
-def load_cleaned_data(cleaned_data_dir):
     clinical_trials = []
     for subdir, _, files in os.walk(cleaned_data_dir):
         for file in files:
@@ -22,30 +43,64 @@ def load_cleaned_data(cleaned_data_dir):
                     clinical_trials.extend(data)
     return clinical_trials
 
-def find_clinical_trials(query, clinical_trials):
+def find_clinical_trials(query, clinical_trials, search_index=None, limit=3, candidates=None):
+    # candidates: NCTIds left by the eligibility pre-filter (or its mask over the search index rows), or None
+    # Ranked BM25 search when an index is available; clinical_trials is then a dict keyed by NCTId
+    if search_index is not None:
+        results = search_index.search(query, limit, candidates)
+        return [clinical_trials[nct_id] for nct_id, _ in results if nct_id in clinical_trials]
+
     # Simple keyword matching
+    if candidates is not None:
+        candidates = set(candidates)
+        clinical_trials = [trial for trial in clinical_trials if trial.get("NCTId") in candidates]
     matching_trials = [trial for trial in clinical_trials if query.lower() in json.dumps(trial).lower()]
     return matching_trials
 
-def generate_response(query, clinical_trials):
-    matching_trials = find_clinical_trials(query, clinical_trials)
+def profile_candidates(search_index, eligibility_index, profile, geo_index=None, radius_miles=None):
+    """Search-index mask of the trials a patient could join, or None when the profile is empty.
 
-    if not matching_trials:
-        return "Sorry, no clinical trials found matching your query."
+    With a radius (and a geo index), the patient's zip is the centre of a radius search instead of an exact site match.
+    """
+    mask = None
+    if radius_miles and geo_index is not None and profile.get("zip_code"):
+        center = geo_index.locate_zip(profile["zip_code"], profile.get("country") or "US")
+        if center is None:
+            raise ValueError(f"Unknown zip code {profile['zip_code']}")
+        mask = geo_index.search_mask(search_index, *center, radius_miles)
+        profile = dict(profile, zip_code=None)
+    if eligibility_index is not None and any(profile.values()):
+        eligible = eligibility_index.search_mask(search_index, **profile)
+        mask = eligible if mask is None else mask & eligible
+    return mask
+
+def trial_summary(trial):
+    summary = f"Title: {trial['BriefTitle']}\nSummary: {trial['BriefSummary']}\n"
+    # The parsed criteria (stored by criteria_parser.py, or parsed now) instead of the raw criteria text
+    eligibility = criteria_text(parsed_criteria(trial), PROMPT_CRITERIA_ITEMS)
+    return summary + (f"Eligibility:\n{eligibility}\n" if eligibility else "")
 
+def build_messages(query, matching_trials):
     # Prepare a summary of matching trials
-    summary = "\n".join([f"Title: {trial['BriefTitle']}\nSummary: {trial['BriefSummary']}\n" for trial in matching_trials[:3]])
+    summary = "\n".join([trial_summary(trial) for trial in matching_trials[:3]])
 
     # Use the ChatCompletion API for a better response
     prompt = f"User query: {query}\n\nFound the following clinical trials:\n{summary}\n\nProvide a helpful response to the user."
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+def generate_response(query, clinical_trials, search_index=None, candidates=None):
+    matching_trials = find_clinical_trials(query, clinical_trials, search_index, candidates=candidates)
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=150
+    if not matching_trials:
+        return NO_MATCHES
+
+    response = get_client().chat.completions.create(
+        model=CHAT_MODEL,
+        messages=build_messages(query, matching_trials),
+        max_tokens=MAX_TOKENS
     )
 
     # Print the entire response for debugging
@@ -55,8 +110,33 @@ def generate_response(query, clinical_trials):
     return response.choices[0].message.content.strip()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Recommend clinical trials for a question, interactively or as an HTTP service.')
+    parser.add_argument('--serve', action='store_true', help='Serve concurrent queries over HTTP instead of the interactive prompt.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on with --serve.')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on with --serve.')
+    add_profile_arguments(parser)
+    parser.add_argument('--radius', type=float, help='With --zip, trials with a site within this many miles of it.')
+    parser.add_argument('--centroids', default=DEFAULT_CENTROIDS_FILE, help='GeoNames postal code file used to build the geo index.')
+    args = parser.parse_args()
+
     cleaned_data_dir = 'data/cleaned'
-    clinical_trials = load_cleaned_data(cleaned_data_dir)
+    clinical_trials = load_cleaned_data(cleaned_data_dir, DEFAULT_STORE_DIR)
+    # The index is built once and memory-mapped on later runs; it is rebuilt only when the trials change
+    search_index = load_or_build_search_index(clinical_trials, DEFAULT_INDEX_DIR)
+    eligibility_index = load_or_build_eligibility_index(clinical_trials)
+    geo_index = load_or_build_geo_index(clinical_trials, centroids_file=args.centroids)
+    clinical_trials = {trial.get("NCTId"): trial for trial in clinical_trials}
+
+    if args.serve:
+        from recommendation_server import run_server
+        run_server(clinical_trials, search_index, args.host, args.port, eligibility_index, geo_index)
+        raise SystemExit(0)
+
+    # The patient profile narrows the trials once for the whole session, before any search or LLM call
+    profile = profile_from_args(args)
+    candidates = profile_candidates(search_index, eligibility_index, profile, geo_index, args.radius)
+    if candidates is not None:
+        print(f"{int(candidates.sum())} of {len(clinical_trials)} trials match the patient profile.")
     
     print("Welcome to the Clinical Trials Finder!")
     print("You can ask me about clinical trials for various conditions.")
@@ -68,5 +148,5 @@ if __name__ == "__main__":
             print("Goodbye!")
             break
         
-        response = generate_response(query, clinical_trials)
+        response = generate_response(query, clinical_trials, search_index, candidates)
         print(f"\nGPT: {response}")
@@ -2,6 +2,7 @@
 import os
 import json
 import pandas as pd
+from manifests import nct_id_digest, file_sha256, snapshot_files, verify_group, load_manifest, write_manifest, MANIFEST_FILE
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 cleaned_data_dir = os.path.join(BASE_DIR, 'data', 'cleaned')
@@ -11,9 +12,16 @@ txt_output_dir = os.path.join(BASE_DIR, 'data', 'txt')
 os.makedirs(txt_output_dir, exist_ok=True)
 
 def json_to_txt(directory):
-    """Convert JSON files in a directory to a single TXT file using CSV formatting."""
+    """Convert JSON files in a directory to a single TXT file using CSV formatting.
+
+    Also returns the directory's manifest entry: the source snapshot, record count and NCTId digest
+    next to the TXT file's rows, NCTId digest, size and checksum.
+    """
     data_frames = []
     json_files = []
+    source_files = snapshot_files(directory)
+    source_records = 0
+    source_nct_ids = set()
     for root, _, files in os.walk(directory):
         for file in files:
             if file.endswith('.json'):
@@ -26,7 +34,16 @@ def json_to_txt(directory):
                     else:
                         df = pd.json_normalize([data])
                     data_frames.append(df)
+                    source_records += len(df)
+                    if "NCTId" in df:
+                        source_nct_ids.update(df["NCTId"].astype(str))
 
+    entry = {
+        "source": {"records": source_records, "nct_digest": nct_id_digest(source_nct_ids), "files": source_files},
+        "rows": 0,
+        "nct_digest": nct_id_digest([]),
+        "parts": [],
+    }
     if data_frames:
         merged_df = pd.concat(data_frames, ignore_index=True)
         relative_path = os.path.relpath(directory, cleaned_data_dir)
@@ -36,15 +53,40 @@ def json_to_txt(directory):
         txt_file_path = os.path.join(output_subdir, f"{os.path.basename(relative_path)}_txt.txt")
         merged_df.to_csv(txt_file_path, index=False, sep='\t')
         print(f"Converted {directory} to {txt_file_path}")
-        return txt_file_path, json_files, len(merged_df)
-    return None, json_files, 0
+        entry["rows"] = len(merged_df)
+        if "NCTId" in merged_df:
+            entry["nct_digest"] = nct_id_digest(merged_df["NCTId"].astype(str))
+        entry["parts"].append({
+            "file": os.path.relpath(txt_file_path, txt_output_dir).replace(os.sep, '/'),
+            "rows": len(merged_df),
+            "bytes": os.path.getsize(txt_file_path),
+            "sha256": file_sha256(txt_file_path),
+        })
+        return txt_file_path, json_files, len(merged_df), entry
+    return None, json_files, 0, entry
+
+def check_trials_count(checksums=False):
+    """Check the number of trials listed in each file in both JSON and TXT directories.
 
-def check_trials_count():
-    """Check the number of trials listed in each file in both JSON and TXT directories."""
+    When the TXT manifest is present and still matches the files on disk (sizes and mtimes) the
+    counts come from it; otherwise the JSON and TXT files are parsed as before.
+    """
+    manifest = load_manifest(os.path.join(txt_output_dir, MANIFEST_FILE)) or {"directories": {}}
     for subdir in next(os.walk(cleaned_data_dir))[1]:
         json_dir = os.path.join(cleaned_data_dir, subdir)
         txt_file_path = os.path.join(txt_output_dir, f"{subdir}_txt.txt")
 
+        entry = manifest["directories"].get(subdir)
+        if entry is not None:
+            check = verify_group(entry, json_dir, txt_output_dir, checksums)
+            if not check["stale_sources"] and not check["bad_parts"]:
+                json_count = check["source_records"]
+                txt_count = check["output_rows"]
+                same = json_count == txt_count and check["digest_match"]
+                print(f"{os.path.basename(txt_file_path)}: {txt_count} trials | {subdir} Trials in [dir] : {json_count} :: ({'same number' if same else 'different numbers'})")
+                continue
+            print(f"{subdir} changed since {os.path.basename(txt_file_path)} was written; counting from the files")
+
         # Count trials in JSON files
         json_count = 0
         for root, _, files in os.walk(json_dir):
@@ -65,8 +107,10 @@ def check_trials_count():
 
 def process_all_directories():
     """Process all directories in the cleaned data directory."""
+    directories = {}
     for subdir in next(os.walk(cleaned_data_dir))[1]:
-        json_to_txt(os.path.join(cleaned_data_dir, subdir))
+        directories[subdir] = json_to_txt(os.path.join(cleaned_data_dir, subdir))[3]
+    write_manifest(os.path.join(txt_output_dir, MANIFEST_FILE), {"directories": directories})
     check_trials_count()
 
 if __name__ == "__main__":
@@ -2,17 +2,21 @@
 import os
 import sys
 import json
+import argparse
 import openai
 import config
 from langchain_community.vectorstores import Chroma
 from langchain_community.document_loaders import DirectoryLoader
 from langchain_community.embeddings import OpenAIEmbeddings
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from chroma_store import DEFAULT_PERSIST_DIR, open_collection, add_missing_documents, document_id
+from criteria_parser import rendered_criteria
 
 # Ensure the OpenAI API key is set
 os.environ["OPENAI_API_KEY"] = config.APIKEY
 
 def load_documents_from_directory(directory):
-    """Recursively load documents from directory."""
+    """Recursively load documents (id, text and metadata per study) from directory."""
     documents = []
     for root, _, files in os.walk(directory):
         for file in files:
@@ -26,49 +30,55 @@ def load_documents_from_directory(directory):
                             content = "\n".join([
                                 item.get("BriefTitle", ""),
                                 item.get("BriefSummary", ""),
-                                item.get("EligibilityCriteria", ""),
+                                rendered_criteria(item),
                                 " ".join(cond for cond in item.get("Conditions", [])),
                                 " ".join(key for key in item.get("Keywords", [])),
                                 " ".join(interv.get("Name", "") for interv in item.get("Intervention", []))
                             ])
-                            documents.append(content)
+                            documents.append({
+                                "id": document_id(item.get("NCTId"), content),
+                                "text": content,
+                                "metadata": {
+                                    "NCTId": item.get("NCTId"),
+                                    "BriefTitle": item.get("BriefTitle"),
+                                    "Conditions": item.get("Conditions"),
+                                    "source": os.path.relpath(file_path, directory),
+                                },
+                            })
                     except json.JSONDecodeError as e:
                         print(f"Error decoding JSON from file: {file_path}")
                         print(e)
     return documents
 
-# Check if query is provided
-if len(sys.argv) < 2:
-    print("Usage: python test_LangChain.py <query>")
-    sys.exit(1)
+parser = argparse.ArgumentParser(description='Index the cleaned studies in Chroma and run a similarity search.')
+parser.add_argument('query', help='Text to search for.')
+parser.add_argument('--persist_directory', default=os.path.join(DEFAULT_PERSIST_DIR, 'json'),
+                    help='Directory of the persistent Chroma collection.')
+parser.add_argument('--in_memory', action='store_true', help='Use a throwaway in-memory collection instead.')
+parser.add_argument('--query_only', action='store_true', help='Search the persisted collection without loading new documents.')
+args = parser.parse_args()
+query = args.query
 
-query = sys.argv[1]
+# Initialize OpenAI embeddings, behind the shared embedding cache so unchanged documents are not re-embedded
+embedding_function = CachedEmbeddings(OpenAIEmbeddings(model="text-embedding-ada-002"), EmbeddingCache(), "text-embedding-ada-002")
 
-print("Loading documents from the 'data/cleaned' directory...")
-documents = load_documents_from_directory(os.path.join("data", "cleaned"))
+# Open the Chroma vector store; a persisted collection keeps its documents between runs
+chroma_vector_store = open_collection(embedding_function, None if args.in_memory else args.persist_directory)
 
-if not documents:
-    print("No documents found.")
-    sys.exit(1)
+if not args.query_only:
+    print("Loading documents from the 'data/cleaned' directory...")
+    documents = load_documents_from_directory(os.path.join("data", "cleaned"))
 
-print(f"Number of documents loaded: {len(documents)}")
+    if not documents:
+        print("No documents found.")
+        sys.exit(1)
 
-# Initialize OpenAI embeddings
-embedding_function = OpenAIEmbeddings(model="text-embedding-ada-002")
+    print(f"Number of documents loaded: {len(documents)}")
 
-# Initialize Chroma vector store
-chroma_vector_store = Chroma(collection_name="my_collection", embedding_function=embedding_function)
-
-# Add documents to the vector store
-print("Adding documents to the vector store...")
-for doc in documents:
-    try:
-        print(f"Adding document: {doc[:100]}")  # Print first 100 characters for debugging
-        chroma_vector_store.add_texts([doc])
-    except Exception as e:
-        print(f"Error adding document: {e}")
-
-print("Documents added to the vector store.")
+    # Add only the studies that are not in the collection yet, in batches keyed by NCTId
+    print("Adding documents to the vector store...")
+    add_missing_documents(chroma_vector_store, documents)
+    print("Documents added to the vector store.")
 
 # Perform a search
 print("Performing a similarity search...")
@@ -87,14 +97,14 @@ except Exception as e:
 print("Debugging information:")
 print(f"Query: {query}")
 try:
-    query_embedding = embedding_function.embed([query])
+    query_embedding = embedding_function.embed_query(query)
     print(f"Query Embedding: {query_embedding}")
 except Exception as e:
     print(f"Error generating query embedding: {e}")
 
 # Verify the size of vector store
 try:
-    vector_store_size = len(chroma_vector_store._index)
+    vector_store_size = chroma_vector_store._collection.count()
     print(f"Vector store size: {vector_store_size}")
 except Exception as e:
     print(f"Error checking vector store size: {e}")
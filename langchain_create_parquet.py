@@ -1,68 +1,49 @@
 # ******** Part of Process (not required) ******
 import os
 import sys
-import pandas as pd
+import argparse
 import openai
 import config
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import OpenAIEmbeddings
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from chroma_store import DEFAULT_PERSIST_DIR, open_collection, add_missing_documents
+from parquet_documents import iter_document_batches
 
 # Ensure the OpenAI API key is set
 os.environ["OPENAI_API_KEY"] = config.APIKEY
 
-def load_documents_from_parquet(directory):
-    """Recursively load documents from parquet files in a directory."""
-    documents = []
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file.endswith('.parquet'):
-                file_path = os.path.join(root, file)
-                print(f"Loading document: {file_path}")
-                df = pd.read_parquet(file_path)
-                for _, row in df.iterrows():
-                    content = "\n".join([
-                        row.get("BriefTitle", ""),
-                        row.get("BriefSummary", ""),
-                        row.get("EligibilityCriteria", ""),
-                        " ".join(row.get("Conditions", [])),
-                        " ".join(row.get("Keywords", [])),
-                        " ".join(interv["Name"] for interv in row.get("Intervention", []))
-                    ])
-                    documents.append(content)
-    return documents
+parser = argparse.ArgumentParser(description='Index the Parquet studies in Chroma and run a similarity search.')
+parser.add_argument('query', help='Text to search for.')
+parser.add_argument('--persist_directory', default=os.path.join(DEFAULT_PERSIST_DIR, 'parquet'),
+                    help='Directory of the persistent Chroma collection.')
+parser.add_argument('--in_memory', action='store_true', help='Use a throwaway in-memory collection instead.')
+parser.add_argument('--query_only', action='store_true', help='Search the persisted collection without loading new documents.')
+args = parser.parse_args()
+query = args.query
 
-# Check if query is provided
-if len(sys.argv) < 2:
-    print("Usage: python test_LangChain.py <query>")
-    sys.exit(1)
+# Initialize OpenAI embeddings, behind the shared embedding cache so unchanged documents are not re-embedded
+embedding_function = CachedEmbeddings(OpenAIEmbeddings(model="text-embedding-ada-002"), EmbeddingCache(), "text-embedding-ada-002")
 
-query = sys.argv[1]
+# Open the Chroma vector store; a persisted collection keeps its documents between runs
+chroma_vector_store = open_collection(embedding_function, None if args.in_memory else args.persist_directory)
 
-print("Loading documents from the 'data/apache_parquet' directory...")
-documents = load_documents_from_parquet(os.path.join("data", "apache_parquet"))
+if not args.query_only:
+    print("Loading documents from the 'data/apache_parquet' directory...")
+    # Documents are built column-wise one Parquet record batch at a time and added batch by batch,
+    # so memory stays bounded however many trials there are
+    documents_loaded = 0
+    print("Adding documents to the vector store...")
+    for documents in iter_document_batches(os.path.join("data", "apache_parquet")):
+        documents_loaded += len(documents)
+        add_missing_documents(chroma_vector_store, documents)
 
-if not documents:
-    print("No documents found.")
-    sys.exit(1)
+    if not documents_loaded:
+        print("No documents found.")
+        sys.exit(1)
 
-print(f"Number of documents loaded: {len(documents)}")
-
-# Initialize OpenAI embeddings
-embedding_function = OpenAIEmbeddings(model="text-embedding-ada-002")
-
-# Initialize Chroma vector store
-chroma_vector_store = Chroma(collection_name="my_collection", embedding_function=embedding_function)
-
-# Add documents to the vector store
-print("Adding documents to the vector store...")
-for doc in documents:
-    try:
-        print(f"Adding document: {doc[:100]}")  # Print first 100 characters for debugging
-        chroma_vector_store.add_texts([doc])
-    except Exception as e:
-        print(f"Error adding document: {e}")
-
-print("Documents added to the vector store.")
+    print(f"Number of documents loaded: {documents_loaded}")
+    print("Documents added to the vector store.")
 
 # Perform a search
 print("Performing a similarity search...")
@@ -81,14 +62,14 @@ except Exception as e:
 print("Debugging information:")
 print(f"Query: {query}")
 try:
-    query_embedding = embedding_function.embed([query])
+    query_embedding = embedding_function.embed_query(query)
     print(f"Query Embedding: {query_embedding}")
 except Exception as e:
     print(f"Error generating query embedding: {e}")
 
 # Verify the size of vector store
 try:
-    vector_store_size = len(chroma_vector_store._index)
+    vector_store_size = chroma_vector_store._collection.count()
     print(f"Vector store size: {vector_store_size}")
 except Exception as e:
     print(f"Error checking vector store size: {e}")
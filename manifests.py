@@ -0,0 +1,108 @@
+# ******** Part of Tools ******
+import os
+import json
+import hashlib
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MANIFEST_FILE = "manifest.json"
+CHUNK_SIZE = 1024 * 1024
+
+# A group entry (one condition or one cleaned subdirectory) in a stage manifest looks like:
+# {
+#     "source": {"records": 12, "nct_digest": "...", "files": [{"file": "a.json", "bytes": 10, "mtime_ns": 1}]},
+#     "rows": 12,
+#     "nct_digest": "...",
+#     "parts": [{"file": "asthma/asthma_part_1.txt", "rows": 12, "bytes": 2048, "sha256": "..."}],
+# }
+# Source files are relative to the group's source directory and parts to the stage's output directory.
+
+def nct_id_digest(nct_ids):
+    """Order-independent SHA-256 of a set of NCTIds, so two stages can be compared without the ids themselves."""
+    digest = hashlib.sha256()
+    for nct_id in sorted(set(nct_id or "" for nct_id in nct_ids)):
+        digest.update(nct_id.encode('utf-8'))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+def study_digest(study, fields):
+    """SHA-256 of a study's NCTId and the given fields."""
+    return hashlib.sha256(json.dumps([study.get("NCTId") or "", [study.get(field) for field in fields]], sort_keys=True, default=str).encode('utf-8')).digest()
+
+def combine_digests(study_digests):
+    """Order-independent SHA-256 of a collection of study digests."""
+    digest = hashlib.sha256()
+    for value in sorted(study_digests):
+        digest.update(value)
+    return digest.hexdigest()
+
+def content_digest(studies, fields):
+    """Order-independent digest of every study's NCTId and indexed fields, so an index can tell when any of them changed."""
+    return combine_digests(study_digest(study, fields) for study in studies)
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def snapshot_files(directory, suffix='.json'):
+    """Relative path, size and mtime of every file under directory; stat only, nothing is read."""
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.endswith(suffix):
+                file_path = os.path.join(root, name)
+                stat = os.stat(file_path)
+                files.append({
+                    "file": os.path.relpath(file_path, directory).replace(os.sep, '/'),
+                    "bytes": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                })
+    return sorted(files, key=lambda entry: entry["file"])
+
+def changed_files(recorded, directory, suffix='.json'):
+    """Files added, removed or modified under directory since the snapshot in `recorded` was taken."""
+    current = {entry["file"]: entry for entry in snapshot_files(directory, suffix)}
+    previous = {entry["file"]: entry for entry in recorded}
+    return sorted(
+        name for name in current.keys() | previous.keys()
+        if current.get(name) != previous.get(name)
+    )
+
+def verify_parts(parts, output_dir, checksums=False):
+    """Parts that are missing or whose size (and, with checksums=True, SHA-256) differ from the manifest."""
+    bad_parts = []
+    for part in parts:
+        part_path = os.path.join(output_dir, part["file"])
+        if not os.path.exists(part_path) or os.path.getsize(part_path) != part["bytes"]:
+            bad_parts.append(part["file"])
+        elif checksums and file_sha256(part_path) != part["sha256"]:
+            bad_parts.append(part["file"])
+    return bad_parts
+
+def verify_group(entry, source_dir, output_dir, checksums=False):
+    """Check one manifest group against the files on disk without parsing any of them."""
+    bad_parts = verify_parts(entry["parts"], output_dir, checksums)
+    return {
+        "source_records": entry["source"]["records"],
+        "output_rows": sum(part["rows"] for part in entry["parts"] if part["file"] not in bad_parts),
+        "stale_sources": changed_files(entry["source"]["files"], source_dir),
+        "bad_parts": bad_parts,
+        "digest_match": entry["source"]["nct_digest"] == entry["nct_digest"],
+    }
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r') as file:
+        return json.load(file)
+
+def write_manifest(manifest_path, manifest):
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=4)
+    os.replace(tmp_path, manifest_path)
+    return manifest
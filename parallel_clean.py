@@ -0,0 +1,97 @@
+# ******** Part of Process ******
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_BATCH_SIZE = 500  # Files per worker task
+
+# Function to read and parse JSON data from a file
+def read_json(file_path):
+    with open(file_path, 'r') as file:
+        try:
+            return json.load(file)
+        except json.JSONDecodeError as e:
+            print(f"\033[91mError decoding JSON from file: {file_path}\033[0m")
+            print(e)
+            return None
+
+# Build the '_cleaned.json' path that mirrors a source file
+def cleaned_path_for(file_path, source_dir, target_dir):
+    relative_path = os.path.relpath(file_path, source_dir)
+    return os.path.splitext(os.path.join(target_dir, relative_path))[0] + '_cleaned.json'
+
+# Function to list the JSON files under a directory in a stable order
+def list_json_files(directory):
+    json_files = []
+    for subdir, _, files in os.walk(directory):
+        for file in files:
+            if file.endswith('.json'):
+                json_files.append(os.path.join(subdir, file))
+    return sorted(json_files)
+
+# Worker: clean one batch of files with clean_data and write the batch's own JSONL shard
+def clean_file_batch(clean_data, batch_index, file_paths, source_dir, target_dir, shards_dir):
+    shard_name = f"shard_{batch_index:05d}.jsonl"
+    entries = []
+    with open(os.path.join(shards_dir, shard_name), 'w') as shard:
+        for file_path in file_paths:
+            relative_path = os.path.relpath(file_path, source_dir)
+            raw_json = read_json(file_path)
+            if raw_json is None:
+                entries.append({"source": relative_path, "output": None, "records": 0})
+                continue
+            cleaned_data = clean_data(raw_json)
+
+            # Keep writing the per-study files the later steps read
+            cleaned_file_path = cleaned_path_for(file_path, source_dir, target_dir)
+            os.makedirs(os.path.dirname(cleaned_file_path), exist_ok=True)
+            with open(cleaned_file_path, 'w') as outfile:
+                json.dump(cleaned_data, outfile, indent=4)
+
+            for study in cleaned_data:
+                shard.write(json.dumps(study))
+                shard.write("\n")
+            entries.append({
+                "source": relative_path,
+                "output": os.path.relpath(cleaned_file_path, target_dir),
+                "records": len(cleaned_data),
+            })
+    return {"shard": shard_name, "records": sum(entry["records"] for entry in entries), "files": entries}
+
+# Function to clean all files across a pool of worker processes.
+# clean_data (raw JSON -> list of cleaned studies) must be a module-level function so workers can import it.
+def clean_files_parallel(clean_data, source_dir, target_dir, shards_dir, workers=None, batch_size=DEFAULT_BATCH_SIZE):
+    workers = workers or os.cpu_count() or 1
+    file_paths = list_json_files(source_dir)
+    batches = [file_paths[i:i + batch_size] for i in range(0, len(file_paths), batch_size)]
+    print(f"\033[92mCleaning {len(file_paths)} files in {len(batches)} batches with {workers} workers\033[0m")
+
+    # Start from an empty shard directory so stale shards never reach the manifest
+    os.makedirs(shards_dir, exist_ok=True)
+    for name in os.listdir(shards_dir):
+        if name.startswith('shard_') or name == 'manifest.json':
+            os.remove(os.path.join(shards_dir, name))
+
+    results = [None] * len(batches)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(clean_file_batch, clean_data, index, batch, source_dir, target_dir, shards_dir): index
+            for index, batch in enumerate(batches)
+        }
+        for completed, future in enumerate(as_completed(futures), start=1):
+            results[futures[future]] = future.result()
+            print(f"\033[92mFinished batch {completed}/{len(batches)}\033[0m")
+
+    # Merge step: batches are cut from a sorted file list, so listing them by index is deterministic
+    manifest = {
+        "files": len(file_paths),
+        "records": sum(result["records"] for result in results),
+        "failed": [entry["source"] for result in results for entry in result["files"] if entry["output"] is None],
+        "shards": results,
+    }
+    with open(os.path.join(shards_dir, 'manifest.json'), 'w') as outfile:
+        json.dump(manifest, outfile, indent=4)
+    print(f"\033[92mCleaned {manifest['records']} studies into {len(results)} shards in {shards_dir}\033[0m")
+    return manifest
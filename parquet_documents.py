@@ -0,0 +1,94 @@
+# ******** Part of Tools ******
+import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from chroma_store import document_id
+from criteria_parser import parse_criteria, criteria_text, PARSED_FIELD, RENDERED_FIELD
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_PARQUET_DIR = os.path.join(BASE_DIR, 'data', 'apache_parquet')
+BATCH_SIZE = 10000  # Rows per record batch; bounds memory regardless of file size
+# Document text is these columns joined by newlines, in this order; EligibilityCriteria contributes its parse
+TEXT_COLUMNS = ["BriefTitle", "BriefSummary", "EligibilityCriteria", "Conditions", "Keywords", "Intervention"]
+# The stored rendering of the parse: a field of the EligibilityParsed struct (trial store), or its own
+# dotted column when json_to_parquet.py flattened the records with json_normalize
+RENDERED_COLUMN = f"{PARSED_FIELD}.{RENDERED_FIELD}"
+COLUMNS = ["NCTId"] + TEXT_COLUMNS + [PARSED_FIELD, RENDERED_COLUMN]
+
+def column_text(array, separator=" "):
+    """One string per row for a column: strings as-is, lists joined by separator, null as ""."""
+    if pa.types.is_null(array.type):
+        return pc.fill_null(array.cast(pa.string()), "")
+    if pa.types.is_list(array.type) or pa.types.is_large_list(array.type):
+        if pa.types.is_struct(array.type.value_type):
+            # Intervention: list<struct<Type, Name>> -> list<string> of the names, without leaving Arrow
+            names = pc.struct_field(array.values, "Name")
+            array = type(array).from_arrays(array.offsets, names, mask=array.is_null())
+        array = pc.binary_join(array, separator)
+    elif not pa.types.is_string(array.type):
+        array = pc.cast(array, pa.string())
+    return pc.fill_null(array, "")
+
+def batch_column(batch, name):
+    """A column of the batch, or all nulls when the file does not have it."""
+    return batch.column(name) if name in batch.schema.names else pa.nulls(batch.num_rows)
+
+def stored_criteria_text(batch):
+    """The criteria_text stored with each row's parse, null where the row has none."""
+    if RENDERED_COLUMN in batch.schema.names:
+        return batch.column(RENDERED_COLUMN).cast(pa.string())
+    if PARSED_FIELD in batch.schema.names:
+        parsed = batch.column(PARSED_FIELD)
+        if pa.types.is_struct(parsed.type) and parsed.type.get_field_index(RENDERED_FIELD) >= 0:
+            # A null parse gives a null field
+            return pc.struct_field(parsed, RENDERED_FIELD).cast(pa.string())
+    return pa.nulls(batch.num_rows, pa.string())
+
+def criteria_column_text(batch):
+    """The parsed criteria of every row as compact text.
+
+    The rendering criteria_parser.py stored with the parse is read as a plain column; only rows
+    without one (never annotated, or annotated before it was stored) are parsed and rendered here.
+    """
+    stored = stored_criteria_text(batch)
+    missing = stored.is_null()
+    if not pc.any(missing).as_py():
+        return stored
+    texts = pc.filter(batch_column(batch, "EligibilityCriteria").cast(pa.string()), missing).to_pylist()
+    rendered = pa.array([criteria_text(parse_criteria(text or "")) for text in texts], pa.string())
+    return pc.replace_with_mask(stored, missing, rendered)
+
+def build_document_text(batch):
+    """Document text for every row of a record batch, assembled column by column."""
+    parts = [criteria_column_text(batch) if name == "EligibilityCriteria" else column_text(batch_column(batch, name))
+             for name in TEXT_COLUMNS]
+    return pc.binary_join_element_wise(*parts, "\n")
+
+def iter_document_batches(directory=DEFAULT_PARQUET_DIR, batch_size=BATCH_SIZE):
+    """Yield lists of Chroma documents (id, text, metadata), one list per Parquet record batch.
+
+    Only the columns the documents need are read, so wide files cost no more than narrow ones.
+    """
+    for root, _, files in os.walk(directory):
+        for file in sorted(files):
+            if not file.endswith('.parquet'):
+                continue
+            file_path = os.path.join(root, file)
+            parquet_file = pq.ParquetFile(file_path)
+            columns = [name for name in COLUMNS if name in parquet_file.schema_arrow.names]
+            source = os.path.relpath(file_path, directory)
+            for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+                texts = build_document_text(batch).to_pylist()
+                nct_ids = batch_column(batch, "NCTId").to_pylist()
+                titles = column_text(batch_column(batch, "BriefTitle")).to_pylist()
+                conditions = column_text(batch_column(batch, "Conditions"), "; ").to_pylist()
+                yield [
+                    {
+                        "id": document_id(nct_id, text),
+                        "text": text,
+                        "metadata": {"NCTId": nct_id, "BriefTitle": title, "Conditions": condition, "source": source},
+                    }
+                    for nct_id, text, title, condition in zip(nct_ids, texts, titles, conditions)
+                ]
@@ -0,0 +1,283 @@
+# ******** Part of Tools ******
+import os
+import json
+import time
+import asyncio
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+from openai import AsyncOpenAI
+from embedding_cache import normalize_text
+from gpt_recommendation import find_clinical_trials, build_messages, profile_candidates, CHAT_MODEL, MAX_TOKENS, NO_MATCHES
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+CACHE_ENTRIES = 4096
+CACHE_TTL = 3600  # Seconds an answer is reused for the same question
+LLM_CONCURRENCY = 32  # Chat completions in flight at once; further requests queue
+LATENCY_WINDOW = 10000  # Recent requests the latency percentiles are computed over
+TRIAL_LIMIT = 3
+
+# ANSI escape codes
+GREEN = "\033[92m"
+RESET = "\033[0m"
+
+PROFILE_PARAMETERS = {"gender": str, "age": float, "healthy_volunteer": bool, "country": str, "state": str, "zip": str, "radius": float}
+
+def cache_key(query, profile=None):
+    """Questions that differ only in case or whitespace (and have the same patient profile) share a cache entry."""
+    key = normalize_text(query).lower()
+    if profile:
+        key += "|" + json.dumps(sorted(profile.items()), default=str).lower()
+    return key
+
+def parse_profile(values):
+    """Patient profile from query/JSON parameters (gender, age, healthy_volunteer, country, state, zip, radius)."""
+    profile = {}
+    for name, kind in PROFILE_PARAMETERS.items():
+        value = values.get(name)
+        if value in (None, ""):
+            continue
+        if kind is bool:
+            profile[name] = str(value).lower() in ("1", "true", "yes")
+        else:
+            profile[name] = kind(value)
+    return profile
+
+class ResponseCache:
+    """LRU cache with a time-to-live: normalised query -> (matched NCTIds, generated answer)."""
+
+    def __init__(self, max_entries=CACHE_ENTRIES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            self.entries.pop(key, None)
+            self.stats["misses"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[1]
+
+    def put(self, key, value):
+        self.entries[key] = (time.monotonic(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+class LatencyTracker:
+    """Keeps the most recent request latencies and reports percentiles in milliseconds."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def summary(self):
+        if not self.samples:
+            return {"count": 0}
+        p50, p95, p99 = np.percentile(np.fromiter(self.samples, dtype=float), [50, 95, 99]) * 1000
+        return {"count": len(self.samples), "p50_ms": round(p50, 2), "p95_ms": round(p95, 2), "p99_ms": round(p99, 2)}
+
+class RecommendationService:
+    """Answers recommendation queries from a corpus and search index that stay loaded in memory.
+
+    One AsyncOpenAI client (and its connection pool) is shared by every request.
+    """
+
+    def __init__(self, clinical_trials, search_index, client=None, model=CHAT_MODEL, cache=None,
+                 llm_concurrency=LLM_CONCURRENCY, limit=TRIAL_LIMIT, eligibility_index=None, geo_index=None):
+        self.trials = clinical_trials
+        self.search_index = search_index
+        self.eligibility_index = eligibility_index
+        self.geo_index = geo_index
+        self.client = client or AsyncOpenAI()
+        self.model = model
+        self.cache = cache or ResponseCache()
+        self.semaphore = asyncio.Semaphore(llm_concurrency)
+        self.limit = limit
+        self.in_flight = {}  # cache key -> future set when the request generating that answer finishes
+        self.latency = LatencyTracker()
+        self.first_chunk_latency = LatencyTracker()
+
+    def trial_summaries(self, nct_ids):
+        return [{"NCTId": nct_id, "BriefTitle": self.trials[nct_id].get("BriefTitle")} for nct_id in nct_ids if nct_id in self.trials]
+
+    async def _generate(self, query, matching_trials):
+        async with self.semaphore:
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=build_messages(query, matching_trials),
+                max_tokens=MAX_TOKENS,
+                stream=True,
+            )
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+
+    def candidates(self, profile):
+        """Search-index mask of the trials allowed by the patient profile; None when there is no profile."""
+        if not profile:
+            return None
+        return profile_candidates(
+            self.search_index, self.eligibility_index,
+            {"gender": profile.get("gender"), "age_years": profile.get("age"), "healthy_volunteer": profile.get("healthy_volunteer"),
+             "country": profile.get("country"), "state": profile.get("state"), "zip_code": profile.get("zip")},
+            self.geo_index, profile.get("radius"),
+        )
+
+    async def recommend(self, query, profile=None):
+        """Yield the response as events: the matched trials, answer text deltas, then a final done event."""
+        start_time = time.perf_counter()
+        key = cache_key(query, profile)
+        cached = self.cache.get(key)
+        if cached is None and key in self.in_flight:
+            # The same question is already being answered; wait for it instead of calling the LLM again
+            await asyncio.shield(self.in_flight[key])
+            cached = self.cache.get(key)
+        if cached is not None:
+            nct_ids, answer = cached
+            yield {"trials": self.trial_summaries(nct_ids), "cached": True}
+            self.first_chunk_latency.add(time.perf_counter() - start_time)
+            yield {"delta": answer}
+        else:
+            self.in_flight[key] = in_flight = asyncio.get_running_loop().create_future()
+            try:
+                matching_trials = find_clinical_trials(query, self.trials, self.search_index, self.limit, self.candidates(profile))
+                nct_ids = [trial.get("NCTId") for trial in matching_trials]
+                yield {"trials": self.trial_summaries(nct_ids), "cached": False}
+                parts = []
+                if matching_trials:
+                    async for delta in self._generate(query, matching_trials):
+                        if not parts:
+                            self.first_chunk_latency.add(time.perf_counter() - start_time)
+                        parts.append(delta)
+                        yield {"delta": delta}
+                    answer = "".join(parts).strip()
+                else:
+                    self.first_chunk_latency.add(time.perf_counter() - start_time)
+                    answer = NO_MATCHES
+                    yield {"delta": answer}
+                self.cache.put(key, (nct_ids, answer))
+            finally:
+                # Waiters re-check the cache; if this request failed they generate the answer themselves
+                if self.in_flight.get(key) is in_flight:
+                    del self.in_flight[key]
+                in_flight.set_result(None)
+        self.latency.add(time.perf_counter() - start_time)
+        yield {"done": True}
+
+    def stats(self):
+        return {
+            "trials": len(self.trials),
+            "latency": self.latency.summary(),
+            "first_chunk_latency": self.first_chunk_latency.summary(),
+            "cache": dict(self.cache.stats, entries=len(self.cache.entries)),
+        }
+
+async def read_request(reader):
+    """Parse one HTTP/1.1 request: (method, path, query parameters, body); None on a closed connection."""
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    method, target, _ = request_line.decode('latin-1').split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode('latin-1').partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length") or 0))
+    url = urlsplit(target)
+    return method.upper(), url.path, parse_qs(url.query), body
+
+def write_head(writer, status, content_type, extra=""):
+    reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}[status]
+    writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\nConnection: close\r\n{extra}\r\n".encode('latin-1'))
+
+async def send_json(writer, status, body):
+    payload = json.dumps(body).encode('utf-8')
+    write_head(writer, status, "application/json", f"Content-Length: {len(payload)}\r\n")
+    writer.write(payload)
+    await writer.drain()
+
+async def send_stream(writer, events):
+    """Send events as newline-delimited JSON with chunked transfer encoding, flushing each one."""
+    write_head(writer, 200, "application/x-ndjson", "Transfer-Encoding: chunked\r\n")
+    try:
+        async for event in events:
+            data = (json.dumps(event) + "\n").encode('utf-8')
+            writer.write(f"{len(data):x}\r\n".encode('latin-1') + data + b"\r\n")
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        raise
+    except Exception as e:
+        # Headers are already sent, so the error is reported as the last event
+        data = (json.dumps({"error": f"{e.__class__.__name__}: {e}"}) + "\n").encode('utf-8')
+        writer.write(f"{len(data):x}\r\n".encode('latin-1') + data + b"\r\n")
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+def make_handler(service):
+    async def handle(reader, writer):
+        try:
+            request = await read_request(reader)
+            if request is None:
+                return
+            method, path, params, body = request
+            if path == "/health":
+                await send_json(writer, 200, {"status": "ok", "trials": len(service.trials)})
+            elif path == "/stats":
+                await send_json(writer, 200, service.stats())
+            elif path == "/recommend":
+                if method == "POST":
+                    values = json.loads(body or b"{}")
+                    query = values.get("query", "")
+                elif method == "GET":
+                    values = {name: value[0] for name, value in params.items()}
+                    query = values.get("q", "")
+                else:
+                    await send_json(writer, 405, {"error": "Use GET or POST"})
+                    return
+                if not query.strip():
+                    await send_json(writer, 400, {"error": "Missing query"})
+                    return
+                await send_stream(writer, service.recommend(query, parse_profile(values)))
+            else:
+                await send_json(writer, 404, {"error": f"Unknown path {path}"})
+        except (ValueError, asyncio.IncompleteReadError):
+            await send_json(writer, 400, {"error": "Malformed request"})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+    return handle
+
+async def start_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    return await asyncio.start_server(make_handler(service), host, port)
+
+def run_server(clinical_trials, search_index, host=DEFAULT_HOST, port=DEFAULT_PORT, eligibility_index=None, geo_index=None):
+    """Serve recommendations until interrupted; the corpus and indexes are already loaded by the caller."""
+    async def serve():
+        service = RecommendationService(clinical_trials, search_index, eligibility_index=eligibility_index, geo_index=geo_index)
+        server = await start_server(service, host, port)
+        print(f"{GREEN}Serving {len(clinical_trials)} trials on http://{host}:{port} (GET /recommend?q=..., /stats){RESET}")
+        async with server:
+            await server.serve_forever()
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print("Server stopped.")
@@ -1,7 +1,16 @@
 #!/bin/sh
 
 # Cron job script to run tasks
+# download.py exits with 100 when AllAPIJSON.zip is unchanged upstream,
+# in which case there is nothing new to process.
 /usr/local/bin/python /usr/src/app/download.py
-/usr/local/bin/python /usr/src/app/process_zip.py
+status=$?
+if [ "$status" -eq 100 ]; then
+    echo "AllAPIJSON.zip unchanged upstream; skipping the remaining steps."
+    exit 0
+elif [ "$status" -ne 0 ]; then
+    exit "$status"
+fi
+/usr/local/bin/python /usr/src/app/stream_clean_zip.py
 /usr/local/bin/python /usr/src/app/upload.py
 /usr/local/bin/python /usr/src/app/gpt_recommendation.py
@@ -0,0 +1,223 @@
+# ******** Part of Tools ******
+import os
+import re
+import json
+import time
+import argparse
+from array import array
+from collections import Counter
+import numpy as np
+from manifests import nct_id_digest, study_digest, combine_digests, content_digest
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_INDEX_DIR = os.path.join(BASE_DIR, 'data', 'search_index')
+INDEX_INFO_FILE = "_index.json"
+K1 = 1.2
+B = 0.75
+MAX_TOKEN_LENGTH = 40
+# Repeating a field counts its terms more often, a simple form of BM25F field boosting
+FIELD_WEIGHTS = {"BriefTitle": 3, "Conditions": 3, "Keywords": 2, "Intervention": 2, "BriefSummary": 1}
+INDEXED_FIELDS = tuple(FIELD_WEIGHTS)
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text):
+    return [
+        token for token in TOKEN_PATTERN.findall((text or "").lower())
+        if token not in STOPWORDS and len(token) <= MAX_TOKEN_LENGTH
+    ]
+
+def field_text(study, field):
+    value = study.get(field)
+    if field == "Intervention":
+        return " ".join((item or {}).get("Name") or "" for item in value or [])
+    if isinstance(value, (list, tuple)):
+        return " ".join(item or "" for item in value)
+    return value or ""
+
+def study_terms(study):
+    """Weighted term frequencies of a study over the indexed fields."""
+    counts = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        for token in tokenize(field_text(study, field)):
+            counts[token] += weight
+    return counts
+
+def build_search_index(studies, index_dir=DEFAULT_INDEX_DIR, k1=K1, b=B):
+    """Build a BM25 inverted index over studies (deduplicated by NCTId) and save it to index_dir.
+
+    Postings are stored CSR-style: for the i-th term (terms sorted), its documents and weighted term
+    frequencies are postings_docs / postings_tf[term_offsets[i]:term_offsets[i + 1]].
+    """
+    vocabulary = {}
+    posting_terms, posting_docs, posting_tf = array('i'), array('i'), array('f')
+    nct_ids, doc_lengths = [], array('f')
+    seen = set()
+    study_digests = []
+    for study in studies:
+        study_digests.append(study_digest(study, INDEXED_FIELDS))
+        nct_id = study.get("NCTId")
+        if nct_id in seen:
+            continue
+        seen.add(nct_id)
+        doc = len(nct_ids)
+        nct_ids.append(nct_id or "")
+        counts = study_terms(study)
+        doc_lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            posting_terms.append(vocabulary.setdefault(term, len(vocabulary)))
+            posting_docs.append(doc)
+            posting_tf.append(tf)
+
+    # Renumber terms in sorted order so a query term is found with a binary search of the terms array
+    terms = sorted(vocabulary)
+    new_ids = np.empty(len(vocabulary), dtype=np.int32)
+    new_ids[[vocabulary[term] for term in terms]] = np.arange(len(terms), dtype=np.int32)
+    posting_terms = new_ids[np.frombuffer(posting_terms, dtype=np.int32)]
+    # Documents were appended in order, so a stable sort keeps each posting list sorted by document
+    order = np.argsort(posting_terms, kind='stable')
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(posting_terms, minlength=len(terms)), out=term_offsets[1:])
+
+    doc_lengths = np.frombuffer(doc_lengths, dtype=np.float32)
+    average_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+    # The length normalisation of each document is fixed at build time, so queries only add up terms
+    doc_norms = (k1 * (1 - b + b * doc_lengths / max(average_length, 1e-9))).astype(np.float32)
+
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, "terms.npy"), np.array([term.encode('utf-8') for term in terms], dtype=bytes))
+    np.save(os.path.join(index_dir, "term_offsets.npy"), term_offsets)
+    np.save(os.path.join(index_dir, "postings_docs.npy"), np.frombuffer(posting_docs, dtype=np.int32)[order])
+    np.save(os.path.join(index_dir, "postings_tf.npy"), np.frombuffer(posting_tf, dtype=np.float32)[order])
+    np.save(os.path.join(index_dir, "doc_norms.npy"), doc_norms)
+    np.save(os.path.join(index_dir, "nct_ids.npy"), np.array(nct_ids, dtype=str))
+    info = {
+        "documents": len(nct_ids),
+        "terms": len(terms),
+        "postings": len(order),
+        "average_length": average_length,
+        "k1": k1,
+        "b": b,
+        "nct_digest": nct_id_digest(nct_ids),
+        "content_digest": combine_digests(study_digests),
+    }
+    info_path = os.path.join(index_dir, INDEX_INFO_FILE)
+    with open(info_path + ".tmp", 'w') as file:
+        json.dump(info, file, indent=4)
+    os.replace(info_path + ".tmp", info_path)
+    return info
+
+class SearchIndex:
+    """BM25 search over an index written by build_search_index; all arrays are memory-mapped."""
+
+    def __init__(self, index_dir=DEFAULT_INDEX_DIR):
+        with open(os.path.join(index_dir, INDEX_INFO_FILE), 'r') as file:
+            self.info = json.load(file)
+        load = lambda name: np.load(os.path.join(index_dir, name), mmap_mode='r')
+        self.terms = load("terms.npy")
+        self.term_offsets = load("term_offsets.npy")
+        self.postings_docs = load("postings_docs.npy")
+        self.postings_tf = load("postings_tf.npy")
+        self.doc_norms = load("doc_norms.npy")
+        self.nct_ids = load("nct_ids.npy")
+        self.k1 = self.info["k1"]
+        self._sorted_ids = None
+
+    def __len__(self):
+        return self.info["documents"]
+
+    def term_id(self, term):
+        encoded = term.encode('utf-8')
+        position = int(np.searchsorted(self.terms, encoded))
+        if position < len(self.terms) and self.terms[position] == encoded:
+            return position
+        return None
+
+    def positions_of(self, nct_ids):
+        """Index row of each NCTId, or -1 where it is not indexed."""
+        if self._sorted_ids is None:
+            order = np.argsort(self.nct_ids)
+            self._sorted_ids = (np.asarray(self.nct_ids)[order], order)
+        sorted_ids, order = self._sorted_ids
+        nct_ids = np.asarray(nct_ids, dtype=sorted_ids.dtype)
+        if not len(sorted_ids):
+            return np.full(len(nct_ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(sorted_ids, nct_ids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[positions] == nct_ids, order[positions], -1)
+
+    def search(self, query, k=10, candidates=None):
+        """Top-k (NCTId, BM25 score) pairs, best first.
+
+        candidates optionally restricts the trials considered: NCTIds, or a bool mask over the index rows.
+        """
+        documents = len(self)
+        scores = np.zeros(documents, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.term_id(term)
+            if term_id is None:
+                continue
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            docs = self.postings_docs[start:end]
+            tf = self.postings_tf[start:end]
+            idf = np.log(1 + (documents - (end - start) + 0.5) / ((end - start) + 0.5))
+            # Each document appears once per posting list, so fancy-index += adds correctly
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + self.doc_norms[docs])
+        if candidates is not None:
+            if isinstance(candidates, np.ndarray) and candidates.dtype == bool:
+                allowed = candidates
+            else:
+                positions = self.positions_of(list(candidates))
+                allowed = np.zeros(documents, dtype=bool)
+                allowed[positions[positions >= 0]] = True
+            scores[~allowed] = 0
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.lexsort((matched, -scores[matched]))]
+        return [(str(self.nct_ids[doc]), float(scores[doc])) for doc in matched]
+
+def open_search_index(index_dir=DEFAULT_INDEX_DIR):
+    if not os.path.exists(os.path.join(index_dir, INDEX_INFO_FILE)):
+        raise FileNotFoundError(f"No search index found at {index_dir}. Run search_index.py to build it.")
+    return SearchIndex(index_dir)
+
+def load_or_build_search_index(studies, index_dir=DEFAULT_INDEX_DIR):
+    """Open the saved index, rebuilding it first when it is missing or any indexed field of any study changed."""
+    info_path = os.path.join(index_dir, INDEX_INFO_FILE)
+    if os.path.exists(info_path):
+        with open(info_path, 'r') as file:
+            if json.load(file).get("content_digest") == content_digest(studies, INDEXED_FIELDS):
+                return SearchIndex(index_dir)
+    print(f"\033[33mBuilding the search index in {index_dir}...\033[0m")
+    build_search_index(studies, index_dir)
+    return SearchIndex(index_dir)
+
+if __name__ == "__main__":
+    from trial_store import iter_cleaned_studies, open_store, DEFAULT_SOURCE_DIR, DEFAULT_STORE_DIR, STORE_INFO_FILE
+
+    parser = argparse.ArgumentParser(description='Build or query the BM25 search index over the cleaned studies.')
+    parser.add_argument('--source_dir', default=DEFAULT_SOURCE_DIR, help='Cleaned studies to index (used when there is no trial store).')
+    parser.add_argument('--store_dir', default=DEFAULT_STORE_DIR, help='Consolidated trial store to index when it exists.')
+    parser.add_argument('--index_dir', default=DEFAULT_INDEX_DIR, help='Directory of the saved index.')
+    parser.add_argument('--query', help='Search the saved index instead of building it.')
+    parser.add_argument('--k', type=int, default=10, help='Number of results.')
+    args = parser.parse_args()
+
+    if args.query:
+        index = open_search_index(args.index_dir)
+        start_time = time.perf_counter()
+        results = index.search(args.query, args.k)
+        print(f"\033[92mTop {len(results)} of {len(index)} trials in {(time.perf_counter() - start_time) * 1000:.1f} ms\033[0m")
+        for nct_id, score in results:
+            print(f"{nct_id}\t{score:.3f}")
+    else:
+        if os.path.exists(os.path.join(args.store_dir, STORE_INFO_FILE)):
+            studies = open_store(args.store_dir).scan(columns=["NCTId", *FIELD_WEIGHTS])
+        else:
+            studies = iter_cleaned_studies(args.source_dir)
+        start_time = time.time()
+        info = build_search_index(studies, args.index_dir)
+        print(f"\033[92mIndexed {info['documents']} trials ({info['terms']} terms) in {time.time() - start_time:.1f}s\033[0m")
@@ -6,6 +6,11 @@ import argparse
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+sys.path.append(os.path.dirname(BASE_DIR))
+from condition_matcher import ConditionMatcher, MatchStats, collect_field_values
+from trial_files import iter_json_trials, GroupedFileWriter
+from geo_index import Geocoder, haversine_miles, trial_locations, DEFAULT_CENTROIDS_FILE, DEFAULT_RADIUS_MILES
+
 def print_step(message, step):
     shades_of_green = [
         "\033[32m",  # Green
@@ -17,6 +22,9 @@ def print_step(message, step):
     color = shades_of_green[step % len(shades_of_green)]
     print(f"{color}{message}{reset_color}")
 
+def print_in_green(message):
+    print(f"\033[32m{message}\033[0m")
+
 def print_in_red(message):
     print(f"\033[31m{message}\033[0m")
 
@@ -110,7 +118,75 @@ def save_filtered_data(filtered_data, file_mapping, output_dir):
             with open(output_path, 'w') as file:
                 json.dump(matching_data, file, indent=2)
 
-def main(condition):
+def stream_filter_by_condition(file_trials, condition):
+    """Generator stage: pass through only the trials whose BriefTitle contains the condition."""
+    for file_path, trial in file_trials:
+        if search_in_dict(trial, condition):
+            yield file_path, trial
+
+def stream_split_by_condition(directory, condition, output_dir):
+    """Read, filter and save in one streaming pass; each source file's matches go to a file of the same name."""
+    writer = GroupedFileWriter(output_dir, os.path.basename)
+    for file_path, trial in stream_filter_by_condition(iter_json_trials(directory), condition):
+        writer.add(file_path, trial)
+    writer.flush()
+    return writer.saved
+
+def stream_filter_by_location(file_trials, geocoder, center, radius_miles):
+    """Generator stage: pass through only the trials with a geocoded site within radius_miles of center (lat, lon)."""
+    for file_path, trial in file_trials:
+        for location in trial_locations(trial):
+            point = geocoder.locate(location)
+            if point is not None and haversine_miles(*center, *point) <= radius_miles:
+                yield file_path, trial
+                break
+
+def stream_split_by_location(directory, geocoder, center, radius_miles, output_dir):
+    """Save the trials near center in one streaming pass; each source file's matches go to a file of the same name."""
+    writer = GroupedFileWriter(output_dir, os.path.basename)
+    for file_path, trial in stream_filter_by_location(iter_json_trials(directory), geocoder, center, radius_miles):
+        writer.add(file_path, trial)
+    writer.flush()
+    return writer.saved
+
+def split_by_conditions(directory, conditions, output_base_dir, all_buckets=False):
+    """Match every trial against all conditions in a single pass and save each condition's trials.
+
+    Trials are written per source file as they are read, so the corpus is never held in memory.
+    """
+    matcher = ConditionMatcher(conditions)
+    stats = MatchStats(conditions)
+    output_dirs = [os.path.join(output_base_dir, condition.replace(" ", "_")) for condition in conditions]
+    for output_dir in output_dirs:
+        os.makedirs(output_dir, exist_ok=True)
+
+    for root, _, files in os.walk(directory):
+        for filename in files:
+            if not filename.endswith(".json"):
+                continue
+            file_path = os.path.join(root, filename)
+            try:
+                with open(file_path, 'r') as file:
+                    json_data = json.load(file)
+            except json.JSONDecodeError as e:
+                print(f"Error: The file {file_path} is not a valid JSON file. Error: {e}")
+                continue
+            buckets = {}
+            for trial in json_data if isinstance(json_data, list) else [json_data]:
+                condition_ids = sorted(matcher.find("\n".join(collect_field_values(trial, "BriefTitle"))))
+                if not all_buckets:
+                    condition_ids = condition_ids[:1]
+                stats.record(1, condition_ids)
+                for condition_id in condition_ids:
+                    buckets.setdefault(condition_id, []).append(trial)
+            for condition_id, trials in buckets.items():
+                with open(os.path.join(output_dirs[condition_id], filename), 'w') as file:
+                    json.dump(trials, file, indent=2)
+
+    print_in_green(stats.report())
+    return dict(zip(conditions, stats.counts))
+
+def main(condition, stream=False):
     extract_base_dir = os.path.join(BASE_DIR, '..', 'data', 'extracted')
     output_dir = os.path.join(BASE_DIR, '..', 'data', 'processed', condition.replace(" ", "_"))
 
@@ -131,6 +207,12 @@ def main(condition):
         print_step("The selected directory is empty. Please use the appropriate option in app.py to extract the zip file.", 0)
         sys.exit(0)
 
+    if stream:
+        print_step(f"Streaming trials and filtering by condition '{condition}'...", 1)
+        saved = stream_split_by_condition(extract_to, condition, output_dir)
+        print_in_red(f"Found {saved} trials containing '{condition}'.")
+        return
+
     # Step 1: Read the extracted JSON files
     print_step("Step 1: Reading extracted JSON files...", 1)
     data, file_mapping = read_json_files(extract_to)
@@ -150,7 +232,42 @@ def main(condition):
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Process clinical trial data.')
-    parser.add_argument('condition', type=str, help='The condition to filter the trials by (e.g., "Breast Cancer").')
+    parser.add_argument('condition', type=str, nargs='?', help='The condition to filter the trials by (e.g., "Breast Cancer").')
+    parser.add_argument('--conditions_file', type=str, help='JSON file of conditions to split by in a single pass.')
+    parser.add_argument('--all_buckets', action='store_true', help='With --conditions_file, save a trial under every condition it matches.')
+    parser.add_argument('--stream', action='store_true', help='Filter trials as they are read instead of loading them all into memory.')
+    parser.add_argument('--near', type=str, help='Split out the trials with a site near this zip code instead of by condition.')
+    parser.add_argument('--country', type=str, default='US', help='Country of the --near zip code.')
+    parser.add_argument('--radius', type=float, default=DEFAULT_RADIUS_MILES, help='Distance in miles for --near.')
+    parser.add_argument('--centroids', type=str, default=DEFAULT_CENTROIDS_FILE, help='GeoNames postal code file used to geocode sites.')
 
     args = parser.parse_args()
-    main(args.condition)
+    if args.conditions_file:
+        with open(args.conditions_file, 'r') as file:
+            conditions = list(json.load(file).values())
+        extract_base_dir = os.path.join(BASE_DIR, '..', 'data', 'extracted')
+        directories = list_directories(extract_base_dir)
+        if not directories:
+            print_step("No directories found in the extracted folder. Please use the appropriate option in app.py to extract the zip file.", 0)
+            sys.exit(0)
+        extract_to = os.path.join(extract_base_dir, select_directory(directories))
+        split_by_conditions(extract_to, conditions, os.path.join(BASE_DIR, '..', 'data', 'processed'), args.all_buckets)
+    elif args.near:
+        geocoder = Geocoder.from_file(args.centroids)
+        center = geocoder.locate_zip(args.near, args.country)
+        if center is None:
+            parser.error(f"Unknown zip code {args.near} ({args.country}).")
+        extract_base_dir = os.path.join(BASE_DIR, '..', 'data', 'extracted')
+        directories = list_directories(extract_base_dir)
+        if not directories:
+            print_step("No directories found in the extracted folder. Please use the appropriate option in app.py to extract the zip file.", 0)
+            sys.exit(0)
+        extract_to = os.path.join(extract_base_dir, select_directory(directories))
+        output_dir = os.path.join(BASE_DIR, '..', 'data', 'processed', f"near_{args.near.replace(' ', '_')}_{args.radius:g}mi")
+        print_step(f"Streaming trials and keeping those within {args.radius:g} miles of {args.near}...", 1)
+        saved = stream_split_by_location(extract_to, geocoder, center, args.radius, output_dir)
+        print_in_red(f"Found {saved} trials within {args.radius:g} miles of {args.near}.")
+    elif args.condition:
+        main(args.condition, args.stream)
+    else:
+        parser.error("Provide a condition, --conditions_file or --near.")
@@ -1,11 +1,28 @@
 # ******** Part of Tools ******
 import os
 import json
-import random
 import sys
+import hashlib
+import argparse
+from array import array
+from collections import deque
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+sys.path.append(os.path.dirname(BASE_DIR))
+from trial_files import load_trials, iter_json_trials, GroupedFileWriter
+
+DEFAULT_SHARD_SIZE = 1000  # Trials per output shard
+DEFAULT_BATCH_SIZE = 500  # Files per worker task
+SPLIT_MANIFEST_FILE = "split_manifest.json"
+# Raw studies list conditions under "Condition", cleaned studies under "Conditions"
+STRATIFY_FIELDS = {
+    "condition": ("Condition", "Conditions"),
+    "phase": ("Phase",),
+}
+
 def print_step(message, step):
     shades_of_green = [
         "\033[32m",  # Green
@@ -38,51 +55,211 @@ def select_directory(directories):
         except ValueError:
             print("Invalid input. Please enter a number.")
 
-def read_json_files(directory):
-    data = []
-    file_mapping = {}
-    print(f"Listing files in directory: {directory}")
+def get_nct_id(trial):
+    """Find the NCTId of a raw ({"FullStudy": ...}) or cleaned trial."""
+    if isinstance(trial, dict):
+        if isinstance(trial.get("NCTId"), str):
+            return trial["NCTId"]
+        for value in trial.values():
+            nct_id = get_nct_id(value)
+            if nct_id:
+                return nct_id
+    elif isinstance(trial, list):
+        for item in trial:
+            nct_id = get_nct_id(item)
+            if nct_id:
+                return nct_id
+    return ""
+
+def hash_fraction(key, seed=0):
+    """Map a key to [0, 1) with SHA-256, so the same key lands in the same place on every machine."""
+    digest = hashlib.sha256(f"{seed}:{key}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+def split_key(trial):
+    # Trials without an NCTId are keyed on their content instead
+    return get_nct_id(trial) or json.dumps(trial, sort_keys=True)
+
+def assign_split(trial, seed=0, test_size=0.2):
+    return 'test' if hash_fraction(split_key(trial), seed) < test_size else 'train'
+
+def stream_random_split(directory, output_dir, seed=0, test_size=0.2):
+    """Assign each trial to train or test by a seeded hash of its NCTId while streaming through the files.
+
+    No shuffle and no in-memory corpus: the split is deterministic and uses constant memory.
+    """
+    writers = {
+        suffix: GroupedFileWriter(output_dir, lambda file_path, suffix=suffix: f"{os.path.basename(file_path).split('.')[0]}_{suffix}.json")
+        for suffix in ('train', 'test')
+    }
+    for file_path, trial in iter_json_trials(directory):
+        writers[assign_split(trial, seed, test_size)].add(file_path, trial)
+    for writer in writers.values():
+        writer.flush()
+    return writers['train'].saved, writers['test'].saved
+
+def list_json_files(directory):
+    """Every .json file under directory as a '/'-separated relative path, sorted so the order is the same on every machine."""
+    json_files = []
     for root, _, files in os.walk(directory):
         for filename in files:
             if filename.endswith(".json"):
-                file_path = os.path.join(root, filename)
-                try:
-                    with open(file_path, 'r') as file:
-                        json_data = json.load(file)
-                        if isinstance(json_data, list):
-                            data.extend(json_data)
-                            file_mapping[file_path] = len(json_data)
-                        else:
-                            data.append(json_data)
-                            file_mapping[file_path] = 1
-                except json.JSONDecodeError as e:
-                    print(f"Error: The file {file_path} is not a valid JSON file. Error: {e}")
-                except Exception as e:
-                    print(f"Error: Failed to read file {file_path}. Error: {e}")
-    return data, file_mapping
-
-def random_split(data, test_size=0.2):
-    random.shuffle(data)
-    split_index = int(len(data) * (1 - test_size))
-    train_data = data[:split_index]
-    test_data = data[split_index:]
-    return train_data, test_data
-
-def save_split_data(data, file_mapping, output_dir, suffix):
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    start_idx = 0
-    for file_path, num_items in file_mapping.items():
-        filename = os.path.basename(file_path)
-        output_path = os.path.join(output_dir, f"{filename.split('.')[0]}_{suffix}.json")
-        subset = data[start_idx:start_idx + num_items]
-        start_idx += num_items
-        with open(output_path, 'w') as file:
-            json.dump(subset, file, indent=2)
-        print(f"Saved {len(subset)} items to {output_path}.")
-
-def main():
+                json_files.append(os.path.relpath(os.path.join(root, filename), directory).replace(os.sep, '/'))
+    return sorted(json_files)
+
+def find_field_values(d, field):
+    """Every string stored under `field` (as a string or a list of strings) anywhere in a nested trial."""
+    values = []
+    if isinstance(d, dict):
+        for key, value in d.items():
+            if key == field and isinstance(value, str):
+                values.append(value)
+            elif key == field and isinstance(value, list) and all(isinstance(item, str) for item in value):
+                values.extend(value)
+            elif isinstance(value, (dict, list)):
+                values.extend(find_field_values(value, field))
+    elif isinstance(d, list):
+        for item in d:
+            values.extend(find_field_values(item, field))
+    return values
+
+def get_stratum(trial, stratify=None):
+    """Stratum of a trial: its first listed condition, or its set of phases (e.g. "Phase 1/Phase 2")."""
+    if not stratify:
+        return ""
+    values = []
+    for field in STRATIFY_FIELDS[stratify]:
+        values.extend(find_field_values(trial, field))
+    values = [value.strip() for value in values if value.strip()]
+    if not values:
+        return "unknown"
+    if stratify == "phase":
+        return "/".join(sorted(set(values)))
+    return values[0].lower()
+
+def scan_file_batch(directory, relative_paths, seed=0, stratify=None):
+    """Counting pass worker: the stratum and hash fraction of every trial, file by file, without keeping the trials."""
+    return [
+        [(get_stratum(trial, stratify), hash_fraction(split_key(trial), seed)) for trial in load_trials(os.path.join(directory, relative_path))]
+        for relative_path in relative_paths
+    ]
+
+def stratum_thresholds(strata, fractions, stratum_count, test_size):
+    """Per stratum, the hash fraction of the last trial that goes to test (-1 when none does).
+
+    Ranking a stratum by hash and cutting at round(n * test_size) gives every stratum the requested
+    test fraction, and the cut depends only on the keys and the seed.
+    """
+    order = np.lexsort((fractions, strata))
+    sizes = np.bincount(strata, minlength=stratum_count)
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    thresholds = np.full(stratum_count, -1.0)
+    for stratum, (start, size) in enumerate(zip(starts, sizes)):
+        test_count = round(int(size) * test_size)
+        if test_count:
+            thresholds[stratum] = fractions[order[start + test_count - 1]]
+    return thresholds
+
+def plan_shards(file_paths, file_offsets, chosen, shard_size):
+    """Yield the (file, trial indexes) entries of consecutive fixed-size shards over the chosen trials, in file order."""
+    entries, size = [], 0
+    for file_index, relative_path in enumerate(file_paths):
+        indexes = np.flatnonzero(chosen[file_offsets[file_index]:file_offsets[file_index + 1]]).tolist()
+        while indexes:
+            taken = indexes[:shard_size - size]
+            indexes = indexes[len(taken):]
+            entries.append((relative_path, taken))
+            size += len(taken)
+            if size == shard_size:
+                yield entries
+                entries, size = [], 0
+    if entries:
+        yield entries
+
+def write_shard(directory, output_dir, shard_name, entries):
+    """Writing pass worker: copy the listed (file, trial indexes) into one JSONL shard."""
+    digest = hashlib.sha256()
+    records = 0
+    with open(os.path.join(output_dir, shard_name), 'wb') as shard:
+        for relative_path, indexes in entries:
+            trials = load_trials(os.path.join(directory, relative_path))
+            for index in indexes:
+                line = (json.dumps(trials[index], ensure_ascii=False) + "\n").encode('utf-8')
+                shard.write(line)
+                digest.update(line)
+                records += 1
+    return {"file": shard_name, "records": records, "sha256": digest.hexdigest()}
+
+def collect_shard(output_dir, split, future):
+    shard = future.result()
+    shard["split"] = split
+    print(f"Saved {shard['records']} items to {os.path.join(output_dir, shard['file'])}.")
+    return shard
+
+def sharded_split(directory, output_dir, seed=0, test_size=0.2, stratify=None, shard_size=DEFAULT_SHARD_SIZE, workers=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Deterministic, optionally stratified train/test split written as fixed-size JSONL shards.
+
+    The counting pass reads the files in parallel and keeps only each trial's stratum and the seeded
+    hash of its NCTId (12 bytes a trial). Each stratum (the whole corpus without --stratify) is cut
+    at round(n * test_size) by hash rank, so every condition or phase gets its share of test trials.
+    The writing pass then fills the fixed-size shards in parallel, each worker copying its own slice
+    of the files. Given the same files, seed and options the shards are byte-identical on any machine.
+    """
+    workers = workers or os.cpu_count() or 1
+    file_paths = list_json_files(directory)
+    batches = [file_paths[i:i + batch_size] for i in range(0, len(file_paths), batch_size)]
+
+    os.makedirs(output_dir, exist_ok=True)
+    # Start from an empty output directory so stale shards never reach the manifest
+    for name in os.listdir(output_dir):
+        if name.endswith('.jsonl') or name == SPLIT_MANIFEST_FILE:
+            os.remove(os.path.join(output_dir, name))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Counting pass: strata and hashes, in sorted file order
+        stratum_ids = {}
+        strata, fractions, file_offsets = array('i'), array('d'), [0]
+        for result in executor.map(scan_file_batch, [directory] * len(batches), batches, [seed] * len(batches), [stratify] * len(batches)):
+            for keys in result:
+                for stratum, fraction in keys:
+                    strata.append(stratum_ids.setdefault(stratum, len(stratum_ids)))
+                    fractions.append(fraction)
+                file_offsets.append(len(fractions))
+        strata = np.frombuffer(strata, dtype=np.int32) if strata else np.empty(0, dtype=np.int32)
+        fractions = np.frombuffer(fractions, dtype=np.float64) if fractions else np.empty(0)
+        test = fractions <= stratum_thresholds(strata, fractions, len(stratum_ids), test_size)[strata]
+
+        # Writing pass: shards are independent, so they are written in parallel; a bounded number
+        # are in flight and their results are collected in order
+        planned = ((split, index, entries) for split, chosen in (('train', ~test), ('test', test))
+                   for index, entries in enumerate(plan_shards(file_paths, file_offsets, chosen, shard_size)))
+        pending = deque()
+        shards = []
+        for split, index, entries in planned:
+            pending.append((split, executor.submit(write_shard, directory, output_dir, f"{split}_{index:05d}.jsonl", entries)))
+            while len(pending) > 2 * workers or (pending and pending[0][1].done()):
+                shards.append(collect_shard(output_dir, *pending.popleft()))
+        while pending:
+            shards.append(collect_shard(output_dir, *pending.popleft()))
+
+    test_counts = np.bincount(strata[test], minlength=len(stratum_ids))
+    totals = np.bincount(strata, minlength=len(stratum_ids))
+    manifest = {
+        "seed": seed,
+        "test_size": test_size,
+        "stratify": stratify,
+        "shard_size": shard_size,
+        "files": len(file_paths),
+        "records": {"train": int(len(test) - test.sum()), "test": int(test.sum())},
+        "strata": {name: {"train": int(totals[i] - test_counts[i]), "test": int(test_counts[i])}
+                   for name, i in sorted(stratum_ids.items())},
+        "shards": shards,
+    }
+    with open(os.path.join(output_dir, SPLIT_MANIFEST_FILE), 'w') as file:
+        json.dump(manifest, file, indent=4)
+    return manifest
+
+def main(stream=False, seed=0, test_size=0.2, stratify=None, shard_size=DEFAULT_SHARD_SIZE, workers=None):
     # Adjust the path to the correct directory for extracted data
     extract_base_dir = os.path.join(BASE_DIR, '..', 'data', 'extracted')
     
@@ -104,20 +281,24 @@ def main():
         print_step("The selected directory is empty. Please use the appropriate option in app.py to extract the zip file.", 0)
         sys.exit(0)
 
-    # Step 1: Read the extracted JSON files
-    print_step("Step 1: Reading extracted JSON files...", 1)
-    data, file_mapping = read_json_files(extract_to)
-    print(f"Read {len(data)} trials from extracted JSON files.")
-
-    # Step 2: Randomly split the data
-    print_step("Step 2: Randomly splitting the data...", 2)
-    train_data, test_data = random_split(data, 0.2)
-    print(f"Split data into {len(train_data)} training and {len(test_data)} testing items.")
+    if stream:
+        print_step(f"Streaming trials into train/test by hash of NCTId (seed {seed})...", 1)
+        train_count, test_count = stream_random_split(extract_to, output_dir, seed, test_size)
+        print(f"Split data into {train_count} training and {test_count} testing items.")
+        return
 
-    # Step 3: Save the split data
-    print_step("Step 3: Saving the split data...", 3)
-    save_split_data(train_data, file_mapping, output_dir, 'train')
-    save_split_data(test_data, file_mapping, output_dir, 'test')
+    print_step(f"Splitting trials by hash of NCTId (seed {seed}, stratify by {stratify or 'nothing'})...", 1)
+    manifest = sharded_split(extract_to, output_dir, seed, test_size, stratify, shard_size, workers)
+    print(f"Split data into {manifest['records']['train']} training and {manifest['records']['test']} testing items "
+          f"in {len(manifest['shards'])} shards.")
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Split the extracted trials into training and testing sets.')
+    parser.add_argument('--stream', action='store_true', help='Keep one output file per source file instead of writing fixed-size shards (each trial is tested against test_size on its own; no stratification).')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the hash-based assignment.')
+    parser.add_argument('--test_size', type=float, default=0.2, help='Fraction of trials that go to the test set.')
+    parser.add_argument('--stratify', choices=sorted(STRATIFY_FIELDS), default=None, help='Give every condition or phase its own test_size share of test trials.')
+    parser.add_argument('--shard_size', type=int, default=DEFAULT_SHARD_SIZE, help='Number of trials per output shard.')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: CPU count).')
+    args = parser.parse_args()
+    main(args.stream, args.seed, args.test_size, args.stratify, args.shard_size, args.workers)
@@ -6,6 +6,19 @@ import argparse
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Fields searched for the target string
+TARGET_FIELDS = {
+    "BriefTitle",
+    "OfficialTitle",
+    "BriefSummary",
+    "DetailedDescription",
+    "Condition",
+    "ConditionMeshTerm"
+}
+
+sys.path.append(os.path.dirname(BASE_DIR))
+from trial_files import iter_json_trials
+
 def print_step(message, step):
     shades_of_green = [
         "\033[32m",  # Green
@@ -77,15 +90,6 @@ def search_target_string(value, target_string):
     return False
 
 def print_and_save_fields(data, file_mapping, output_dir, target_string):
-    target_fields = {
-        "BriefTitle",
-        "OfficialTitle",
-        "BriefSummary",
-        "DetailedDescription",
-        "Condition",
-        "ConditionMeshTerm"
-    }
-
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
@@ -101,7 +105,7 @@ def print_and_save_fields(data, file_mapping, output_dir, target_string):
                 items_to_check = [json_data]
                 
             for item in items_to_check:
-                matches = find_in_nested_dict(item, target_fields)
+                matches = find_in_nested_dict(item, TARGET_FIELDS)
                 save_item = False
                 for field, value in matches.items():
                     if isinstance(value, list):
@@ -118,9 +122,37 @@ def print_and_save_fields(data, file_mapping, output_dir, target_string):
 
     print_in_red(f"Processed {total_files} files. Found {found_files} files containing '{target_string}'.")
 
+def stream_print_and_save_fields(directory, output_dir, target_string):
+    """Streaming variant of print_and_save_fields: each trial is checked and saved as it is read."""
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    found_files = 0
+    total_trials = 0
+    for file_path, item in iter_json_trials(directory):
+        total_trials += 1
+        matches = find_in_nested_dict(item, TARGET_FIELDS)
+        save_item = False
+        for field, value in matches.items():
+            if isinstance(value, list):
+                value = ', '.join(value)
+            if search_target_string(value, target_string):
+                print_in_green(f"Field '{field}': {value}")
+                save_item = True
+
+        if save_item:
+            save_path = os.path.join(output_dir, os.path.basename(file_path))
+            with open(save_path, 'w') as save_file:
+                json.dump(item, save_file, indent=2)
+            found_files += 1
+
+    print_in_red(f"Processed {total_trials} trials. Found {found_files} files containing '{target_string}'.")
+    return found_files
+
 def main():
     parser = argparse.ArgumentParser(description='Search and process JSON files for a specific string.')
     parser.add_argument('search_string', type=str, help='The string to search for in the JSON files.')
+    parser.add_argument('--stream', action='store_true', help='Check trials as they are read instead of loading them all into memory.')
     args = parser.parse_args()
 
     extract_base_dir = os.path.join(BASE_DIR, '..', 'data', 'extracted')
@@ -144,6 +176,11 @@ def main():
         print_step("The selected directory is empty. Please use the appropriate option in app.py to extract the zip file.", 0)
         sys.exit(0)
 
+    if args.stream:
+        print_step(f"Streaming trials and saving those containing '{args.search_string}'...", 1)
+        stream_print_and_save_fields(extract_to, output_dir, args.search_string)
+        return
+
     # Step 1: Read the extracted JSON files
     print_step("Step 1: Reading extracted JSON files...", 1)
     data, file_mapping = read_json_files(extract_to)
@@ -0,0 +1,144 @@
+# ******** Part of Process ******
+import os
+import sys
+import json
+import time
+import argparse
+import zipfile
+from clean_files import clean_data
+from extract_zip import is_valid_zip, zip_fingerprint
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_ZIP_PATH = os.path.join(BASE_DIR, 'data', 'raw', 'AllAPIJSON.zip')
+DEFAULT_OUTPUT_DIR = os.path.join(BASE_DIR, 'data', 'cleaned_jsonl')
+SHARD_RECORDS = 50000  # Cleaned studies per JSONL shard
+MANIFEST_FILE = "manifest.json"
+
+# ANSI escape codes
+GREEN = "\033[92m"
+RED = "\033[91m"
+RESET = "\033[0m"
+
+class ShardWriter:
+    """Append cleaned studies to numbered JSONL shards, starting a new shard every shard_records lines."""
+
+    def __init__(self, output_dir, shard_records=SHARD_RECORDS, prefix="cleaned"):
+        self.output_dir = output_dir
+        self.shard_records = shard_records
+        self.prefix = prefix
+        self.shards = []
+        self.file = None
+        self.records_in_shard = 0
+
+    def _open_next_shard(self):
+        self.close()
+        shard_name = f"{self.prefix}_{len(self.shards):05d}.jsonl"
+        self.file = open(os.path.join(self.output_dir, shard_name), 'w', encoding='utf-8')
+        self.shards.append({"file": shard_name, "records": 0})
+        self.records_in_shard = 0
+
+    def write(self, record):
+        if self.file is None or self.records_in_shard >= self.shard_records:
+            self._open_next_shard()
+        self.file.write(json.dumps(record, ensure_ascii=False))
+        self.file.write("\n")
+        self.records_in_shard += 1
+        self.shards[-1]["records"] += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def iter_zip_members(zip_ref):
+    """Yield the JSON members of the archive, skipping macOS metadata and directories."""
+    for info in zip_ref.infolist():
+        if info.is_dir() or info.filename.startswith('__MACOSX/') or not info.filename.endswith('.json'):
+            continue
+        yield info
+
+def stream_clean_zip(zip_path, output_dir, shard_records=SHARD_RECORDS, force=False):
+    """Clean every study in the archive straight from the zip and write the results as JSONL shards.
+
+    Returns the manifest dict, or None if the archive is invalid or was already processed.
+    """
+    if not is_valid_zip(zip_path):
+        print(f"{RED}{zip_path} is not a valid zip file.{RESET}")
+        return None
+
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    source = zip_fingerprint(zip_path)
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as file:
+            previous = json.load(file)
+        if previous.get("source") == source:
+            print(f"{GREEN}{zip_path} is unchanged since the last run; skipping.{RESET}")
+            return None
+
+    os.makedirs(output_dir, exist_ok=True)
+    # Drop shards from a previous run so the output only reflects this archive
+    for name in os.listdir(output_dir):
+        if name.endswith('.jsonl') or name == MANIFEST_FILE:
+            os.remove(os.path.join(output_dir, name))
+
+    writer = ShardWriter(output_dir, shard_records)
+    members = 0
+    failed = []
+    start_time = time.time()
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            for info in iter_zip_members(zip_ref):
+                members += 1
+                try:
+                    with zip_ref.open(info) as member:
+                        raw_json = json.load(member)
+                except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                    print(f"{RED}Error decoding JSON from member: {info.filename}{RESET}")
+                    print(e)
+                    failed.append(info.filename)
+                    continue
+                for cleaned_study in clean_data(raw_json):
+                    writer.write(cleaned_study)
+                if members % 10000 == 0:
+                    elapsed = time.time() - start_time
+                    print(f"{GREEN}Cleaned {members} members ({members / elapsed:.0f}/s){RESET}")
+    finally:
+        writer.close()
+
+    manifest = {
+        "source": source,
+        "members": members,
+        "records": sum(shard["records"] for shard in writer.shards),
+        "failed": failed,
+        "shards": writer.shards,
+    }
+    with open(manifest_path, 'w') as file:
+        json.dump(manifest, file, indent=4)
+
+    elapsed = time.time() - start_time
+    print(f"{GREEN}Cleaned {manifest['records']} studies from {members} members into {len(writer.shards)} shards in {elapsed:.1f}s{RESET}")
+    return manifest
+
+def iter_cleaned_records(output_dir):
+    """Read the cleaned studies back from the JSONL shards, in shard order."""
+    with open(os.path.join(output_dir, MANIFEST_FILE), 'r') as file:
+        manifest = json.load(file)
+    for shard in manifest["shards"]:
+        with open(os.path.join(output_dir, shard["file"]), 'r', encoding='utf-8') as file:
+            for line in file:
+                yield json.loads(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Clean studies directly from AllAPIJSON.zip into JSONL shards without extracting it.')
+    parser.add_argument('--zip_path', default=DEFAULT_ZIP_PATH, help='Path to the downloaded ZIP file.')
+    parser.add_argument('--output_dir', default=DEFAULT_OUTPUT_DIR, help='Directory for the cleaned JSONL shards.')
+    parser.add_argument('--shard_records', type=int, default=SHARD_RECORDS, help='Number of studies per shard.')
+    parser.add_argument('--force', action='store_true', help='Process the archive even if it is unchanged.')
+    args = parser.parse_args()
+
+    print(f"{GREEN}Starting to stream {args.zip_path}...{RESET}")
+    manifest = stream_clean_zip(args.zip_path, args.output_dir, args.shard_records, args.force)
+    if manifest is not None and manifest["failed"]:
+        sys.exit(1)
+    print(f"{GREEN}Finished streaming.{RESET}")
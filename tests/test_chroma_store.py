@@ -0,0 +1,61 @@
+import unittest
+import numpy as np
+from chroma_store import add_missing_documents, clean_metadata, document_id, text_hash, TEXT_HASH_KEY
+
+class FakeStore:
+    """Implements the Chroma calls chroma_store uses: get(ids=...), delete(ids=...) and add_texts."""
+
+    def __init__(self):
+        self.documents = {}
+        self.add_calls = 0
+
+    def get(self, ids, include):
+        found = [doc_id for doc_id in ids if doc_id in self.documents]
+        return {"ids": found, "metadatas": [self.documents[doc_id][1] for doc_id in found]}
+
+    def delete(self, ids):
+        for doc_id in ids:
+            del self.documents[doc_id]
+
+    def add_texts(self, texts, metadatas, ids):
+        self.add_calls += 1
+        for text, metadata, doc_id in zip(texts, metadatas, ids):
+            self.documents[doc_id] = (text, metadata)
+
+class TestChromaStore(unittest.TestCase):
+    def documents(self, count):
+        return [{"id": document_id(f"NCT{i:08d}", f"text {i}"), "text": f"text {i}",
+                 "metadata": {"NCTId": f"NCT{i:08d}", "Conditions": ["Asthma", "COPD"], "BriefTitle": None}}
+                for i in range(count)]
+
+    def test_adds_in_batches_and_skips_existing(self):
+        store = FakeStore()
+        self.assertEqual(add_missing_documents(store, self.documents(25), batch_size=10), 25)
+        self.assertEqual(store.add_calls, 3)
+        self.assertEqual(store.documents["NCT00000003"][1], {"NCTId": "NCT00000003", "Conditions": "Asthma; COPD",
+                                                             TEXT_HASH_KEY: text_hash("text 3")})
+        # A second run only adds the new documents
+        self.assertEqual(add_missing_documents(store, self.documents(30) + self.documents(30), batch_size=10), 5)
+        self.assertEqual(store.add_calls, 4)
+        self.assertEqual(len(store.documents), 30)
+
+    def test_replaces_documents_whose_text_changed(self):
+        store = FakeStore()
+        add_missing_documents(store, self.documents(5))
+        store.documents["NCT00000004"] = ("text 4", {"NCTId": "NCT00000004"})  # Stored before hashes were kept
+        documents = self.documents(5)
+        documents[1]["text"] = "text 1, amended"
+        self.assertEqual(add_missing_documents(store, documents), 2)
+        self.assertEqual(store.documents["NCT00000001"][0], "text 1, amended")
+        self.assertEqual(store.documents["NCT00000001"][1][TEXT_HASH_KEY], text_hash("text 1, amended"))
+        self.assertEqual(store.documents["NCT00000004"][1][TEXT_HASH_KEY], text_hash("text 4"))
+        self.assertEqual(add_missing_documents(store, documents), 0)
+
+    def test_document_id_and_metadata(self):
+        self.assertEqual(document_id("NCT01234567", "anything"), "NCT01234567")
+        self.assertEqual(document_id(None, "same text"), document_id("", "same text"))
+        self.assertTrue(document_id(None, "same text").startswith("sha256:"))
+        self.assertEqual(clean_metadata({"Conditions": np.array(["A", "B"]), "rows": np.int64(3)}), {"Conditions": "A; B", "rows": 3})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from clean_files import clean_data, process_all_files_parallel
+
+def make_study(nct_id):
+    return {"FullStudy": {"Study": {"ProtocolSection": {"IdentificationModule": {"NCTId": nct_id, "BriefTitle": f"Title {nct_id}"}}}}}
+
+class TestProcessAllFilesParallel(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.work_dir, "processed")
+        self.target_dir = os.path.join(self.work_dir, "cleaned")
+        self.shards_dir = os.path.join(self.work_dir, "cleaned_shards")
+        self.nct_ids = [f"NCT{index:08d}" for index in range(7)]
+        for nct_id in self.nct_ids:
+            os.makedirs(os.path.join(self.source_dir, nct_id[:7] + "xxxx"), exist_ok=True)
+            with open(os.path.join(self.source_dir, nct_id[:7] + "xxxx", f"{nct_id}.json"), 'w') as file:
+                json.dump(make_study(nct_id), file)
+        with open(os.path.join(self.source_dir, "broken.json"), 'w') as file:
+            file.write("{")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def run_parallel(self):
+        return process_all_files_parallel(workers=2, batch_size=3, source_dir=self.source_dir,
+                                          target_dir=self.target_dir, shards_dir=self.shards_dir)
+
+    def test_shards_and_files_match_serial_cleaning(self):
+        manifest = self.run_parallel()
+        self.assertEqual(manifest["files"], 8)
+        self.assertEqual(manifest["records"], 7)
+        self.assertEqual(manifest["failed"], ["broken.json"])
+        self.assertEqual([shard["shard"] for shard in manifest["shards"]], ["shard_00000.jsonl", "shard_00001.jsonl", "shard_00002.jsonl"])
+
+        records = []
+        for shard in manifest["shards"]:
+            with open(os.path.join(self.shards_dir, shard["shard"])) as file:
+                records.extend(json.loads(line) for line in file)
+        self.assertEqual([record["NCTId"] for record in records], self.nct_ids)
+
+        with open(os.path.join(self.target_dir, "NCT0000xxxx", "NCT00000003_cleaned.json")) as file:
+            self.assertEqual(json.load(file), clean_data(make_study("NCT00000003")))
+
+    def test_manifest_is_deterministic(self):
+        first = self.run_parallel()
+        second = self.run_parallel()
+        self.assertEqual(first, second)
+
+if __name__ == "__main__":
+    unittest.main()
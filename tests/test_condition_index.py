@@ -0,0 +1,75 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_batch'))
+from condition_index import load_or_build_index, resolve_condition, save_index, TERM_LOOKUP_KEY
+from step_2_split_by_condition import split_with_index, move_files_by_condition
+
+TITLES = {
+    "NCT00000001": "Early Alzheimer's Disease Study",
+    "NCT00000002": "Breast Cancer Screening",
+    "NCT00000003": "Metastatic breast cancers in older women",
+    "NCT00000004": "Heart Failure",
+}
+
+class TestConditionIndex(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.cleaned_dir = os.path.join(self.work_dir, "cleaned")
+        self.categorized_dir = os.path.join(self.work_dir, "categorized_conditions")
+        self.index_path = os.path.join(self.work_dir, "condition_index.json")
+        for nct_id, title in TITLES.items():
+            os.makedirs(os.path.join(self.cleaned_dir, "NCT0000xxxx"), exist_ok=True)
+            with open(os.path.join(self.cleaned_dir, "NCT0000xxxx", f"{nct_id}_cleaned.json"), 'w') as file:
+                json.dump([{"NCTId": nct_id, "BriefTitle": title, "Conditions": ["Cardiomyopathy"] if nct_id == "NCT00000004" else []}], file)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def matched(self, index, condition, fields=("BriefTitle",)):
+        return sorted(index["nct_ids"][doc_id][0] for doc_id in resolve_condition(index, condition, fields))
+
+    def test_matches_agree_with_substring_search(self):
+        index = load_or_build_index(self.cleaned_dir, self.index_path)
+        self.assertEqual(self.matched(index, "Alzheimer"), ["NCT00000001"])
+        self.assertEqual(self.matched(index, "Alzheimer's"), ["NCT00000001"])
+        self.assertEqual(self.matched(index, "Breast Cancer"), ["NCT00000002", "NCT00000003"])
+        self.assertEqual(self.matched(index, "reast canc"), ["NCT00000002", "NCT00000003"])
+        self.assertEqual(self.matched(index, "Cardiomyopathy"), [])
+        self.assertEqual(self.matched(index, "Cardiomyopathy", ("Conditions",)), ["NCT00000004"])
+
+    def test_term_lookup_agrees_with_scanning_every_document(self):
+        index = load_or_build_index(self.cleaned_dir, self.index_path)
+        titles = [index["texts"]["BriefTitle"][doc_id] for doc_id in range(len(index["files"]))]
+        for condition in ("cancer", "ANCE", "a", "st canc", "cancers in old", "breast cancer screening",
+                          "breast cancers in older women", "s in o", "heart fail", "art fail", "east scree", "xyz", ""):
+            expected = {doc_id for doc_id, title in enumerate(titles) if condition.lower() in title}
+            self.assertEqual(resolve_condition(index, condition), expected, condition)
+        # The lookup tables are rebuilt in memory and never saved
+        save_index(index, self.index_path)
+        self.assertNotIn(TERM_LOOKUP_KEY, load_or_build_index(self.cleaned_dir, self.index_path))
+
+    def test_split_matches_per_condition_moves(self):
+        expected_dir = os.path.join(self.work_dir, "expected")
+        shutil.copytree(self.cleaned_dir, os.path.join(self.work_dir, "cleaned_copy"))
+        for condition in ("Breast Cancer", "Breast", "Alzheimer"):
+            move_files_by_condition(os.path.join(self.work_dir, "cleaned_copy"), condition,
+                                    os.path.join(expected_dir, condition.replace(" ", "_").lower()))
+
+        counts = split_with_index(["Breast Cancer", "Breast", "Alzheimer"], cleaned_data_dir=self.cleaned_dir,
+                                  categorized_dir=self.categorized_dir, index_path=self.index_path)
+        self.assertEqual(counts, {"Breast Cancer": 2, "Breast": 0, "Alzheimer": 1})
+        for condition_dir in ("breast_cancer", "alzheimer"):
+            self.assertEqual(sorted(os.listdir(os.path.join(self.categorized_dir, condition_dir, "NCT0000xxxx"))),
+                             sorted(os.listdir(os.path.join(expected_dir, condition_dir, "NCT0000xxxx"))))
+
+        # The saved index now describes only the files left behind and is reused as is
+        index = load_or_build_index(self.cleaned_dir, self.index_path)
+        self.assertEqual(index["nct_ids"], [["NCT00000004"]])
+
+if __name__ == "__main__":
+    unittest.main()
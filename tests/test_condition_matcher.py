@@ -0,0 +1,65 @@
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'app_batch'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'split_zip_data_for_test'))
+from condition_matcher import ConditionMatcher
+from step_2_split_by_condition import split_with_matcher
+from split_out_condition import split_by_conditions
+
+class TestConditionMatcher(unittest.TestCase):
+    def test_agrees_with_substring_search(self):
+        rng = random.Random(7)
+        for _ in range(2000):
+            conditions = ["".join(rng.choice("abc") for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 6))]
+            text = "".join(rng.choice("abcABC '") for _ in range(rng.randint(0, 30)))
+            expected = {index for index, condition in enumerate(conditions) if condition.lower() in text.lower()}
+            self.assertEqual(ConditionMatcher(conditions).find(text), expected)
+
+    def test_overlapping_conditions(self):
+        matcher = ConditionMatcher(["Breast Cancer", "Breast", "Cancer", "Alzheimer's"])
+        self.assertEqual(matcher.find("Metastatic BREAST CANCER"), {0, 1, 2})
+        self.assertEqual(matcher.find("Early Alzheimer's"), {3})
+
+class TestSinglePassSplits(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.cleaned_dir = os.path.join(self.work_dir, "cleaned")
+        os.makedirs(self.cleaned_dir)
+        titles = {"NCT00000001": "Breast Cancer Screening", "NCT00000002": "Alzheimer Disease", "NCT00000003": "Heart Failure"}
+        for nct_id, title in titles.items():
+            with open(os.path.join(self.cleaned_dir, f"{nct_id}_cleaned.json"), 'w') as file:
+                json.dump([{"NCTId": nct_id, "BriefTitle": title}], file)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_first_matching_condition_wins(self):
+        categorized_dir = os.path.join(self.work_dir, "categorized")
+        counts = split_with_matcher(["Breast", "Breast Cancer", "Alzheimer"], cleaned_data_dir=self.cleaned_dir, categorized_dir=categorized_dir)
+        self.assertEqual(counts, {"Breast": 1, "Breast Cancer": 0, "Alzheimer": 1})
+        self.assertEqual(os.listdir(self.cleaned_dir), ["NCT00000003_cleaned.json"])
+
+    def test_all_buckets_copies_to_every_match(self):
+        categorized_dir = os.path.join(self.work_dir, "categorized")
+        counts = split_with_matcher(["Breast", "Breast Cancer"], all_buckets=True, cleaned_data_dir=self.cleaned_dir, categorized_dir=categorized_dir)
+        self.assertEqual(counts, {"Breast": 1, "Breast Cancer": 1})
+        for condition_dir in ("breast", "breast_cancer"):
+            self.assertEqual(os.listdir(os.path.join(categorized_dir, condition_dir)), ["NCT00000001_cleaned.json"])
+        self.assertNotIn("NCT00000001_cleaned.json", os.listdir(self.cleaned_dir))
+
+    def test_split_out_condition_writes_each_bucket(self):
+        output_dir = os.path.join(self.work_dir, "processed")
+        counts = split_by_conditions(self.cleaned_dir, ["Breast", "Breast Cancer", "Heart"], output_dir, all_buckets=True)
+        self.assertEqual(counts, {"Breast": 1, "Breast Cancer": 1, "Heart": 1})
+        with open(os.path.join(output_dir, "Breast_Cancer", "NCT00000001_cleaned.json")) as file:
+            self.assertEqual(json.load(file)[0]["NCTId"], "NCT00000001")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from criteria_parser import (parse_criteria, split_criteria, criteria_hash, parsed_criteria, annotate_directory,
+                             criteria_text, rendered_criteria, CriteriaCache, PARSED_FIELD, RENDERED_FIELD)
+from gpt_recommendation import build_messages
+
+CRITERIA = """Inclusion Criteria:
+
+  * Men and women 18 to 65 years of age
+  * Body mass index (BMI) between 18.5 and 35 kg/m2
+  * HbA1c >=7.0% and <=10.5% at screening; eGFR > 45 mL/min/1.73m2
+  * ECOG performance status of 0, 1 or 2
+  * Able to give informed consent and
+    willing to comply with the protocol
+
+Exclusion Criteria:
+
+  1. Life expectancy less than 3 months
+  2. Karnofsky score 60 or less
+  3. Pregnancy
+"""
+
+def bounds(parsed):
+    return [(c["measure"], c["section"], c["min"], c["max"], c["unit"]) for c in parsed["constraints"]]
+
+class TestParseCriteria(unittest.TestCase):
+    def test_sections_and_items(self):
+        parsed = parse_criteria(CRITERIA)
+        self.assertEqual(len(parsed["inclusion"]), 5)
+        self.assertEqual(parsed["inclusion"][4], "Able to give informed consent and willing to comply with the protocol")
+        self.assertEqual(parsed["exclusion"], ["Life expectancy less than 3 months", "Karnofsky score 60 or less", "Pregnancy"])
+        # Unlabelled text counts as inclusion; unindented lines are separate items
+        self.assertEqual(split_criteria("Adults\nNo prior chemotherapy"), [("inclusion", "Adults"), ("inclusion", "No prior chemotherapy")])
+        self.assertEqual(parse_criteria(""), {"inclusion": [], "exclusion": [], "constraints": []})
+
+    def test_numeric_constraints(self):
+        self.assertEqual(bounds(parse_criteria(CRITERIA)), [
+            ("age", "inclusion", 18.0, 65.0, "years"),
+            ("bmi", "inclusion", 18.5, 35.0, "kg/m2"),
+            ("hba1c", "inclusion", 7.0, 10.5, "%"),
+            ("egfr", "inclusion", 45.0, None, "mL/min/1.73m2"),
+            ("ecog", "inclusion", 0.0, 2.0, ""),
+            ("life_expectancy", "exclusion", None, 3.0, "months"),
+            ("karnofsky", "exclusion", None, 60.0, "%"),
+        ])
+        egfr = parse_criteria(CRITERIA)["constraints"][3]
+        self.assertEqual((egfr["min_inclusive"], egfr["max_inclusive"]), (False, None))
+        self.assertEqual(bounds(parse_criteria("Inclusion criteria: adults 18 years or older")), [("age", "inclusion", 18.0, None, "years")])
+        # Bounds in other time units are converted to the measure's unit
+        self.assertEqual(bounds(parse_criteria("Aged 6 months to 17 years")), [("age", "inclusion", 0.5, 17.0, "years")])
+        self.assertEqual(bounds(parse_criteria("Life expectancy of at least 12 weeks")), [("life_expectancy", "inclusion", 2.7598, None, "months")])
+        self.assertEqual(bounds(parse_criteria("COVID-19 infection within 14 days")), [])
+
+class TestCriteriaText(unittest.TestCase):
+    def test_prompt_uses_the_parse(self):
+        self.assertEqual(criteria_text(parse_criteria(CRITERIA), max_items=2).split("\n"), [
+            "Requires: age 18-65 years; bmi 18.5-35 kg/m2; hba1c 7-10.5 %; egfr > 45 mL/min/1.73m2; ecog 0-2",
+            "Excludes: life expectancy < 3 months; karnofsky <= 60 %",
+            "Inclusion: Men and women 18 to 65 years of age; Body mass index (BMI) between 18.5 and 35 kg/m2; (+3 more)",
+            "Exclusion: Life expectancy less than 3 months; Karnofsky score 60 or less; (+1 more)",
+        ])
+        self.assertEqual(criteria_text(parse_criteria("")), "")
+        trial = {"BriefTitle": "Asthma study", "BriefSummary": "Summary", "EligibilityCriteria": CRITERIA}
+        # A stored parse is used as-is while it matches the text
+        trial[PARSED_FIELD] = dict(parsed_criteria(trial), exclusion=["Stored item"])
+        prompt = build_messages("asthma", [trial])[1]["content"]
+        self.assertIn("Eligibility:\nRequires: age 18-65 years;", prompt)
+        self.assertIn("Exclusion: Stored item", prompt)
+        self.assertNotIn("Pregnancy", prompt)
+
+class TestCriteriaCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = CriteriaCache(os.path.join(self.tmp_dir, "cache"))
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_texts_are_parsed_once(self):
+        first = self.cache.parse_many([CRITERIA, "Age >= 18", CRITERIA])
+        self.assertEqual(first[0], parse_criteria(CRITERIA))
+        self.assertEqual(self.cache.stats, {"hits": 1, "misses": 2})
+        reopened = CriteriaCache(os.path.join(self.tmp_dir, "cache"))
+        self.assertEqual(reopened.parse_many(["Age >= 18"]), [parse_criteria("Age >= 18")])
+        self.assertEqual(reopened.stats, {"hits": 1, "misses": 0})
+        reopened.close()
+
+    def test_annotate_directory_stores_parse_next_to_the_text(self):
+        source_dir = os.path.join(self.tmp_dir, "cleaned")
+        os.makedirs(os.path.join(source_dir, "NCT0000xxxx"))
+        studies = [{"NCTId": "NCT00000001", "EligibilityCriteria": CRITERIA}, {"NCTId": "NCT00000002", "EligibilityCriteria": ""}]
+        cleaned_path = os.path.join(source_dir, "NCT0000xxxx", "NCT00000001_cleaned.json")
+        with open(cleaned_path, 'w') as file:
+            json.dump(studies, file)
+        with open(os.path.join(source_dir, "shard_00000.jsonl"), 'w') as file:
+            file.writelines(json.dumps(study) + "\n" for study in studies)
+
+        self.assertEqual(annotate_directory(source_dir, self.cache), {"files": 2, "rewritten": 2, "studies": 4, "parsed": 4})
+        self.assertEqual(self.cache.stats["misses"], 2)
+        with open(cleaned_path) as file:
+            annotated = json.load(file)
+        self.assertEqual(annotated[0][PARSED_FIELD]["hash"], criteria_hash(CRITERIA))
+        self.assertEqual(annotated[0][PARSED_FIELD]["exclusion"], parse_criteria(CRITERIA)["exclusion"])
+        self.assertIs(parsed_criteria(annotated[0]), annotated[0][PARSED_FIELD])
+        self.assertEqual(annotated[0][PARSED_FIELD][RENDERED_FIELD], criteria_text(parse_criteria(CRITERIA)))
+        self.assertEqual(rendered_criteria(annotated[0]), criteria_text(parse_criteria(CRITERIA)))
+
+        # Unchanged files are left alone; an edited criteria text is re-parsed
+        self.assertEqual(annotate_directory(source_dir, self.cache)["rewritten"], 0)
+        annotated[1]["EligibilityCriteria"] = "Age >= 18"
+        self.assertEqual(parsed_criteria(annotated[1])["constraints"][0]["min"], 18.0)
+        with open(cleaned_path, 'w') as file:
+            json.dump(annotated, file)
+        self.assertEqual(annotate_directory(source_dir, self.cache), {"files": 2, "rewritten": 1, "studies": 4, "parsed": 1})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,147 @@
+import os
+import hashlib
+import shutil
+import tempfile
+import threading
 import unittest
-from download import download_zip
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from download import download_zip, download_zip_ranged, manifest_path_for, refresh_zip, load_metadata
+
+PAYLOAD = os.urandom(300 * 1024 + 17)
+ETAG = '"test-etag"'
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves PAYLOAD and honours single byte-range requests."""
+    fail_ranges = set()  # start offsets that should fail once
+    requested_ranges = []
+    etag = ETAG
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_common_headers(self):
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", type(self).etag)
+        self.send_header("Last-Modified", "Wed, 01 Jan 2025 00:00:00 GMT")
+
+    def do_HEAD(self):
+        if self.headers.get("If-None-Match") == type(self).etag:
+            self.send_response(304)
+            self.send_common_headers()
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_common_headers()
+        self.send_header("Content-Length", str(len(PAYLOAD)))
+        self.end_headers()
+
+    def do_GET(self):
+        range_header = self.headers.get("Range")
+        if not range_header:
+            self.send_response(200)
+            self.send_common_headers()
+            self.send_header("Content-Length", str(len(PAYLOAD)))
+            self.end_headers()
+            self.wfile.write(PAYLOAD)
+            return
+        start, end = (int(value) for value in range_header.split("=")[1].split("-"))
+        type(self).requested_ranges.append(start)
+        if start in type(self).fail_ranges:
+            type(self).fail_ranges.discard(start)
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = PAYLOAD[start:end + 1]
+        self.send_response(206)
+        self.send_common_headers()
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
 class TestDownloadZip(unittest.TestCase):
     def test_download_zip(self):
         # Add test cases for download_zip function
         pass
 
+class RangeServerTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/AllAPIJSON.zip"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.dest_dir = tempfile.mkdtemp()
+        RangeHandler.fail_ranges = set()
+        RangeHandler.requested_ranges = []
+        RangeHandler.etag = ETAG
+
+    def tearDown(self):
+        shutil.rmtree(self.dest_dir)
+
+class TestDownloadZipRanged(RangeServerTestCase):
+    def test_parallel_segments_reassemble_file(self):
+        zip_path = download_zip_ranged(self.url, self.dest_dir, segments=4, segment_size=64 * 1024)
+        with open(zip_path, 'rb') as file:
+            self.assertEqual(file.read(), PAYLOAD)
+        self.assertEqual(len(RangeHandler.requested_ranges), 5)
+        self.assertFalse(os.path.exists(manifest_path_for(zip_path)))
+        with open(zip_path + ".sha256") as file:
+            self.assertTrue(file.read().startswith(hashlib.sha256(PAYLOAD).hexdigest()))
+
+    def test_interrupted_download_resumes_from_manifest(self):
+        RangeHandler.fail_ranges = {128 * 1024}
+        self.assertIsNone(download_zip_ranged(self.url, self.dest_dir, segments=2, segment_size=64 * 1024))
+        zip_path = os.path.join(self.dest_dir, "AllAPIJSON.zip")
+        self.assertTrue(os.path.exists(manifest_path_for(zip_path)))
+
+        RangeHandler.requested_ranges = []
+        self.assertEqual(download_zip_ranged(self.url, self.dest_dir, segments=2, segment_size=64 * 1024), zip_path)
+        # Only the failed segment is fetched again
+        self.assertEqual(RangeHandler.requested_ranges, [128 * 1024])
+        with open(zip_path, 'rb') as file:
+            self.assertEqual(file.read(), PAYLOAD)
+
+    def test_corrupted_segment_is_refetched(self):
+        zip_path = os.path.join(self.dest_dir, "AllAPIJSON.zip")
+        RangeHandler.fail_ranges = {0}
+        download_zip_ranged(self.url, self.dest_dir, segments=2, segment_size=64 * 1024)
+        # Damage a completed segment on disk before resuming
+        with open(zip_path, 'r+b') as file:
+            file.seek(64 * 1024)
+            file.write(b"\x00" * 10)
+        self.assertEqual(download_zip_ranged(self.url, self.dest_dir, segments=2, segment_size=64 * 1024), zip_path)
+        with open(zip_path, 'rb') as file:
+            self.assertEqual(file.read(), PAYLOAD)
+
+    def test_expected_checksum_mismatch_fails(self):
+        self.assertIsNone(download_zip_ranged(self.url, self.dest_dir, segments=2, expected_sha256="0" * 64))
+
+class TestRefreshZip(RangeServerTestCase):
+    def test_unchanged_archive_is_not_downloaded_again(self):
+        zip_path, changed = refresh_zip(self.url, self.dest_dir, segments=2)
+        self.assertTrue(changed)
+        self.assertEqual(load_metadata(zip_path)["etag"], ETAG)
+
+        RangeHandler.requested_ranges = []
+        self.assertEqual(refresh_zip(self.url, self.dest_dir, segments=2), (zip_path, False))
+        self.assertEqual(RangeHandler.requested_ranges, [])
+
+    def test_new_etag_triggers_download(self):
+        zip_path, _ = refresh_zip(self.url, self.dest_dir, segments=2)
+        RangeHandler.etag = '"new-etag"'
+        RangeHandler.requested_ranges = []
+        self.assertEqual(refresh_zip(self.url, self.dest_dir, segments=2), (zip_path, True))
+        self.assertTrue(RangeHandler.requested_ranges)
+        self.assertEqual(load_metadata(zip_path)["etag"], '"new-etag"')
+
 if __name__ == "__main__":
     unittest.main()
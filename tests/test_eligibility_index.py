@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from eligibility_index import (build_eligibility_index, open_eligibility_index, load_or_build_eligibility_index, parse_age_days,
+                               normalize_state, normalize_zip)
+from search_index import build_search_index, open_search_index
+
+def location(country, state="", zip_code=""):
+    return {"Facility": "", "City": "", "State": state, "Zip": zip_code, "Country": country}
+
+STUDIES = [
+    {"NCTId": "NCT00000001", "BriefTitle": "Asthma in women", "Gender": "Female", "MinimumAge": "18 Years",
+     "HealthyVolunteers": "No", "Location": [location("United States", "California", "94305-5101")]},
+    {"NCTId": "NCT00000002", "BriefTitle": "Asthma in children", "Gender": "All", "MinimumAge": "6 Months",
+     "HealthyVolunteers": "Accepts Healthy Volunteers", "Location": [location("United States", "Texas", "77030")]},
+    {"NCTId": "NCT00000003", "BriefTitle": "Asthma in older men", "Gender": "Male", "MinimumAge": "65 Years",
+     "HealthyVolunteers": "No", "Location": [location("Canada", "Ontario")]},
+    {"NCTId": "NCT00000004", "BriefTitle": "Asthma registry", "Gender": "", "MinimumAge": "N/A",
+     "HealthyVolunteers": None, "Location": []},
+]
+
+class TestParsing(unittest.TestCase):
+    def test_parse_age_days(self):
+        self.assertEqual(parse_age_days("18 Years"), 6574)
+        self.assertEqual(parse_age_days("6 Months"), 182)
+        self.assertEqual(parse_age_days("2 Weeks"), 14)
+        self.assertIsNone(parse_age_days("N/A"))
+        self.assertIsNone(parse_age_days(None))
+
+    def test_normalize_location(self):
+        self.assertEqual(normalize_state("US", "CA"), "united states/california")
+        self.assertEqual(normalize_state("Canada", " Ontario "), "canada/ontario")
+        self.assertEqual(normalize_zip("94305-5101"), "94305")
+        self.assertEqual(normalize_zip("SW1A 1AA"), "SW1A 1AA")
+
+class TestEligibilityIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        build_eligibility_index(STUDIES, os.path.join(self.tmp_dir, "eligibility"))
+        self.index = open_eligibility_index(os.path.join(self.tmp_dir, "eligibility"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_profiles(self):
+        self.assertEqual(len(self.index.candidates()), 4)
+        # Missing gender/age data never excludes the registry study
+        self.assertEqual(self.index.candidates(gender="Female", age_years=45), ["NCT00000001", "NCT00000002", "NCT00000004"])
+        self.assertEqual(self.index.candidates(gender="female", age_years=45, country="US", state="CA"), ["NCT00000001"])
+        self.assertEqual(self.index.candidates(age_years=10), ["NCT00000002", "NCT00000004"])
+        self.assertEqual(self.index.candidates(healthy_volunteer=True), ["NCT00000002", "NCT00000004"])
+        self.assertEqual(self.index.candidates(zip_code="94305"), ["NCT00000001"])
+        self.assertEqual(self.index.candidates(country="Canada", gender="Male", age_years=70), ["NCT00000003"])
+        self.assertEqual(self.index.candidates(country="France"), [])
+
+    def test_search_mask_restricts_search(self):
+        # The search index lists the trials in a different order; the mask follows its rows
+        build_search_index(list(reversed(STUDIES)), os.path.join(self.tmp_dir, "search"))
+        search_index = open_search_index(os.path.join(self.tmp_dir, "search"))
+        mask = self.index.search_mask(search_index, gender="Male", age_years=70)
+        self.assertEqual(mask.dtype, np.bool_)
+        results = search_index.search("asthma", k=10, candidates=mask)
+        self.assertEqual({nct_id for nct_id, _ in results}, {"NCT00000002", "NCT00000003", "NCT00000004"})
+        mask = self.index.search_mask(search_index, gender="Male", age_years=70, country="Canada")
+        self.assertEqual([nct_id for nct_id, _ in search_index.search("asthma", candidates=mask)], ["NCT00000003"])
+        self.assertEqual([nct_id for nct_id, _ in search_index.search("asthma", candidates=["NCT00000002"])], ["NCT00000002"])
+
+    def test_rebuilds_when_eligibility_changes(self):
+        index_dir = os.path.join(self.tmp_dir, "eligibility")
+        mtime = os.path.getmtime(os.path.join(index_dir, "gender.npy"))
+        self.assertEqual(len(load_or_build_eligibility_index(list(reversed(STUDIES)), index_dir)), 4)
+        self.assertEqual(os.path.getmtime(os.path.join(index_dir, "gender.npy")), mtime)
+        # Same NCTIds, but one trial now only takes men and another moved
+        edited = [dict(study) for study in STUDIES]
+        edited[0]["Gender"] = "Male"
+        edited[1]["Location"] = [location("Canada", "Ontario")]
+        index = load_or_build_eligibility_index(edited, index_dir)
+        self.assertEqual(index.candidates(gender="Female", age_years=45), ["NCT00000002", "NCT00000004"])
+        self.assertEqual(index.candidates(zip_code="77030"), [])
+
+if __name__ == "__main__":
+    unittest.main()
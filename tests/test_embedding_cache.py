@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from embedding_cache import EmbeddingCache, CachedEmbeddings, normalize_text, text_hash
+
+def fake_vectors(texts):
+    return [[float(len(text)), float(sum(map(ord, text)) % 97), 1.0] for text in texts]
+
+class CountingEmbedder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return fake_vectors(texts)
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_only_new_texts_are_embedded(self):
+        embedder = CountingEmbedder()
+        cache = EmbeddingCache(self.cache_dir)
+        first = cache.embed(["a trial", "b trial", "a  trial "], embedder, "model-1")
+        self.assertEqual(embedder.calls, [["a trial", "b trial"]])
+        np.testing.assert_array_equal(first[0], first[2])
+
+        second = cache.embed(["b trial", "c trial"], embedder, "model-1")
+        self.assertEqual(embedder.calls[-1], ["c trial"])
+        np.testing.assert_array_equal(second[0], first[1])
+        self.assertEqual(cache.stats, {"hits": 1, "misses": 3})
+
+    def test_failed_texts_are_not_cached(self):
+        cache = EmbeddingCache(self.cache_dir)
+        results = cache.embed(["ok", "failed"], lambda texts: [fake_vectors(texts)[0], None], "model-1")
+        self.assertIsNone(results[1])
+        embedder = CountingEmbedder()
+        cache.embed(["ok", "failed"], embedder, "model-1")
+        self.assertEqual(embedder.calls, [["failed"]])
+
+    def test_persists_across_instances_and_is_keyed_by_model(self):
+        cache = EmbeddingCache(self.cache_dir)
+        cache.embed(["trial"], CountingEmbedder(), "model-1")
+        cache.close()
+
+        embedder = CountingEmbedder()
+        cache = EmbeddingCache(self.cache_dir)
+        vector = cache.embed(["trial"], embedder, "model-1")[0]
+        self.assertEqual(embedder.calls, [])
+        self.assertIsInstance(vector, np.memmap)
+        np.testing.assert_array_equal(vector, np.float32(fake_vectors(["trial"])[0]))
+
+        cache.embed(["trial"], embedder, "model-2")
+        self.assertEqual(embedder.calls, [["trial"]])
+
+    def test_partial_row_is_dropped_before_appending(self):
+        cache = EmbeddingCache(self.cache_dir)
+        cache.embed(["one"], CountingEmbedder(), "model-1")
+        with open(cache.vectors_path("model-1", 3), 'ab') as file:
+            file.write(b"\x00\x01")  # Interrupted write
+        cache.embed(["two"], CountingEmbedder(), "model-1")
+        cache.close()
+
+        cache = EmbeddingCache(self.cache_dir)
+        vectors = cache.get_many("model-1", ["one", "two"])
+        np.testing.assert_array_equal(np.asarray(vectors), np.float32(fake_vectors(["one", "two"])))
+
+    def test_normalisation(self):
+        self.assertEqual(normalize_text("  Breast\n\tCancer "), "Breast Cancer")
+        self.assertEqual(text_hash("Café"), text_hash("Café"))
+
+    def test_cached_langchain_embeddings(self):
+        class FakeLangChainEmbeddings:
+            def __init__(self):
+                self.documents = 0
+
+            def embed_documents(self, texts):
+                self.documents += len(texts)
+                return fake_vectors(texts)
+
+            def embed_query(self, text):
+                return fake_vectors([text])[0]
+
+        inner = FakeLangChainEmbeddings()
+        embeddings = CachedEmbeddings(inner, EmbeddingCache(self.cache_dir), "model-1")
+        self.assertEqual(embeddings.embed_documents(["x", "y"]), fake_vectors(["x", "y"]))
+        self.assertEqual(embeddings.embed_documents(["y", "x", "z"]), fake_vectors(["y", "x", "z"]))
+        self.assertEqual(inner.documents, 3)
+        self.assertEqual(embeddings.embed_query("x"), fake_vectors(["x"])[0])
+
+if __name__ == "__main__":
+    unittest.main()
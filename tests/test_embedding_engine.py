@@ -0,0 +1,149 @@
+import json
+import time
+import base64
+import struct
+import asyncio
+import hashlib
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from openai import AsyncOpenAI
+from embedding_engine import EmbeddingEngine, TokenBucket, pack_batches, count_tokens, truncate_text
+
+DIMENSIONS = 8
+
+def fake_embedding(text):
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    return [byte / 255.0 for byte in digest[:DIMENSIONS]]
+
+class FakeEmbeddingHandler(BaseHTTPRequestHandler):
+    """Minimal /v1/embeddings endpoint: deterministic vectors, plus scripted 429/500 failures."""
+    failures = []  # status codes returned, in order, before requests succeed
+    batch_sizes = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if type(self).failures:
+            status = type(self).failures.pop(0)
+            self.send_json(status, {"error": {"message": "try again", "type": "server_error"}}, {"Retry-After": "0"})
+            return
+        inputs = request["input"] if isinstance(request["input"], list) else [request["input"]]
+        type(self).batch_sizes.append(len(inputs))
+        data = []
+        for index, text in enumerate(inputs):
+            vector = fake_embedding(text)
+            if request.get("encoding_format") == "base64":
+                vector = base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode('ascii')
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+        # Return the items out of order; the engine has to put them back by index
+        data.reverse()
+        self.send_json(200, {"object": "list", "data": data, "model": request["model"],
+                             "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+class TestPackBatches(unittest.TestCase):
+    def test_respects_token_and_input_limits(self):
+        self.assertEqual(pack_batches([3, 3, 3, 10, 1], max_tokens=6), [[0, 1], [2], [3], [4]])
+        self.assertEqual(pack_batches([1] * 5, max_tokens=100, max_inputs=2), [[0, 1], [2, 3], [4]])
+        self.assertEqual(pack_batches([]), [])
+        # Inputs over the per-input limit are counted at the limit they are truncated to
+        self.assertEqual(pack_batches([50, 3, 3], max_tokens=13, max_input_tokens=10), [[0, 1], [2]])
+
+class TestTokenBucket(unittest.TestCase):
+    def test_waits_for_refill(self):
+        async def acquire_all():
+            bucket = TokenBucket(rate_per_minute=600, capacity=2)  # 10 per second
+            start = time.monotonic()
+            for _ in range(5):
+                await bucket.acquire(1)
+            return time.monotonic() - start
+        self.assertGreaterEqual(asyncio.run(acquire_all()), 0.25)
+
+class TestEmbeddingEngine(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeEmbeddingHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}/v1"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        FakeEmbeddingHandler.failures = []
+        FakeEmbeddingHandler.batch_sizes = []
+
+    def embed(self, texts, **options):
+        async def run():
+            client = AsyncOpenAI(base_url=self.base_url, api_key="test", max_retries=0)
+            engine = EmbeddingEngine(client=client, base_delay=0.01, **options)
+            try:
+                return await engine.embed_async(texts), engine.stats
+            finally:
+                await client.close()
+        return asyncio.run(run())
+
+    def assertVectorsEqual(self, actual, expected):
+        self.assertEqual(len(actual), len(expected))
+        for vector, expected_vector in zip(actual, expected):
+            for value, expected_value in zip(vector, expected_vector):
+                self.assertAlmostEqual(value, expected_value, places=5)
+
+    def test_batches_concurrently_and_keeps_order(self):
+        texts = [f"Trial {i} " + "word " * (i % 7) for i in range(200)]
+        embeddings, stats = self.embed(texts, max_tokens_per_request=100, concurrency=4)
+        self.assertVectorsEqual(embeddings, [fake_embedding(text) for text in texts])
+        self.assertEqual(sum(FakeEmbeddingHandler.batch_sizes), 200)
+        self.assertGreater(min(FakeEmbeddingHandler.batch_sizes), 1)
+        self.assertEqual(stats["requests"], len(FakeEmbeddingHandler.batch_sizes))
+
+    def test_retries_rate_limits_and_server_errors(self):
+        FakeEmbeddingHandler.failures = [429, 500, 503]
+        embeddings, stats = self.embed(["a", "b", "c"], concurrency=1)
+        self.assertVectorsEqual(embeddings, [fake_embedding(text) for text in ["a", "b", "c"]])
+        self.assertEqual(stats["retries"], 3)
+
+    def test_gives_up_after_max_retries(self):
+        FakeEmbeddingHandler.failures = [500] * 3
+        embeddings, stats = self.embed(["a"], max_retries=2)
+        self.assertEqual(embeddings, [None])
+        self.assertEqual((stats["failed_batches"], stats["failed_texts"]), (1, 1))
+
+    def test_client_errors_are_not_retried(self):
+        FakeEmbeddingHandler.failures = [400, 400]
+        embeddings, stats = self.embed(["a"])
+        self.assertEqual(embeddings, [None])
+        self.assertEqual(FakeEmbeddingHandler.failures, [400])
+
+    def test_failed_batch_is_skipped(self):
+        # One input per request: only the first request fails, the other texts are still embedded
+        FakeEmbeddingHandler.failures = [400]
+        embeddings, stats = self.embed(["a", "b", "c"], max_inputs_per_request=1, concurrency=1)
+        self.assertIsNone(embeddings[0])
+        self.assertVectorsEqual(embeddings[1:], [fake_embedding(text) for text in ["b", "c"]])
+        self.assertEqual((stats["requests"], stats["failed_batches"]), (2, 1))
+
+    def test_truncates_long_inputs(self):
+        long_text = "word " * 500
+        embeddings, stats = self.embed([long_text, "b"], max_tokens_per_input=50)
+        self.assertEqual(stats["truncated"], 1)
+        self.assertLessEqual(count_tokens(truncate_text(long_text, 50)), 50)
+        self.assertVectorsEqual(embeddings, [fake_embedding(truncate_text(long_text, 50)), fake_embedding("b")])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from embedding_store import EmbeddingStoreWriter, write_embedding_store, open_embedding_store, quantize
+
+class TestEmbeddingStore(unittest.TestCase):
+    def setUp(self):
+        self.store_dir = os.path.join(tempfile.mkdtemp(), "store")
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(size=(25, 16)).astype(np.float32)
+        self.records = [{"NCTId": f"NCT{i:08d}", "file": f"file_{i % 3}.json", "BriefTitle": f"Trial {i}"} for i in range(25)]
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.store_dir))
+
+    def test_float32_round_trip_is_zero_copy(self):
+        info = write_embedding_store(self.store_dir, self.records, self.vectors, shard_rows=10)
+        self.assertEqual([shard["rows"] for shard in info["shards"]], [10, 10, 5])
+        store = open_embedding_store(self.store_dir)
+        self.assertEqual(len(store), 25)
+        self.assertIsInstance(store.shard_vectors(0), np.memmap)
+        np.testing.assert_array_equal(store.vectors(), self.vectors)
+        np.testing.assert_array_equal(store.lookup("NCT00000012"), self.vectors[12])
+        self.assertIsNone(store.lookup("NCT99999999"))
+        self.assertEqual(store.metadata.column("BriefTitle")[24].as_py(), "Trial 24")
+
+    def test_float16_and_int8_are_close(self):
+        for dtype, tolerance in (("float16", 1e-2), ("int8", 3e-2)):
+            write_embedding_store(self.store_dir, self.records, self.vectors, dtype=dtype, shard_rows=7)
+            store = open_embedding_store(self.store_dir)
+            self.assertEqual(store.shards[0].dtype, np.dtype(dtype))
+            np.testing.assert_allclose(store.vectors(), self.vectors, atol=tolerance)
+            np.testing.assert_allclose(store.lookup("NCT00000020"), self.vectors[20], atol=tolerance)
+
+    def test_smaller_than_json(self):
+        write_embedding_store(self.store_dir, self.records, self.vectors)
+        json_size = len(json.dumps([dict(record, embedding=vector.tolist()) for record, vector in zip(self.records, self.vectors)], indent=4))
+        store_size = sum(os.path.getsize(os.path.join(self.store_dir, name)) for name in os.listdir(self.store_dir))
+        self.assertLess(store_size, json_size)
+
+    def test_rejects_mixed_dimensions(self):
+        writer = EmbeddingStoreWriter(self.store_dir)
+        writer.add(self.records[:1], self.vectors[:1])
+        with self.assertRaises(ValueError):
+            writer.add(self.records[1:2], [[1.0, 2.0]])
+
+    def test_int8_zero_vector(self):
+        codes, scales = quantize(np.zeros((1, 4)), "int8")
+        self.assertEqual(codes.tolist(), [[0, 0, 0, 0]])
+        self.assertEqual(scales.tolist(), [1.0])
+
+if __name__ == "__main__":
+    unittest.main()
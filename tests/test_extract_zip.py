@@ -0,0 +1,33 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import zipfile
+from extract_zip import extract_zip, STAMP_FILE
+
+class TestExtractZipSkipsUnchangedArchive(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.zip_path = os.path.join(self.work_dir, "AllAPIJSON.zip")
+        self.extract_to = os.path.join(self.work_dir, "extracted")
+        with zipfile.ZipFile(self.zip_path, 'w') as zip_ref:
+            zip_ref.writestr("NCT0000xxxx/NCT00000102.json", json.dumps({"FullStudy": {}}))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_second_extraction_is_skipped(self):
+        self.assertTrue(extract_zip(self.zip_path, self.extract_to))
+        self.assertTrue(os.path.exists(os.path.join(self.extract_to, "AllAPIJSON", STAMP_FILE)))
+        self.assertFalse(extract_zip(self.zip_path, self.extract_to))
+        self.assertTrue(extract_zip(self.zip_path, self.extract_to, force=True))
+
+    def test_changed_archive_is_extracted_again(self):
+        extract_zip(self.zip_path, self.extract_to)
+        with zipfile.ZipFile(self.zip_path, 'a') as zip_ref:
+            zip_ref.writestr("NCT0000xxxx/NCT00000104.json", json.dumps({"FullStudy": {}}))
+        self.assertTrue(extract_zip(self.zip_path, self.extract_to))
+
+if __name__ == "__main__":
+    unittest.main()
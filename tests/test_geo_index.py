@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from geo_index import Geocoder, DEFAULT_CENTROIDS_FILE, build_geo_index, open_geo_index, load_or_build_geo_index, haversine_miles, country_code
+from eligibility_index import build_eligibility_index, open_eligibility_index
+from search_index import build_search_index, open_search_index
+from gpt_recommendation import profile_candidates
+
+# GeoNames postal code format: country, postal code, place, admin1 name, admin1 code, admin2 name, admin2 code,
+# admin3 name, admin3 code, latitude, longitude, accuracy
+CENTROIDS = [
+    ("US", "94305", "Stanford", "California", "CA", 37.4178, -122.1720),
+    ("US", "94103", "San Francisco", "California", "CA", 37.7725, -122.4147),
+    ("US", "94110", "San Francisco", "California", "CA", 37.7487, -122.4158),
+    ("US", "95814", "Sacramento", "California", "CA", 38.5804, -121.4922),
+    ("US", "77030", "Houston", "Texas", "TX", 29.7072, -95.4011),
+    ("CA", "T2N", "Calgary", "Alberta", "AB", 51.0741, -114.1293),
+    ("US", "62701", "Springfield", "Illinois", "IL", 39.8017, -89.6437),
+    ("US", "01103", "Springfield", "Massachusetts", "MA", 42.1029, -72.5887),
+]
+
+def location(country, city="", state="", zip_code=""):
+    return {"Facility": "", "City": city, "State": state, "Zip": zip_code, "Country": country}
+
+STUDIES = [
+    {"NCTId": "NCT00000001", "BriefTitle": "Asthma at Stanford", "Gender": "Female",
+     "Location": [location("United States", "Stanford", "California", "94305-5101")]},
+    {"NCTId": "NCT00000002", "BriefTitle": "Asthma in San Francisco", "Gender": "Male",
+     "Location": [location("United States", "San Francisco", "CA")]},
+    {"NCTId": "NCT00000003", "BriefTitle": "Asthma in Sacramento", "Gender": "All",
+     "Location": [location("United States", "Sacramento", "California", "95814")]},
+    {"NCTId": "NCT00000004", "BriefTitle": "Asthma in Houston and Calgary", "Gender": "All",
+     "Location": [location("United States", "Houston", "Texas", "77030"), location("Canada", "Calgary", "Alberta", "T2N 4N1")]},
+    {"NCTId": "NCT00000005", "BriefTitle": "Asthma registry", "Gender": "All", "Location": []},
+    {"NCTId": "NCT00000006", "BriefTitle": "Asthma somewhere", "Gender": "All",
+     "Location": [location("United States", "Nowhere", "", "00000"), location("Atlantis")]},
+]
+
+class TestGeocoder(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.centroids_file = os.path.join(self.tmp_dir, "postal_codes.txt")
+        with open(self.centroids_file, 'w', encoding='utf-8') as file:
+            for code, postal, place, admin_name, admin_code, lat, lon in CENTROIDS:
+                file.write("\t".join([code, postal, place, admin_name, admin_code, "", "", "", "", str(lat), str(lon), "4"]) + "\n")
+        self.geocoder = Geocoder.from_file(self.centroids_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_locate(self):
+        self.assertEqual(country_code("USA"), "US")
+        self.assertEqual(country_code("Canada"), "CA")
+        self.assertEqual(self.geocoder.locate(STUDIES[0]["Location"][0]), (37.4178, -122.1720))
+        # No zip: the mean of the city's postal centroids, found with the state abbreviation
+        lat, lon = self.geocoder.locate(STUDIES[1]["Location"][0])
+        self.assertAlmostEqual(lat, (37.7725 + 37.7487) / 2)
+        self.assertAlmostEqual(lon, (-122.4147 - 122.4158) / 2)
+        # Canadian codes are matched on their outward part; raw LocationZip keys work too
+        self.assertEqual(self.geocoder.locate({"LocationZip": "T2N 4N1", "LocationCountry": "Canada"}), (51.0741, -114.1293))
+        # Without a state a city is only placed when its name is unique in the country
+        self.assertEqual(self.geocoder.locate(location("United States", "Houston")), (29.7072, -95.4011))
+        self.assertEqual(self.geocoder.locate(location("United States", "Springfield", "IL")), (39.8017, -89.6437))
+        self.assertIsNone(self.geocoder.locate(location("United States", "Springfield")))
+        self.assertIsNone(self.geocoder.locate(STUDIES[5]["Location"][0]))
+        self.assertIsNone(self.geocoder.locate(STUDIES[5]["Location"][1]))
+        with self.assertRaises(FileNotFoundError):
+            Geocoder.from_file(os.path.join(self.tmp_dir, "missing.txt"))
+
+    def test_bundled_centroids(self):
+        geocoder = Geocoder.from_file(DEFAULT_CENTROIDS_FILE)
+        lat, lon = geocoder.locate(location("United States", zip_code="94305"))
+        self.assertAlmostEqual(lat, 37.42, places=1)
+        self.assertAlmostEqual(lon, -122.16, places=1)
+        self.assertIsNotNone(geocoder.locate(location("United States", "Boston", "MA")))
+        self.assertIsNotNone(geocoder.locate(location("Puerto Rico", "San Juan")))
+
+    def test_radius_queries(self):
+        info = build_geo_index(STUDIES, self.geocoder, os.path.join(self.tmp_dir, "geo"))
+        self.assertEqual((info["sites"], info["located_sites"], info["located_trials"]), (7, 5, 4))
+        index = open_geo_index(os.path.join(self.tmp_dir, "geo"))
+        stanford = index.locate_zip("94305-5101")
+        self.assertEqual(stanford, (37.4178, -122.1720))
+        self.assertIsNone(index.locate_zip("99999"))
+
+        results = index.within(*stanford, 50)
+        self.assertEqual([nct_id for nct_id, _ in results], ["NCT00000001", "NCT00000002"])
+        self.assertAlmostEqual(results[0][1], 0.0)
+        self.assertAlmostEqual(results[1][1], float(haversine_miles(*stanford, *self.geocoder.locate(STUDIES[1]["Location"][0]))))
+        self.assertEqual([nct_id for nct_id, _ in index.within(*stanford, 100)], ["NCT00000001", "NCT00000002", "NCT00000003"])
+        self.assertEqual(index.within(*index.locate_zip("T2N 4N1", "Canada"), 10), [("NCT00000004", 0.0)])
+        # A radius that spans the whole globe finds every located trial
+        self.assertEqual(int(index.candidate_mask(0.0, 179.9, 13000).sum()), 4)
+
+    def test_rebuilds_when_sites_change(self):
+        index_dir = os.path.join(self.tmp_dir, "geo")
+        index = load_or_build_geo_index(STUDIES, index_dir, self.centroids_file)
+        mtime = os.path.getmtime(os.path.join(index_dir, "site_lat.npy"))
+        self.assertEqual([nct_id for nct_id, _ in index.within(29.7072, -95.4011, 10)], ["NCT00000004"])
+        load_or_build_geo_index(list(reversed(STUDIES)), index_dir, self.centroids_file)
+        self.assertEqual(os.path.getmtime(os.path.join(index_dir, "site_lat.npy")), mtime)
+        # Same NCTIds, but the registry study opened a Houston site
+        edited = [dict(study) for study in STUDIES]
+        edited[4]["Location"] = [location("United States", "Houston", "Texas", "77030")]
+        index = load_or_build_geo_index(edited, index_dir, self.centroids_file)
+        self.assertEqual([nct_id for nct_id, _ in index.within(29.7072, -95.4011, 10)], ["NCT00000004", "NCT00000005"])
+
+    def test_random_points_match_brute_force(self):
+        rng = np.random.default_rng(0)
+        points = np.column_stack([rng.uniform(-89, 89, 300), rng.uniform(-180, 180, 300)])
+        geocoder = Geocoder([("US", f"{i:05d}", "", "", "", lat, lon) for i, (lat, lon) in enumerate(points)])
+        studies = [{"NCTId": f"NCT{i:08d}", "Location": [location("US", zip_code=f"{i % 300:05d}"), location("US", zip_code=f"{(i * 7) % 300:05d}")]}
+                   for i in range(400)]
+        build_geo_index(studies, geocoder, os.path.join(self.tmp_dir, "random"))
+        index = open_geo_index(os.path.join(self.tmp_dir, "random"))
+        for lat, lon, radius in [(37.0, -122.0, 500), (88.0, 10.0, 300), (-10.0, 179.5, 800), (0.0, -179.9, 2500)]:
+            expected = {}
+            for i, study in enumerate(studies):
+                miles = min(float(haversine_miles(lat, lon, *geocoder.locate(site))) for site in study["Location"])
+                if miles <= radius:
+                    expected[study["NCTId"]] = miles
+            results = dict(index.within(lat, lon, radius))
+            self.assertEqual(set(results), set(expected))
+            for nct_id, miles in results.items():
+                self.assertAlmostEqual(miles, expected[nct_id], places=6)
+
+    def test_profile_candidates_with_radius(self):
+        build_geo_index(STUDIES, self.geocoder, os.path.join(self.tmp_dir, "geo"))
+        build_eligibility_index(STUDIES, os.path.join(self.tmp_dir, "eligibility"))
+        build_search_index(list(reversed(STUDIES)), os.path.join(self.tmp_dir, "search"))
+        geo_index = open_geo_index(os.path.join(self.tmp_dir, "geo"))
+        eligibility_index = open_eligibility_index(os.path.join(self.tmp_dir, "eligibility"))
+        search_index = open_search_index(os.path.join(self.tmp_dir, "search"))
+
+        def found(profile, radius=None):
+            mask = profile_candidates(search_index, eligibility_index, profile, geo_index, radius)
+            return sorted(nct_id for nct_id, _ in search_index.search("asthma", 10, mask))
+
+        self.assertEqual(found({"zip_code": "94305"}), ["NCT00000001"])
+        self.assertEqual(found({"zip_code": "94305"}, 50), ["NCT00000001", "NCT00000002"])
+        self.assertEqual(found({"zip_code": "94305", "gender": "Male"}, 100), ["NCT00000002", "NCT00000003"])
+        self.assertIsNone(profile_candidates(search_index, eligibility_index, {"zip_code": None}, geo_index, 50))
+        with self.assertRaises(ValueError):
+            profile_candidates(search_index, eligibility_index, {"zip_code": "99999"}, geo_index, 50)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from manifests import nct_id_digest, file_sha256, snapshot_files, changed_files, verify_group
+
+class TestManifests(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.work_dir, "source")
+        self.output_dir = os.path.join(self.work_dir, "output")
+        os.makedirs(os.path.join(self.source_dir, "nested"))
+        os.makedirs(self.output_dir)
+        for name in ("a.json", os.path.join("nested", "b.json")):
+            with open(os.path.join(self.source_dir, name), 'w') as file:
+                json.dump([{"NCTId": name}], file)
+        self.part_path = os.path.join(self.output_dir, "part_1.txt")
+        with open(self.part_path, 'w') as file:
+            file.write("NCTId\na.json\nnested/b.json\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def make_entry(self):
+        return {
+            "source": {"records": 2, "nct_digest": nct_id_digest(["a", "b"]), "files": snapshot_files(self.source_dir)},
+            "rows": 2,
+            "nct_digest": nct_id_digest(["b", "a", "a"]),
+            "parts": [{"file": "part_1.txt", "rows": 2, "bytes": os.path.getsize(self.part_path), "sha256": file_sha256(self.part_path)}],
+        }
+
+    def test_digest_ignores_order_and_duplicates(self):
+        self.assertEqual(nct_id_digest(["NCT2", "NCT1"]), nct_id_digest(["NCT1", "NCT2", "NCT1"]))
+        self.assertNotEqual(nct_id_digest(["NCT1"]), nct_id_digest(["NCT1", "NCT2"]))
+
+    def test_snapshot_uses_relative_paths(self):
+        self.assertEqual([entry["file"] for entry in snapshot_files(self.source_dir)], ["a.json", "nested/b.json"])
+
+    def test_unchanged_group_verifies(self):
+        check = verify_group(self.make_entry(), self.source_dir, self.output_dir, checksums=True)
+        self.assertEqual(check, {"source_records": 2, "output_rows": 2, "stale_sources": [], "bad_parts": [], "digest_match": True})
+
+    def test_changes_are_detected(self):
+        entry = self.make_entry()
+        with open(os.path.join(self.source_dir, "c.json"), 'w') as file:
+            json.dump([], file)
+        os.remove(os.path.join(self.source_dir, "a.json"))
+        self.assertEqual(changed_files(entry["source"]["files"], self.source_dir), ["a.json", "c.json"])
+
+        # Same size, different content: only the checksum catches it
+        with open(self.part_path, 'r+') as file:
+            file.write("X")
+        self.assertEqual(verify_group(entry, self.source_dir, self.output_dir)["bad_parts"], [])
+        check = verify_group(entry, self.source_dir, self.output_dir, checksums=True)
+        self.assertEqual(check["bad_parts"], ["part_1.txt"])
+        self.assertEqual(check["output_rows"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+import pyarrow.parquet as pq
+from parquet_documents import iter_document_batches
+from criteria_parser import parse_criteria, criteria_text, parsed_criteria, PARSED_FIELD, RENDERED_FIELD
+from trial_store import build_store
+
+def iterrows_documents(file_path):
+    """The DataFrame.iterrows builder the columnar loader replaced (with the criteria given as their parse)."""
+    df = pd.read_parquet(file_path)
+    return [
+        "\n".join([
+            row.get("BriefTitle", ""),
+            row.get("BriefSummary", ""),
+            criteria_text(parse_criteria(row.get("EligibilityCriteria", ""))),
+            " ".join(row.get("Conditions", [])),
+            " ".join(row.get("Keywords", [])),
+            " ".join(interv["Name"] for interv in row.get("Intervention", [])),
+        ])
+        for _, row in df.iterrows()
+    ]
+
+class TestParquetDocuments(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.studies = [
+            {
+                "NCTId": f"NCT{i:08d}",
+                "BriefTitle": f"Trial {i}",
+                "BriefSummary": f"Summary {i}",
+                "EligibilityCriteria": "Inclusion Criteria:\n* Aged 18 to 65 years\nExclusion Criteria:\n* Pregnancy",
+                "Conditions": ["Asthma", "COPD"][:i % 3],
+                "Keywords": [f"kw{i}"],
+                "Intervention": [{"Type": "Drug", "Name": f"Drug {j}"} for j in range(i % 4)],
+                "Location": [{"City": "Boston"}],
+            }
+            for i in range(23)
+        ]
+        pd.json_normalize(self.studies).to_parquet(os.path.join(self.directory, "asthma.parquet"), index=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_matches_iterrows_builder(self):
+        batches = list(iter_document_batches(self.directory, batch_size=10))
+        self.assertEqual([len(batch) for batch in batches], [10, 10, 3])
+        documents = [document for batch in batches for document in batch]
+        self.assertEqual([document["text"] for document in documents],
+                         iterrows_documents(os.path.join(self.directory, "asthma.parquet")))
+        self.assertIn("\nRequires: age 18-65 years\nInclusion: Aged 18 to 65 years\nExclusion: Pregnancy\n", documents[0]["text"])
+        self.assertEqual(documents[2]["id"], "NCT00000002")
+        self.assertEqual(documents[2]["metadata"], {"NCTId": "NCT00000002", "BriefTitle": "Trial 2",
+                                                    "Conditions": "Asthma; COPD", "source": "asthma.parquet"})
+
+    def test_stored_rendering_is_read_as_a_column(self):
+        # Annotated records, with a marker rendering so the test can tell it was read rather than recomputed
+        for study in self.studies[:20]:
+            study[PARSED_FIELD] = dict(parsed_criteria(study), **{RENDERED_FIELD: f"Stored {study['NCTId']}"})
+        parquet_dir = os.path.join(self.directory, "flattened")
+        os.makedirs(parquet_dir)
+        # json_to_parquet.py flattens the parse into EligibilityParsed.* columns
+        pd.json_normalize(self.studies).to_parquet(os.path.join(parquet_dir, "asthma.parquet"), index=False)
+        # The trial store keeps it as one struct column
+        source_dir = os.path.join(self.directory, "cleaned")
+        os.makedirs(source_dir)
+        pd.Series(self.studies).to_json(os.path.join(source_dir, "studies.json"), orient="records")
+        build_store(source_dir, os.path.join(self.directory, "store"))
+        store_file = os.path.join(self.directory, "store", "nct_prefix=NCT000", "part-0.parquet")
+        self.assertTrue(pq.ParquetFile(store_file).schema_arrow.field(PARSED_FIELD).type.num_fields > 0)
+
+        for directory in (parquet_dir, os.path.join(self.directory, "store")):
+            texts = [document["text"] for batch in iter_document_batches(directory, batch_size=8) for document in batch]
+            self.assertIn("\nStored NCT00000003\n", texts[3])
+            # Rows without a stored parse are parsed and rendered here
+            self.assertIn("\nRequires: age 18-65 years\n", texts[21])
+
+    def test_missing_columns_and_nulls(self):
+        pd.DataFrame({"BriefTitle": ["Only a title", None]}).to_parquet(os.path.join(self.directory, "sparse.parquet"), index=False)
+        documents = [document for batch in iter_document_batches(self.directory) for document in batch]
+        sparse = [document for document in documents if document["metadata"]["source"] == "sparse.parquet"]
+        self.assertEqual([document["text"] for document in sparse], ["Only a title\n\n\n\n\n", "\n\n\n\n\n"])
+        self.assertTrue(sparse[0]["id"].startswith("sha256:"))
+        self.assertIsNone(sparse[0]["metadata"]["NCTId"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import json
+import shutil
+import asyncio
+import tempfile
+import threading
+import unittest
+import http.client
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from openai import AsyncOpenAI
+from search_index import build_search_index, open_search_index
+from eligibility_index import build_eligibility_index, open_eligibility_index
+from recommendation_server import RecommendationService, ResponseCache, start_server, cache_key, parse_profile
+
+class StubChatHandler(BaseHTTPRequestHandler):
+    """Minimal streaming /v1/chat/completions endpoint that answers with a fixed sentence."""
+    requests = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        type(self).requests += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for word in ["Consider ", "these ", "trials."]:
+            chunk = {"id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 0, "model": request["model"],
+                     "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+def get(port, path):
+    """GET path; returns the status and the body split into JSON lines (or one JSON document)."""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    connection.request("GET", path)
+    response = connection.getresponse()
+    body = response.read().decode('utf-8')
+    connection.close()
+    if response.getheader("Content-Type") == "application/x-ndjson":
+        return response.status, [json.loads(line) for line in body.splitlines()]
+    return response.status, json.loads(body)
+
+class TestResponseCache(unittest.TestCase):
+    def test_lru_and_ttl(self):
+        cache = ResponseCache(max_entries=2, ttl=60)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)  # evicts b, the least recently used
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+        cache.ttl = -1
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache_key("  Asthma\tTrials "), "asthma trials")
+        self.assertNotEqual(cache_key("asthma", {"gender": "Female"}), cache_key("asthma"))
+        self.assertEqual(parse_profile({"q": "asthma", "age": "45", "gender": "Female", "zip": "", "healthy_volunteer": "false"}),
+                         {"age": 45.0, "gender": "Female", "healthy_volunteer": False})
+        self.assertEqual(parse_profile({"zip": "94305", "radius": "25"}), {"zip": "94305", "radius": 25.0})
+
+class TestRecommendationServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.llm = ThreadingHTTPServer(("127.0.0.1", 0), StubChatHandler)
+        threading.Thread(target=cls.llm.serve_forever, daemon=True).start()
+        cls.index_dir = tempfile.mkdtemp()
+        studies = [
+            {"NCTId": f"NCT{i:08d}", "BriefTitle": f"{condition} study {i}", "BriefSummary": f"Treatment of {condition}.",
+             "Conditions": [condition], "Gender": gender}
+            for i, (condition, gender) in enumerate([("Asthma", "Female"), ("Diabetes", "All"), ("Asthma", "Male"), ("Migraine", "All")])
+        ]
+        build_search_index(studies, cls.index_dir)
+        build_eligibility_index(studies, os.path.join(cls.index_dir, "eligibility"))
+        cls.trials = {study["NCTId"]: study for study in studies}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.llm.shutdown()
+        shutil.rmtree(cls.index_dir)
+
+    def test_streams_caches_and_reports_latency(self):
+        async def scenario():
+            client = AsyncOpenAI(api_key="test", base_url=f"http://127.0.0.1:{self.llm.server_address[1]}/v1")
+            service = RecommendationService(self.trials, open_search_index(self.index_dir), client=client,
+                                            eligibility_index=open_eligibility_index(os.path.join(self.index_dir, "eligibility")))
+            server = await start_server(service, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            loop = asyncio.get_running_loop()
+            fetch = lambda path: loop.run_in_executor(None, get, port, path)
+            try:
+                first = await fetch("/recommend?q=asthma")
+                # Concurrent clients; the same question asked differently is answered from the cache
+                paths = ["/recommend?q=ASTHMA", "/recommend?q=migraine", "/recommend?q=%20asthma%20"] * 5
+                concurrent = await asyncio.gather(*(fetch(path) for path in paths))
+                no_match = await fetch("/recommend?q=fracture")
+                male = await fetch("/recommend?q=asthma&gender=Male")
+                missing = await fetch("/recommend")
+                stats = await fetch("/stats")
+            finally:
+                server.close()
+                await server.wait_closed()
+                await client.close()
+            return first, concurrent, no_match, male, missing, stats
+
+        first, concurrent, no_match, male, missing, stats = asyncio.run(scenario())
+        status, events = first
+        self.assertEqual(status, 200)
+        self.assertEqual({trial["NCTId"] for trial in events[0]["trials"]}, {"NCT00000000", "NCT00000002"})
+        self.assertFalse(events[0]["cached"])
+        self.assertEqual("".join(event.get("delta", "") for event in events), "Consider these trials.")
+        self.assertEqual(events[-1], {"done": True})
+        for status, events in concurrent:
+            self.assertEqual(status, 200)
+            self.assertEqual(events[-1], {"done": True})
+        self.assertTrue(all(events[0]["cached"] for _, events in concurrent[::3]))
+        self.assertEqual({"".join(event.get("delta", "") for event in events) for _, events in concurrent}, {"Consider these trials."})
+        self.assertEqual(no_match[1][0]["trials"], [])
+        self.assertIn("no clinical trials", no_match[1][1]["delta"])
+        # The patient profile narrows the trials and gets its own cache entry
+        self.assertEqual([trial["NCTId"] for trial in male[1][0]["trials"]], ["NCT00000002"])
+        self.assertFalse(male[1][0]["cached"])
+        self.assertEqual(missing[0], 400)
+        # Concurrent identical questions share one LLM call: asthma, migraine and the male asthma profile
+        self.assertEqual(StubChatHandler.requests, 3)
+        status, body = stats
+        self.assertEqual(body["latency"]["count"], 18)
+        self.assertIn("p95_ms", body["latency"])
+        self.assertGreaterEqual(body["cache"]["hits"], 10)
+
+if __name__ == "__main__":
+    unittest.main()
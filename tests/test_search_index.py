@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from search_index import build_search_index, open_search_index, load_or_build_search_index, tokenize
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.index_dir = os.path.join(tempfile.mkdtemp(), "index")
+        self.studies = [
+            {"NCTId": "NCT00000001", "BriefTitle": "Inhaled steroids for asthma in children", "Conditions": ["Asthma"],
+             "BriefSummary": "A study of asthma control.", "Keywords": ["pediatric"], "Intervention": [{"Type": "Drug", "Name": "Budesonide"}]},
+            {"NCTId": "NCT00000002", "BriefTitle": "Exercise and heart failure", "Conditions": ["Heart Failure"],
+             "BriefSummary": "Patients with asthma are excluded.", "Keywords": None, "Intervention": None},
+            {"NCTId": "NCT00000003", "BriefTitle": "Metformin in type 2 diabetes", "Conditions": ["Diabetes Mellitus, Type 2"],
+             "BriefSummary": "Glucose control with metformin.", "Keywords": ["glucose"], "Intervention": [{"Type": "Drug", "Name": "Metformin"}]},
+            {"NCTId": "NCT00000001", "BriefTitle": "Duplicate entry from another condition directory"},
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.index_dir))
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize("The Effect of COVID-19 on Type 2 Diabetes"), ["effect", "covid", "19", "type", "2", "diabetes"])
+        self.assertEqual(tokenize(None), [])
+
+    def test_ranked_search(self):
+        info = build_search_index(self.studies, self.index_dir)
+        self.assertEqual(info["documents"], 3)
+        index = open_search_index(self.index_dir)
+        self.assertIsInstance(index.postings_docs, np.memmap)
+        results = index.search("asthma")
+        # The trial about asthma outranks the one that only mentions it in the summary
+        self.assertEqual([nct_id for nct_id, _ in results], ["NCT00000001", "NCT00000002"])
+        self.assertGreater(results[0][1], results[1][1])
+        self.assertEqual(index.search("metformin budesonide", k=1)[0][0], "NCT00000003")
+        self.assertEqual(index.search("the of"), [])
+        self.assertEqual(index.search("unknownterm"), [])
+
+    def test_rebuilds_only_when_the_trials_change(self):
+        load_or_build_search_index(self.studies, self.index_dir)
+        mtime = os.path.getmtime(os.path.join(self.index_dir, "postings_docs.npy"))
+        load_or_build_search_index(list(reversed(self.studies)), self.index_dir)
+        self.assertEqual(os.path.getmtime(os.path.join(self.index_dir, "postings_docs.npy")), mtime)
+        studies = self.studies + [{"NCTId": "NCT00000004", "BriefTitle": "Asthma biologics"}]
+        index = load_or_build_search_index(studies, self.index_dir)
+        self.assertEqual(len(index), 4)
+        # An edited title is re-indexed even though the set of NCTIds is the same
+        edited = [dict(study) for study in studies]
+        edited[1]["BriefTitle"] = "Exercise and sarcoidosis"
+        index = load_or_build_search_index(edited, self.index_dir)
+        self.assertEqual(len(index), 4)
+        self.assertEqual([nct_id for nct_id, _ in index.search("sarcoidosis")], ["NCT00000002"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'split_zip_data_for_test'))
+from split_out_condition import read_json_files, filter_by_condition, stream_split_by_condition, stream_split_by_location
+from split_out_random import stream_random_split, assign_split, sharded_split, get_stratum, hash_fraction
+from split_out_string import stream_print_and_save_fields
+from geo_index import Geocoder
+
+def raw_trial(nct_id, title, condition="Asthma", phases=("Phase 2",)):
+    return {"FullStudy": {"Study": {"ProtocolSection": {
+        "IdentificationModule": {"NCTId": nct_id, "BriefTitle": title},
+        "ConditionsModule": {"ConditionList": {"Condition": [condition]}},
+        "DesignModule": {"PhaseList": {"Phase": list(phases)}},
+    }}}}
+
+class TestStreamingSplits(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tmp_dir, 'extracted')
+        os.makedirs(os.path.join(self.source_dir, 'NCT0000xxxx'))
+        for i in range(40):
+            title = "Breast Cancer Study" if i % 3 == 0 else "Asthma Study"
+            trial = raw_trial(f"NCT{i:08d}", title)
+            with open(os.path.join(self.source_dir, 'NCT0000xxxx', f"NCT{i:08d}.json"), 'w') as file:
+                json.dump(trial, file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read_output(self, output_dir):
+        trials = {}
+        for name in os.listdir(output_dir):
+            with open(os.path.join(output_dir, name)) as file:
+                trials[name] = json.load(file)
+        return trials
+
+    def test_condition_stream_matches_in_memory_filter(self):
+        data, _ = read_json_files(self.source_dir)
+        expected = filter_by_condition(data, "breast cancer")
+        output_dir = os.path.join(self.tmp_dir, 'condition')
+        self.assertEqual(stream_split_by_condition(self.source_dir, "breast cancer", output_dir), len(expected))
+        written = [trial for trials in self.read_output(output_dir).values() for trial in trials]
+        self.assertCountEqual(written, expected)
+
+    def test_random_split_is_deterministic_and_keyed_on_nct_id(self):
+        first_dir = os.path.join(self.tmp_dir, 'first')
+        second_dir = os.path.join(self.tmp_dir, 'second')
+        train_count, test_count = stream_random_split(self.source_dir, first_dir, seed=3, test_size=0.25)
+        self.assertEqual(train_count + test_count, 40)
+        self.assertGreater(test_count, 0)
+        self.assertEqual(stream_random_split(self.source_dir, second_dir, seed=3, test_size=0.25), (train_count, test_count))
+        self.assertEqual(self.read_output(first_dir), self.read_output(second_dir))
+        for name, trials in self.read_output(first_dir).items():
+            for trial in trials:
+                self.assertTrue(name.endswith(f"_{assign_split(trial, 3, 0.25)}.json"))
+        # The assignment depends on the NCTId, not on the rest of the trial
+        self.assertEqual(assign_split(raw_trial("NCT00000007", "a"), 3), assign_split(raw_trial("NCT00000007", "b"), 3))
+
+    def test_location_stream_keeps_trials_near_zip(self):
+        geocoder = Geocoder([("US", "94305", "Stanford", "California", "CA", 37.4178, -122.1720),
+                             ("US", "77030", "Houston", "Texas", "TX", 29.7072, -95.4011)])
+        for i in range(3):
+            trial = raw_trial(f"NCT9{i:07d}", "Asthma Study")
+            trial["FullStudy"]["Study"]["ProtocolSection"]["ContactsLocationsModule"] = {"LocationList": {"Location": [
+                {"LocationCity": "Houston", "LocationZip": "77030", "LocationCountry": "United States"},
+                {"LocationZip": "94305-5101" if i else "", "LocationCountry": "United States"},
+            ]}}
+            with open(os.path.join(self.source_dir, 'NCT0000xxxx', f"NCT9{i:07d}.json"), 'w') as file:
+                json.dump(trial, file)
+        output_dir = os.path.join(self.tmp_dir, 'near')
+        self.assertEqual(stream_split_by_location(self.source_dir, geocoder, (37.42, -122.17), 50, output_dir), 2)
+        self.assertEqual(sorted(os.listdir(output_dir)), ["NCT90000001.json", "NCT90000002.json"])
+        self.assertEqual(stream_split_by_location(self.source_dir, geocoder, (29.7, -95.4), 50, os.path.join(self.tmp_dir, 'houston')), 3)
+
+    def test_string_stream_saves_matching_files(self):
+        output_dir = os.path.join(self.tmp_dir, 'string')
+        self.assertEqual(stream_print_and_save_fields(self.source_dir, output_dir, "breast"), 14)
+        self.assertEqual(len(os.listdir(output_dir)), 14)
+
+class TestShardedSplit(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tmp_dir, 'extracted')
+        for i in range(100):
+            directory = os.path.join(self.source_dir, f"NCT0000{i // 25}xxx")
+            os.makedirs(directory, exist_ok=True)
+            condition = "Breast Cancer" if i % 4 == 0 else "Asthma"
+            trials = [raw_trial(f"NCT{i:06d}{j:02d}", "Study", condition, ("Phase 1",) if j else ("Phase 3",)) for j in range(2)]
+            with open(os.path.join(directory, f"NCT{i:08d}.json"), 'w') as file:
+                json.dump(trials, file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read_split(self, output_dir, split):
+        nct_ids = []
+        for name in sorted(os.listdir(output_dir)):
+            if name.startswith(split + "_"):
+                with open(os.path.join(output_dir, name)) as file:
+                    nct_ids.extend(json.loads(line)["FullStudy"]["Study"]["ProtocolSection"]["IdentificationModule"]["NCTId"] for line in file)
+        return nct_ids
+
+    def test_stratum(self):
+        trial = raw_trial("NCT1", "Study", "Breast Cancer", ("Phase 2", "Phase 1"))
+        self.assertEqual(get_stratum(trial, "condition"), "breast cancer")
+        self.assertEqual(get_stratum(trial, "phase"), "Phase 1/Phase 2")
+        self.assertEqual(get_stratum({"NCTId": "NCT2"}, "phase"), "unknown")
+        self.assertEqual(get_stratum({"NCTId": "NCT3", "Conditions": ["Asthma"]}, "condition"), "asthma")
+
+    def lowest_hashes(self, nct_ids, seed, test_size):
+        """The round(n * test_size) NCTIds with the lowest seeded hash."""
+        ranked = sorted(nct_ids, key=lambda nct_id: hash_fraction(nct_id, seed))
+        return sorted(ranked[:round(len(ranked) * test_size)])
+
+    def test_split_is_reproducible_and_sharded(self):
+        first = sharded_split(self.source_dir, os.path.join(self.tmp_dir, 'a'), seed=5, shard_size=30, workers=2, batch_size=7)
+        second = sharded_split(self.source_dir, os.path.join(self.tmp_dir, 'b'), seed=5, shard_size=30, workers=1, batch_size=50)
+        # Same shards byte for byte, whatever the worker count or batching
+        self.assertEqual(first["shards"], second["shards"])
+        self.assertEqual([shard["file"] for shard in first["shards"]],
+                         [f"train_{i:05d}.jsonl" for i in range(6)] + ["test_00000.jsonl", "test_00001.jsonl"])
+        self.assertEqual([shard["records"] for shard in first["shards"]], [30] * 5 + [10, 30, 10])
+
+        # The test set is exactly the 20% of trials with the lowest hash
+        train = self.read_split(os.path.join(self.tmp_dir, 'a'), 'train')
+        test = self.read_split(os.path.join(self.tmp_dir, 'a'), 'test')
+        all_ids = [f"NCT{i:06d}{j:02d}" for i in range(100) for j in range(2)]
+        self.assertEqual(sorted(test), self.lowest_hashes(all_ids, 5, 0.2))
+        self.assertEqual(sorted(train + test), all_ids)
+        self.assertEqual(first["records"], {"train": 160, "test": 40})
+
+        sharded_split(self.source_dir, os.path.join(self.tmp_dir, 'c'), seed=6, shard_size=30, workers=1)
+        self.assertNotEqual(self.read_split(os.path.join(self.tmp_dir, 'c'), 'test'), test)
+
+    def test_every_stratum_gets_its_share(self):
+        manifest = sharded_split(self.source_dir, os.path.join(self.tmp_dir, 'strat'), test_size=0.25, stratify="condition", workers=2, batch_size=9)
+        self.assertEqual(manifest["strata"], {"asthma": {"train": 112, "test": 38}, "breast cancer": {"train": 38, "test": 12}})
+        breast_cancer = [f"NCT{i:06d}{j:02d}" for i in range(0, 100, 4) for j in range(2)]
+        test = self.read_split(os.path.join(self.tmp_dir, 'strat'), 'test')
+        self.assertEqual(sorted(set(test) & set(breast_cancer)), self.lowest_hashes(breast_cancer, 0, 0.25))
+
+        manifest = sharded_split(self.source_dir, os.path.join(self.tmp_dir, 'strat'), test_size=0.25, stratify="phase", workers=1)
+        self.assertEqual(manifest["strata"], {"Phase 1": {"train": 75, "test": 25}, "Phase 3": {"train": 75, "test": 25}})
+        self.assertEqual(len(os.listdir(os.path.join(self.tmp_dir, 'strat'))), 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_batch'))
+from step_3_clean_files import process_changed_files
+
+def make_study(nct_id, title):
+    return {"FullStudy": {"Study": {"ProtocolSection": {"IdentificationModule": {"NCTId": nct_id, "BriefTitle": title}}}}}
+
+class TestProcessChangedFiles(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.work_dir, "extracted_working")
+        self.target_dir = os.path.join(self.work_dir, "cleaned")
+        self.db_path = os.path.join(self.work_dir, "clean_state.sqlite")
+        os.makedirs(self.source_dir)
+        for nct_id in ("NCT00000001", "NCT00000002", "NCT00000003"):
+            self.write_source(nct_id, "Original")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def write_source(self, nct_id, title):
+        with open(os.path.join(self.source_dir, f"{nct_id}.json"), 'w') as file:
+            json.dump(make_study(nct_id, title), file)
+
+    def run_incremental(self):
+        return process_changed_files(self.db_path, self.source_dir, self.target_dir)
+
+    def test_only_changed_new_and_removed_studies_are_touched(self):
+        self.assertEqual(self.run_incremental()["new"], 3)
+        self.assertEqual(self.run_incremental()["unchanged"], 3)
+
+        self.write_source("NCT00000001", "Updated")
+        self.write_source("NCT00000004", "Original")
+        os.remove(os.path.join(self.source_dir, "NCT00000003.json"))
+        counts = self.run_incremental()
+        self.assertEqual((counts["new"], counts["changed"], counts["unchanged"], counts["removed"]), (1, 1, 1, 1))
+
+        with open(os.path.join(self.target_dir, "NCT00000001_cleaned.json")) as file:
+            self.assertEqual(json.load(file)[0]["BriefTitle"], "Updated")
+        self.assertFalse(os.path.exists(os.path.join(self.target_dir, "NCT00000003_cleaned.json")))
+
+    def test_touched_but_identical_file_is_not_recleaned(self):
+        self.run_incremental()
+        path = os.path.join(self.source_dir, "NCT00000002.json")
+        os.utime(path, ns=(0, 0))
+        counts = self.run_incremental()
+        self.assertEqual((counts["changed"], counts["unchanged"]), (0, 3))
+
+    def test_missing_output_is_regenerated(self):
+        self.run_incremental()
+        os.remove(os.path.join(self.target_dir, "NCT00000002_cleaned.json"))
+        self.assertEqual(self.run_incremental()["changed"], 1)
+        self.assertTrue(os.path.exists(os.path.join(self.target_dir, "NCT00000002_cleaned.json")))
+
+    def test_unparseable_change_drops_stale_output(self):
+        self.run_incremental()
+        with open(os.path.join(self.source_dir, "NCT00000002.json"), 'w') as file:
+            file.write('{"FullStudy": ')  # Truncated download
+        self.assertEqual(self.run_incremental()["failed"], 1)
+        self.assertFalse(os.path.exists(os.path.join(self.target_dir, "NCT00000002_cleaned.json")))
+        # Once fixed it is cleaned again as a new file
+        self.write_source("NCT00000002", "Fixed")
+        self.assertEqual(self.run_incremental()["new"], 1)
+        with open(os.path.join(self.target_dir, "NCT00000002_cleaned.json")) as file:
+            self.assertEqual(json.load(file)[0]["BriefTitle"], "Fixed")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_batch'))
+import pandas as pd
+import step_4_condense_files
+from step_4_condense_files import stream_json_to_txt, condense_all_parallel, check_trials_count, load_condense_manifest
+
+def make_cleaned_study(nct_id, summary):
+    return {
+        "NCTId": nct_id,
+        "BriefTitle": f"Study of \"Asthma\"\t{nct_id}",
+        "BriefSummary": summary,
+        "Gender": "All",
+        "Location": [{"Facility": "Clinic", "City": "Boston", "State": "MA", "Zip": "02115", "Country": "United States"}],
+        "Conditions": ["Asthma"],
+        "Design": {"Phase": "Phase 2"},
+    }
+
+class TestStreamJsonToTxt(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.condition_dir = os.path.join(self.work_dir, "categorized_conditions", "asthma")
+        os.makedirs(self.condition_dir)
+        for i in range(30):
+            studies = [make_cleaned_study(f"NCT{i:06d}{j:02d}", "Line one\nline two " * (i + 1)) for j in range(3)]
+            with open(os.path.join(self.condition_dir, f"NCT{i:08d}_cleaned.json"), 'w') as file:
+                json.dump(studies, file)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_single_part_matches_pandas_output(self):
+        old_base, old_output = step_4_condense_files.CATEGORIZED_CONDITIONS_DIR, step_4_condense_files.TXT_OUTPUT_DIR
+        step_4_condense_files.CATEGORIZED_CONDITIONS_DIR = os.path.join(self.work_dir, "categorized_conditions")
+        step_4_condense_files.TXT_OUTPUT_DIR = os.path.join(self.work_dir, "pandas")
+        try:
+            pandas_path, _ = step_4_condense_files.json_to_txt(self.condition_dir, "asthma")
+        finally:
+            step_4_condense_files.CATEGORIZED_CONDITIONS_DIR, step_4_condense_files.TXT_OUTPUT_DIR = old_base, old_output
+
+        result = stream_json_to_txt(self.condition_dir, "asthma", os.path.join(self.work_dir, "stream"))
+        self.assertEqual(len(result["parts"]), 1)
+        with open(pandas_path, 'rb') as expected, open(result["parts"][0]["file"], 'rb') as actual:
+            # Row order differs (os.walk vs sorted), so compare the parsed tables
+            expected_df = pd.read_csv(expected, sep='\t').sort_values("NCTId", ignore_index=True)
+            actual_df = pd.read_csv(actual, sep='\t')
+        pd.testing.assert_frame_equal(actual_df, expected_df)
+        self.assertEqual(result["parts"][0]["bytes"], os.path.getsize(result["parts"][0]["file"]))
+
+    def test_parts_are_packed_up_to_the_limit(self):
+        output_dir = os.path.join(self.work_dir, "stream")
+        max_bytes = 20000
+        result = stream_json_to_txt(self.condition_dir, "asthma", output_dir, max_bytes=max_bytes)
+        self.assertGreater(len(result["parts"]), 2)
+        self.assertEqual(result["rows"], 90)
+
+        rows = []
+        for part in result["parts"]:
+            self.assertEqual(part["bytes"], os.path.getsize(part["file"]))
+            self.assertLessEqual(part["bytes"], max_bytes)
+            df = pd.read_csv(part["file"], sep='\t')
+            self.assertEqual(len(df), part["rows"])
+            rows.extend(df["NCTId"])
+        self.assertEqual(rows, sorted(rows))
+        self.assertEqual(len(rows), 90)
+
+        # Each part was closed only because the next row would not have fitted
+        first_rows = [pd.read_csv(part["file"], sep='\t').iloc[:1] for part in result["parts"][1:]]
+        for part, next_row in zip(result["parts"], first_rows):
+            row_bytes = len(next_row.to_csv(sep='\t', index=False, header=False).encode('utf-8'))
+            self.assertGreater(part["bytes"] + row_bytes, max_bytes)
+
+    def test_stale_parts_are_removed(self):
+        output_dir = os.path.join(self.work_dir, "stream")
+        stream_json_to_txt(self.condition_dir, "asthma", output_dir, max_bytes=20000)
+        result = stream_json_to_txt(self.condition_dir, "asthma", output_dir)
+        self.assertEqual(sorted(os.listdir(output_dir)), ["asthma_part_1.txt"])
+        self.assertEqual(result["rows"], 90)
+
+class TestCondenseAllParallel(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.categorized_dir = os.path.join(self.work_dir, "categorized_conditions")
+        self.txt_dir = os.path.join(self.work_dir, "txt")
+        for condition, count in (("asthma", 5), ("breast_cancer", 12), ("copd", 1)):
+            os.makedirs(os.path.join(self.categorized_dir, condition))
+            for i in range(count):
+                with open(os.path.join(self.categorized_dir, condition, f"NCT{i:08d}_cleaned.json"), 'w') as file:
+                    json.dump([make_cleaned_study(f"NCT{i:08d}", condition)], file)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_manifest_lists_every_condition(self):
+        manifest = condense_all_parallel(workers=2, categorized_dir=self.categorized_dir, txt_dir=self.txt_dir)
+        self.assertEqual(manifest, load_condense_manifest(self.txt_dir))
+        self.assertEqual([entry["condition"] for entry in manifest["conditions"]], ["asthma", "breast_cancer", "copd"])
+        self.assertEqual(manifest["rows"], 18)
+        for entry in manifest["conditions"]:
+            self.assertIn("seconds", entry)
+            for part in entry["parts"]:
+                part_path = os.path.join(self.txt_dir, part["file"])
+                self.assertEqual(os.path.getsize(part_path), part["bytes"])
+                self.assertEqual(len(pd.read_csv(part_path, sep='\t')), part["rows"])
+
+    def test_check_trials_count_uses_manifest(self):
+        condense_all_parallel(workers=1, categorized_dir=self.categorized_dir, txt_dir=self.txt_dir)
+        self.assertEqual(sorted(check_trials_count(self.categorized_dir, self.txt_dir)),
+                         [("asthma", 5, 5), ("breast_cancer", 12, 12), ("copd", 1, 1)])
+        # A part that no longer matches the manifest is not counted
+        with open(os.path.join(self.txt_dir, "copd", "copd_part_1.txt"), 'a') as file:
+            file.write("extra\n")
+        self.assertIn(("copd", 1, 0), check_trials_count(self.categorized_dir, self.txt_dir))
+
+    def test_manifest_records_source_and_digests(self):
+        manifest = condense_all_parallel(workers=1, categorized_dir=self.categorized_dir, txt_dir=self.txt_dir)
+        for entry in manifest["conditions"]:
+            self.assertEqual(entry["source"]["records"], entry["rows"])
+            self.assertEqual(entry["source"]["nct_digest"], entry["nct_digest"])
+            self.assertTrue(all(len(part["sha256"]) == 64 for part in entry["parts"]))
+        # A new source file makes the manifest stale, so that condition is counted from the files
+        with open(os.path.join(self.categorized_dir, "copd", "NCT99999999_cleaned.json"), 'w') as file:
+            json.dump([make_cleaned_study("NCT99999999", "copd")], file)
+        self.assertIn(("copd", 2, 1), check_trials_count(self.categorized_dir, self.txt_dir))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import zipfile
+from clean_files import clean_data
+from stream_clean_zip import stream_clean_zip, iter_cleaned_records
+
+def make_study(nct_id, title):
+    return {
+        "FullStudy": {
+            "Study": {
+                "ProtocolSection": {
+                    "IdentificationModule": {"NCTId": nct_id, "BriefTitle": title},
+                    "ConditionsModule": {"ConditionList": {"Condition": ["Breast Cancer"]}},
+                }
+            }
+        }
+    }
+
+class TestStreamCleanZip(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.zip_path = os.path.join(self.work_dir, "AllAPIJSON.zip")
+        self.output_dir = os.path.join(self.work_dir, "cleaned_jsonl")
+        self.studies = [make_study(f"NCT0000010{i}", f"Study {i}") for i in range(5)]
+        with zipfile.ZipFile(self.zip_path, 'w') as zip_ref:
+            for study in self.studies:
+                nct_id = study["FullStudy"]["Study"]["ProtocolSection"]["IdentificationModule"]["NCTId"]
+                zip_ref.writestr(f"NCT0000xxxx/{nct_id}.json", json.dumps(study))
+            zip_ref.writestr("__MACOSX/NCT0000xxxx/._NCT00000100.json", "not json")
+            zip_ref.writestr("NCT0000xxxx/broken.json", "{")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_records_match_clean_data_and_are_sharded(self):
+        manifest = stream_clean_zip(self.zip_path, self.output_dir, shard_records=2)
+        self.assertEqual(manifest["records"], 5)
+        self.assertEqual([shard["records"] for shard in manifest["shards"]], [2, 2, 1])
+        self.assertEqual(manifest["failed"], ["NCT0000xxxx/broken.json"])
+        expected = [clean_data(study)[0] for study in self.studies]
+        self.assertEqual(list(iter_cleaned_records(self.output_dir)), expected)
+        self.assertFalse(os.path.exists(os.path.join(self.work_dir, "extracted")))
+
+    def test_unchanged_archive_is_skipped(self):
+        stream_clean_zip(self.zip_path, self.output_dir)
+        self.assertIsNone(stream_clean_zip(self.zip_path, self.output_dir))
+        self.assertIsNotNone(stream_clean_zip(self.zip_path, self.output_dir, force=True))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+from study_schema import (compile_extractor, extract_cleaned_study, extract_batch_cleaned_study, handwritten_clean_study,
+                          sample_study, benchmark, parse_path, Format, CLEANED_STUDY_FIELDS)
+
+STUDIES = [
+    sample_study(1),
+    sample_study(2, sites=0),
+    {},
+    {"ProtocolSection": {}},
+    {"ProtocolSection": {"IdentificationModule": {"NCTId": "NCT00000003", "SecondaryIdInfoList": {"SecondaryIdInfo": []}},
+                         "ContactsLocationsModule": {"LocationList": {"Location": [{"LocationCity": "Lyon"}, {}]}},
+                         "ConditionsModule": {"KeywordList": {"Keyword": ["sleep"]}}}},
+    {"ProtocolSection": {"IdentificationModule": {"SecondaryIdInfoList": {"SecondaryIdInfo": [{"SecondaryIdType": "Other"}]}},
+                         "EligibilityModule": {"Gender": "Female"},
+                         "ArmsInterventionsModule": {"InterventionList": {"Intervention": [{"InterventionName": "Placebo"}]}}}},
+]
+
+class TestCompiledExtractor(unittest.TestCase):
+    def test_matches_the_handwritten_extractor(self):
+        for study in STUDIES:
+            cleaned = extract_cleaned_study(study)
+            self.assertEqual(cleaned, handwritten_clean_study(study))
+            self.assertEqual(list(cleaned), list(CLEANED_STUDY_FIELDS))
+        # The batch pipeline adds the study link right after NCTId
+        batch = extract_batch_cleaned_study(STUDIES[0])
+        self.assertEqual(batch["NCTId_link"], "clinicaltrials.gov/study/NCT00000001")
+        self.assertEqual(list(batch)[-3:], ["NCTId", "NCTId_link", "MoreInfoLink"])
+        self.assertEqual({k: v for k, v in batch.items() if k != "NCTId_link"}, extract_cleaned_study(STUDIES[0]))
+        self.assertEqual(extract_batch_cleaned_study({})["NCTId_link"], "clinicaltrials.gov/study/")
+        self.assertEqual(benchmark(STUDIES, repeat=1).keys(), {"handwritten", "compiled"})
+
+    def test_each_module_is_read_once(self):
+        source = extract_cleaned_study.source
+        for module in ("IdentificationModule", "EligibilityModule", "ConditionsModule"):
+            self.assertEqual(source.count(f"'{module}'"), 1)
+
+    def test_spec_paths(self):
+        self.assertEqual(parse_path("A.B[0].C[]"), [("A", None), ("B", "first"), ("C", "list")])
+        extract = compile_extractor({
+            "Lead": "SponsorModule.Collaborator[0].Name",
+            "Sites": ("LocationList.Location[]", {"City": "LocationCity", "Contact": "ContactList.Contact[0].Name"}),
+            "Label": Format("{Lead} ({Lead})"),
+        })
+        study = {"ProtocolSection": {
+            "SponsorModule": {"Collaborator": [{"Name": "NIH"}, {"Name": "FDA"}]},
+            "LocationList": {"Location": [{"LocationCity": "Oslo", "ContactList": {"Contact": [{"Name": "Dr. A"}]}}, {"LocationCity": "Bergen"}]},
+        }}
+        self.assertEqual(extract(study), {
+            "Lead": "NIH",
+            "Sites": [{"City": "Oslo", "Contact": "Dr. A"}, {"City": "Bergen", "Contact": ""}],
+            "Label": "NIH (NIH)",
+        })
+        self.assertEqual(extract({}), {"Lead": "", "Sites": [], "Label": " ()"})
+        with self.assertRaises(ValueError):
+            compile_extractor({"Label": Format("{NCTId}"), "NCTId": "IdentificationModule.NCTId"})
+        with self.assertRaises(ValueError):
+            compile_extractor({"Sites": "LocationList[].Location"})
+
+if __name__ == "__main__":
+    unittest.main()
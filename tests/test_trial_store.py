@@ -0,0 +1,95 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import pyarrow.parquet as pq
+from trial_store import build_store, open_store
+from criteria_parser import parsed_criteria, PARSED_FIELD
+
+def make_cleaned(nct_id, gender="All", conditions=("Breast Cancer",)):
+    return {
+        "BriefTitle": f"Title {nct_id}",
+        "BriefSummary": "Summary",
+        "EligibilityCriteria": "Adults",
+        "HealthyVolunteers": "No",
+        "Gender": gender,
+        "MinimumAge": "18 Years",
+        "Location": [{"Facility": "Clinic", "City": "Boston", "State": "Massachusetts", "Zip": "02115", "Country": "United States"}],
+        "Conditions": list(conditions),
+        "Keywords": [],
+        "Intervention": [{"Type": "Drug", "Name": "Aspirin"}],
+        "NCTId": nct_id,
+        "MoreInfoLink": "",
+    }
+
+class TestTrialStore(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.work_dir, "cleaned")
+        self.store_dir = os.path.join(self.work_dir, "trial_store")
+        os.makedirs(os.path.join(self.source_dir, "a"))
+        self.nct_ids = ["NCT01000003", "NCT00000002", "NCT01000001", "NCT00000001"]
+        for index, nct_id in enumerate(self.nct_ids):
+            with open(os.path.join(self.source_dir, "a", f"{nct_id}_cleaned.json"), 'w') as file:
+                json.dump([make_cleaned(nct_id, gender="Female" if index % 2 else "All")], file)
+        # The same study in a JSONL shard must not be stored twice
+        with open(os.path.join(self.source_dir, "shard_00000.jsonl"), 'w') as file:
+            file.write(json.dumps(make_cleaned("NCT00000001")) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_partitions_are_sorted_by_nct_id(self):
+        info = build_store(self.source_dir, self.store_dir, row_group_size=1)
+        self.assertEqual(info["records"], 4)
+        self.assertEqual(info["partitions"], {"NCT000": 2, "NCT010": 2})
+        parquet_file = pq.ParquetFile(os.path.join(self.store_dir, "nct_prefix=NCT010", "part-0.parquet"))
+        self.assertEqual(parquet_file.read(columns=["NCTId"]).column(0).to_pylist(), ["NCT01000001", "NCT01000003"])
+        self.assertTrue(parquet_file.metadata.row_group(0).column(0).statistics.has_min_max)
+
+    def test_scan_with_columns_and_filter(self):
+        build_store(self.source_dir, self.store_dir)
+        store = open_store(self.store_dir)
+        rows = list(store.scan(columns=["NCTId", "Gender"], filter={"Gender": "Female"}))
+        self.assertEqual(sorted(row["NCTId"] for row in rows), ["NCT00000001", "NCT00000002"])
+        self.assertEqual(set(rows[0]), {"NCTId", "Gender"})
+        self.assertEqual(store.count(), 4)
+
+    def test_get_by_nct_id_returns_full_record(self):
+        build_store(self.source_dir, self.store_dir)
+        [record] = open_store(self.store_dir).get(["NCT01000003"])
+        self.assertEqual(record["Intervention"], [{"Type": "Drug", "Name": "Aspirin"}])
+        self.assertEqual(record["Conditions"], ["Breast Cancer"])
+        self.assertNotIn("nct_prefix", record)
+
+    def test_studies_without_nct_id_are_all_kept(self):
+        with open(os.path.join(self.source_dir, "a", "unnamed_cleaned.json"), 'w') as file:
+            json.dump([make_cleaned(None, conditions=["Asthma"]), make_cleaned("", conditions=["Gout"])], file)
+        info = build_store(self.source_dir, self.store_dir)
+        self.assertEqual(info["partitions"]["unknown"], 2)
+        store = open_store(self.store_dir)
+        rows = list(store.scan(filter={"nct_prefix": "unknown"}))
+        self.assertEqual(sorted(row["Conditions"][0] for row in rows), ["Asthma", "Gout"])
+        self.assertNotIn("nct_prefix", rows[0])
+        self.assertEqual([row["nct_prefix"] for row in store.scan(columns=["NCTId", "nct_prefix"], filter={"NCTId": "NCT00000002"})], ["NCT000"])
+
+    def test_parsed_criteria_are_persisted(self):
+        study = make_cleaned("NCT02000001")
+        study["EligibilityCriteria"] = "Inclusion Criteria:\n* Aged 18 to 65 years\nExclusion Criteria:\n* Pregnancy"
+        study[PARSED_FIELD] = parsed_criteria(study)
+        with open(os.path.join(self.source_dir, "a", "NCT02000001_cleaned.json"), 'w') as file:
+            json.dump([study], file)
+        build_store(self.source_dir, self.store_dir)
+        store = open_store(self.store_dir)
+        [record] = store.get(["NCT02000001"])
+        self.assertEqual(record[PARSED_FIELD], study[PARSED_FIELD])
+        self.assertIs(parsed_criteria(record), record[PARSED_FIELD])
+        self.assertIsNone(store.get(["NCT00000001"])[0][PARSED_FIELD])
+
+    def test_open_missing_store_raises(self):
+        with self.assertRaises(FileNotFoundError):
+            open_store(self.store_dir)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from embedding_store import write_embedding_store, open_embedding_store
+from vector_index import VectorIndex, build_from_store, normalize
+
+class TestVectorIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        # Clustered vectors, so IVF probing has structure to find
+        centers = rng.normal(size=(20, 32))
+        self.vectors = (centers[rng.integers(20, size=2000)] + 0.3 * rng.normal(size=(2000, 32))).astype(np.float32)
+        self.ids = [f"NCT{i:08d}" for i in range(2000)]
+        self.queries = self.vectors[rng.integers(2000, size=50)] + 0.1 * rng.normal(size=(50, 32))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def brute_force(self, query, k, ids=None, vectors=None):
+        ids = ids if ids is not None else self.ids
+        vectors = normalize(vectors if vectors is not None else self.vectors)
+        scores = vectors @ normalize(query)
+        return [ids[row] for row in np.argsort(-scores, kind='stable')[:k]]
+
+    def test_exact_search_matches_brute_force(self):
+        index = VectorIndex(32)
+        index.add(self.ids, self.vectors)
+        for query in self.queries[:10]:
+            results = index.search(query, k=5)
+            self.assertEqual([nct_id for nct_id, _ in results], self.brute_force(query, 5))
+            self.assertEqual([score for _, score in results], sorted([score for _, score in results], reverse=True))
+
+    def test_ivf_recall(self):
+        index = VectorIndex(32)
+        index.add(self.ids, self.vectors)
+        index.train_ivf(nlist=40, nprobe=6)
+        hits = 0
+        for query in self.queries:
+            hits += len(set(nct_id for nct_id, _ in index.search(query, k=10)) & set(self.brute_force(query, 10)))
+        self.assertGreater(hits / (10 * len(self.queries)), 0.9)
+
+    def test_add_replace_and_delete(self):
+        index = VectorIndex(32)
+        index.add(self.ids[:100], self.vectors[:100])
+        index.train_ivf(nlist=4, nprobe=4)
+        index.add(self.ids[100:200], self.vectors[100:200])
+        self.assertEqual(len(index), 200)
+        self.assertEqual(index.delete(["NCT00000005", "NCT99999999"]), 1)
+        self.assertNotIn("NCT00000005", index)
+        self.assertNotIn("NCT00000005", [nct_id for nct_id, _ in index.search(self.vectors[5], k=200)])
+        # Re-adding an NCTId replaces its vector instead of duplicating it
+        index.add(["NCT00000007"], self.vectors[150:151])
+        self.assertEqual(len(index), 199)
+        results = index.search(self.vectors[150], k=2, exact=True)
+        self.assertEqual({nct_id for nct_id, _ in results}, {"NCT00000007", "NCT00000150"})
+        self.assertEqual(len(index.search(self.vectors[0], k=500)), 199)
+
+    def test_save_and_load(self):
+        index = VectorIndex(32)
+        index.add(self.ids, self.vectors)
+        index.train_ivf(nlist=20)
+        index.delete(self.ids[:10])
+        index_dir = os.path.join(self.tmp_dir, "index")
+        info = index.save(index_dir)
+        self.assertEqual(info["size"], 1990)
+        loaded = VectorIndex.load(index_dir)
+        self.assertIsInstance(loaded.vectors, np.memmap)
+        self.assertEqual(len(loaded), 1990)
+        for query in self.queries[:5]:
+            self.assertEqual(loaded.search(query, k=5), index.search(query, k=5))
+        # A loaded (read-only) index can still be updated
+        loaded.add(["NCT00000001"], self.vectors[1:2])
+        loaded.delete(["NCT00000020"])
+        self.assertEqual(loaded.search(self.vectors[1], k=1, exact=True)[0][0], "NCT00000001")
+        self.assertEqual(len(loaded), 1990)
+
+    def test_build_from_store(self):
+        store_dir = os.path.join(self.tmp_dir, "store")
+        records = [{"NCTId": nct_id, "file": "a.json", "BriefTitle": ""} for nct_id in self.ids[:300]]
+        write_embedding_store(store_dir, records, self.vectors[:300], dtype="float16", shard_rows=128)
+        index = build_from_store(open_embedding_store(store_dir))
+        self.assertEqual(len(index), 300)
+        self.assertEqual(index.search(self.vectors[42], k=1)[0][0], "NCT00000042")
+
+if __name__ == "__main__":
+    unittest.main()
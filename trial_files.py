@@ -0,0 +1,55 @@
+# ******** Part of Tools ******
+import os
+import json
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_trials(file_path):
+    """The trials in one JSON file (a list or a single trial); [] when the file cannot be read."""
+    try:
+        with open(file_path, 'r') as file:
+            json_data = json.load(file)
+    except json.JSONDecodeError as e:
+        print(f"Error: The file {file_path} is not a valid JSON file. Error: {e}")
+        return []
+    except Exception as e:
+        print(f"Error: Failed to read file {file_path}. Error: {e}")
+        return []
+    return json_data if isinstance(json_data, list) else [json_data]
+
+def iter_json_trials(directory):
+    """Yield (file_path, trial) pairs one file at a time instead of loading every trial into memory."""
+    for root, _, files in os.walk(directory):
+        for filename in files:
+            if filename.endswith(".json"):
+                file_path = os.path.join(root, filename)
+                for trial in load_trials(file_path):
+                    yield file_path, trial
+
+class GroupedFileWriter:
+    """Write trials to one output file per source file as they stream past.
+
+    Only the trials of the current source file are buffered, so memory does not grow with the corpus.
+    """
+
+    def __init__(self, output_dir, name_for):
+        self.output_dir = output_dir
+        self.name_for = name_for
+        self.current_path = None
+        self.trials = []
+        self.saved = 0
+        os.makedirs(output_dir, exist_ok=True)
+
+    def add(self, file_path, trial):
+        if file_path != self.current_path:
+            self.flush()
+            self.current_path = file_path
+        self.trials.append(trial)
+
+    def flush(self):
+        if self.trials:
+            output_path = os.path.join(self.output_dir, self.name_for(self.current_path))
+            with open(output_path, 'w') as file:
+                json.dump(self.trials, file, indent=2)
+            self.saved += len(self.trials)
+        self.trials = []
@@ -0,0 +1,213 @@
+# ******** Part of Process ******
+import os
+import json
+import shutil
+import argparse
+import tempfile
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from criteria_parser import PARSED_FIELD, RENDERED_FIELD
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SOURCE_DIR = os.path.join(BASE_DIR, 'data', 'cleaned')
+DEFAULT_STORE_DIR = os.path.join(BASE_DIR, 'data', 'trial_store')
+PARTITION_COLUMN = "nct_prefix"
+ROW_GROUP_SIZE = 10000
+STORE_INFO_FILE = "_store.json"
+
+STRING_FIELDS = [
+    "NCTId", "BriefTitle", "BriefSummary", "EligibilityCriteria", "HealthyVolunteers",
+    "Gender", "MinimumAge", "NCTId_link", "MoreInfoLink",
+]
+LOCATION_TYPE = pa.struct([(name, pa.string()) for name in ("Facility", "City", "State", "Zip", "Country")])
+INTERVENTION_TYPE = pa.struct([(name, pa.string()) for name in ("Type", "Name")])
+# The parse criteria_parser.py stores next to EligibilityCriteria
+CONSTRAINT_TYPE = pa.struct([
+    ("measure", pa.string()), ("min", pa.float64()), ("max", pa.float64()), ("min_inclusive", pa.bool_()),
+    ("max_inclusive", pa.bool_()), ("unit", pa.string()), ("section", pa.string()), ("text", pa.string()),
+])
+PARSED_CRITERIA_TYPE = pa.struct([
+    ("hash", pa.string()), ("inclusion", pa.list_(pa.string())), ("exclusion", pa.list_(pa.string())),
+    ("constraints", pa.list_(CONSTRAINT_TYPE)), (RENDERED_FIELD, pa.string()),
+])
+
+SCHEMA = pa.schema(
+    [(name, pa.string()) for name in STRING_FIELDS]
+    + [
+        ("Location", pa.list_(LOCATION_TYPE)),
+        ("Conditions", pa.list_(pa.string())),
+        ("Keywords", pa.list_(pa.string())),
+        ("Intervention", pa.list_(INTERVENTION_TYPE)),
+        (PARSED_FIELD, PARSED_CRITERIA_TYPE),
+    ]
+)
+
+def partition_for(nct_id):
+    """Partition of a study: "NCT" and the first three digits of its NCTId, stored as nct_prefix=NCT000 ...
+    nct_prefix=NCT069 (roughly 10k studies each); studies without an NCTId go to nct_prefix=unknown."""
+    return nct_id[:6] if nct_id else "unknown"
+
+def iter_cleaned_studies(source_dir):
+    """Yield cleaned studies from the _cleaned.json files and/or JSONL shards under source_dir."""
+    for root, _, files in os.walk(source_dir):
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            if file.endswith('.jsonl'):
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if line.strip():
+                            yield json.loads(line)
+            elif file.endswith('.json') and file != STORE_INFO_FILE and file != 'manifest.json':
+                with open(file_path, 'r') as f:
+                    try:
+                        data = json.load(f)
+                    except json.JSONDecodeError as e:
+                        print(f"\033[91mError decoding JSON from file: {file_path}\033[0m")
+                        print(e)
+                        continue
+                for study in data if isinstance(data, list) else [data]:
+                    yield study
+
+def normalize_study(study):
+    """Coerce a cleaned study to the store schema (scalars as strings, lists of the expected shape)."""
+    record = {}
+    for name in STRING_FIELDS:
+        value = study.get(name)
+        record[name] = None if value is None else str(value)
+    record["Location"] = [{key: str(loc.get(key, "")) for key in LOCATION_TYPE.names} for loc in study.get("Location") or []]
+    record["Conditions"] = [str(value) for value in study.get("Conditions") or []]
+    record["Keywords"] = [str(value) for value in study.get("Keywords") or []]
+    record["Intervention"] = [{key: str(item.get(key, "")) for key in INTERVENTION_TYPE.names} for item in study.get("Intervention") or []]
+    parsed = study.get(PARSED_FIELD)
+    record[PARSED_FIELD] = None if not parsed else {
+        "hash": parsed.get("hash"),
+        "inclusion": [str(item) for item in parsed.get("inclusion") or []],
+        "exclusion": [str(item) for item in parsed.get("exclusion") or []],
+        "constraints": [{key: constraint.get(key) for key in CONSTRAINT_TYPE.names} for constraint in parsed.get("constraints") or []],
+        RENDERED_FIELD: parsed.get(RENDERED_FIELD),
+    }
+    return record
+
+def build_store(source_dir, store_dir, row_group_size=ROW_GROUP_SIZE):
+    """Write every cleaned study under source_dir to an NCTId-sorted, partitioned Parquet store.
+
+    Studies are first spilled to one temporary JSONL file per partition so only a single
+    partition is ever held in memory while it is sorted and written.
+    """
+    spill_dir = tempfile.mkdtemp(prefix="trial_store_")
+    spill_files = {}
+    try:
+        for study in iter_cleaned_studies(source_dir):
+            record = normalize_study(study)
+            partition = partition_for(record["NCTId"])
+            if partition not in spill_files:
+                spill_files[partition] = open(os.path.join(spill_dir, f"{partition}.jsonl"), 'w', encoding='utf-8')
+            spill_files[partition].write(json.dumps(record, ensure_ascii=False))
+            spill_files[partition].write("\n")
+        for spill_file in spill_files.values():
+            spill_file.close()
+
+        if os.path.exists(store_dir):
+            shutil.rmtree(store_dir)
+        os.makedirs(store_dir)
+
+        partitions = {}
+        for partition in sorted(spill_files):
+            with open(os.path.join(spill_dir, f"{partition}.jsonl"), 'r', encoding='utf-8') as f:
+                records = [json.loads(line) for line in f]
+            # Duplicate NCTIds (e.g. the same study in two shards) keep the last copy seen;
+            # studies without an NCTId cannot be told apart and are all kept
+            unique = {}
+            unnamed = []
+            for record in records:
+                if record["NCTId"]:
+                    unique[record["NCTId"]] = record
+                else:
+                    unnamed.append(record)
+            records = list(unique.values()) + unnamed
+            records.sort(key=lambda record: record["NCTId"] or "")
+            table = pa.Table.from_pylist(records, schema=SCHEMA)
+            partition_dir = os.path.join(store_dir, f"{PARTITION_COLUMN}={partition}")
+            os.makedirs(partition_dir)
+            pq.write_table(table, os.path.join(partition_dir, "part-0.parquet"), row_group_size=row_group_size,
+                           compression="zstd", write_statistics=True)
+            partitions[partition] = len(records)
+            print(f"\033[92mWrote {len(records)} studies to {partition_dir}\033[0m")
+    finally:
+        for spill_file in spill_files.values():
+            spill_file.close()
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    info = {"records": sum(partitions.values()), "partitions": partitions, "row_group_size": row_group_size}
+    with open(os.path.join(store_dir, STORE_INFO_FILE), 'w') as f:
+        json.dump(info, f, indent=4)
+    return info
+
+def make_filter(filter):
+    """Turn {column: value-or-list} into a dataset expression; expressions pass through unchanged."""
+    if filter is None or isinstance(filter, ds.Expression):
+        return filter
+    expression = None
+    for column, value in filter.items():
+        if isinstance(value, (list, tuple, set)):
+            term = ds.field(column).isin(list(value))
+        else:
+            term = ds.field(column) == value
+        expression = term if expression is None else expression & term
+    return expression
+
+class TrialStore:
+    """Read access to a store written by build_store."""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.dataset = ds.dataset(store_dir, format="parquet", partitioning="hive",
+                                  exclude_invalid_files=True, ignore_prefixes=[".", "_"])
+
+    def study_columns(self, columns=None):
+        """The requested columns, or every stored field without the nct_prefix partition column."""
+        if columns is not None:
+            return columns
+        return [name for name in self.dataset.schema.names if name != PARTITION_COLUMN]
+
+    def to_table(self, columns=None, filter=None):
+        return self.dataset.to_table(columns=self.study_columns(columns), filter=make_filter(filter))
+
+    def scan_batches(self, columns=None, filter=None, batch_size=ROW_GROUP_SIZE):
+        """Yield pyarrow RecordBatches, reading only the requested columns and matching row groups."""
+        scanner = self.dataset.scanner(columns=self.study_columns(columns), filter=make_filter(filter), batch_size=batch_size)
+        yield from scanner.to_batches()
+
+    def scan(self, columns=None, filter=None, batch_size=ROW_GROUP_SIZE):
+        """Yield studies as dicts, e.g. scan(columns=["NCTId", "BriefTitle"], filter={"Gender": "Female"})."""
+        for batch in self.scan_batches(columns, filter, batch_size):
+            yield from batch.to_pylist()
+
+    def get(self, nct_ids, columns=None):
+        """Look up studies by NCTId; the partition column lets Parquet skip unrelated partitions."""
+        nct_ids = list(nct_ids)
+        prefixes = sorted({partition_for(nct_id) for nct_id in nct_ids})
+        expression = ds.field(PARTITION_COLUMN).isin(prefixes) & ds.field("NCTId").isin(nct_ids)
+        return self.to_table(columns=columns, filter=expression).to_pylist()
+
+    def count(self, filter=None):
+        return self.dataset.count_rows(filter=make_filter(filter))
+
+def open_store(store_dir=DEFAULT_STORE_DIR):
+    if not os.path.exists(os.path.join(store_dir, STORE_INFO_FILE)):
+        raise FileNotFoundError(f"No trial store found at {store_dir}. Run trial_store.py to build it.")
+    return TrialStore(store_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the consolidated Parquet trial store from cleaned JSON/JSONL files.')
+    parser.add_argument('--source_dir', default=DEFAULT_SOURCE_DIR, help='Directory with _cleaned.json files or JSONL shards.')
+    parser.add_argument('--store_dir', default=DEFAULT_STORE_DIR, help='Directory for the Parquet trial store.')
+    parser.add_argument('--row_group_size', type=int, default=ROW_GROUP_SIZE, help='Rows per Parquet row group.')
+    args = parser.parse_args()
+
+    print(f"\033[92mBuilding trial store from {args.source_dir}...\033[0m")
+    info = build_store(args.source_dir, args.store_dir, args.row_group_size)
+    print(f"\033[92mStored {info['records']} studies in {len(info['partitions'])} partitions at {args.store_dir}\033[0m")
@@ -0,0 +1,271 @@
+# ******** Part of Tools ******
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_INDEX_DIR = os.path.join(BASE_DIR, 'data', 'vector_index')
+INDEX_INFO_FILE = "_index.json"
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64  # Training vectors per inverted list
+ASSIGN_CHUNK = 8192  # Rows scored against the centroids at a time
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def nearest_centroids(vectors, centroids):
+    """Index of the most similar centroid per vector, scored in chunks to bound memory."""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        assignments[start:start + ASSIGN_CHUNK] = np.argmax(vectors[start:start + ASSIGN_CHUNK] @ centroids.T, axis=1)
+    return assignments
+
+def kmeans(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means (cosine) on the given vectors; returns unit-length centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = nearest_centroids(vectors, centroids)
+        order = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=nlist)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        filled = counts > 0
+        centroids[filled] = np.add.reduceat(vectors[order], starts[filled], axis=0)
+        # An empty list is re-seeded with a random vector rather than left dead
+        centroids[~filled] = vectors[rng.integers(len(vectors), size=int((~filled).sum()))]
+        centroids = normalize(centroids)
+    return centroids
+
+class VectorIndex:
+    """Cosine-similarity index over trial embeddings, keyed by NCTId.
+
+    Exact search scores every live vector with one matrix-vector product. After train_ivf() the
+    index also has an inverted-file (IVF) mode: vectors are bucketed by their nearest k-means
+    centroid and a query only scores the buckets of its nprobe nearest centroids.
+
+    Adding an NCTId that is already present replaces its vector; deletes only flip a liveness
+    flag until compact() (or save(compact=True)) drops the rows.
+    """
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.size = 0
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._alive = np.empty(0, dtype=bool)
+        self._assignments = np.empty(0, dtype=np.int32)
+        self.ids = []
+        self.row_of = {}
+        self.centroids = None
+        self.nprobe = DEFAULT_NPROBE
+        self._lists = None  # (rows ordered by list, list offsets); rebuilt lazily after adds
+
+    @property
+    def vectors(self):
+        return self._vectors[:self.size]
+
+    @property
+    def alive(self):
+        return self._alive[:self.size]
+
+    def __len__(self):
+        return len(self.row_of)
+
+    def __contains__(self, nct_id):
+        return nct_id in self.row_of
+
+    def _reserve(self, rows):
+        """Grow the backing arrays geometrically so a stream of small adds stays amortised O(1)."""
+        needed = self.size + rows
+        if needed <= len(self._vectors) and self._vectors.flags.writeable:
+            return
+        capacity = max(needed, 2 * len(self._vectors), 1024)
+        vectors = np.empty((capacity, self.dim), dtype=np.float32)
+        vectors[:self.size] = self.vectors
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self.size] = self.alive
+        assignments = np.full(capacity, -1, dtype=np.int32)
+        assignments[:self.size] = self._assignments[:self.size]
+        self._vectors, self._alive, self._assignments = vectors, alive, assignments
+
+    def add(self, nct_ids, vectors):
+        nct_ids = list(nct_ids)
+        vectors = normalize(vectors).reshape(len(nct_ids), self.dim)
+        # Keep only the last vector of an NCTId repeated within the batch
+        last = {nct_id: position for position, nct_id in enumerate(nct_ids)}
+        positions = sorted(last.values())
+        self.delete([nct_ids[position] for position in positions if nct_ids[position] in self.row_of])
+        self._reserve(len(positions))
+        start = self.size
+        end = start + len(positions)
+        self._vectors[start:end] = vectors[positions]
+        self._alive[start:end] = True
+        if self.centroids is not None:
+            self._assignments[start:end] = nearest_centroids(self._vectors[start:end], self.centroids)
+            self._lists = None
+        for offset, position in enumerate(positions):
+            self.row_of[nct_ids[position]] = start + offset
+            self.ids.append(nct_ids[position])
+        self.size = end
+
+    def delete(self, nct_ids):
+        removed = 0
+        for nct_id in nct_ids:
+            row = self.row_of.pop(nct_id, None)
+            if row is not None:
+                if not self._alive.flags.writeable:
+                    self._reserve(0)
+                self._alive[row] = False
+                removed += 1
+        return removed
+
+    def compact(self):
+        """Drop deleted rows and renumber the rest."""
+        keep = np.flatnonzero(self.alive)
+        self._vectors = self.vectors[keep].copy()
+        self._alive = np.ones(len(keep), dtype=bool)
+        self._assignments = self._assignments[:self.size][keep].copy()
+        self.ids = [self.ids[row] for row in keep]
+        self.row_of = {nct_id: row for row, nct_id in enumerate(self.ids)}
+        self.size = len(keep)
+        self._lists = None
+
+    def train_ivf(self, nlist=None, nprobe=DEFAULT_NPROBE, seed=0):
+        """Cluster the live vectors into nlist inverted lists (default ~4 * sqrt(n))."""
+        live = np.flatnonzero(self.alive)
+        nlist = min(nlist or max(1, int(4 * np.sqrt(len(live)))), len(live))
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(live), nlist * KMEANS_SAMPLE_PER_LIST)
+        sample = self.vectors[np.sort(rng.choice(live, size=sample_size, replace=False))]
+        self.centroids = kmeans(sample, nlist, seed=seed)
+        self.nprobe = nprobe
+        self._reserve(0)
+        self._assignments[:self.size] = nearest_centroids(self.vectors, self.centroids)
+        self._lists = None
+
+    def _inverted_lists(self):
+        if self._lists is None:
+            assignments = self._assignments[:self.size]
+            order = np.argsort(assignments, kind='stable')
+            offsets = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+            self._lists = (order, offsets)
+        return self._lists
+
+    def search(self, query, k=10, nprobe=None, exact=False):
+        """Top-k (NCTId, cosine similarity) pairs for a query vector.
+
+        Uses the IVF lists when the index has been trained, unless exact=True.
+        """
+        query = normalize(query).reshape(self.dim)
+        if self.centroids is None or exact:
+            rows = None
+            scores = self.vectors @ query
+        else:
+            nprobe = min(nprobe or self.nprobe, len(self.centroids))
+            probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+            order, offsets = self._inverted_lists()
+            rows = np.concatenate([order[offsets[probe]:offsets[probe + 1]] for probe in probes])
+            scores = self.vectors[rows] @ query
+        alive = self.alive if rows is None else self.alive[rows]
+        scores = np.where(alive, scores, -np.inf)
+        k = min(k, int(alive.sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self.ids[row if rows is None else rows[row]], float(scores[row])) for row in top]
+
+    def save(self, index_dir, compact=True):
+        if compact:
+            self.compact()
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(os.path.join(index_dir, "vectors.npy"), self.vectors)
+        np.save(os.path.join(index_dir, "ids.npy"), np.array(self.ids, dtype=str))
+        np.save(os.path.join(index_dir, "alive.npy"), self.alive)
+        if self.centroids is not None:
+            np.save(os.path.join(index_dir, "centroids.npy"), self.centroids)
+            np.save(os.path.join(index_dir, "assignments.npy"), self._assignments[:self.size])
+        info = {"dim": self.dim, "size": self.size, "live": len(self), "ivf": self.centroids is not None, "nprobe": self.nprobe}
+        # The info file is replaced last, so a partially written index is never opened
+        info_path = os.path.join(index_dir, INDEX_INFO_FILE)
+        with open(info_path + ".tmp", 'w') as file:
+            json.dump(info, file, indent=4)
+        os.replace(info_path + ".tmp", info_path)
+        return info
+
+    @classmethod
+    def load(cls, index_dir):
+        """Open a saved index; vectors are memory-mapped and only copied on the first add or delete."""
+        with open(os.path.join(index_dir, INDEX_INFO_FILE), 'r') as file:
+            info = json.load(file)
+        index = cls(info["dim"])
+        index._vectors = np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode='r')
+        index._alive = np.load(os.path.join(index_dir, "alive.npy"), mmap_mode='r')
+        index.ids = np.load(os.path.join(index_dir, "ids.npy")).tolist()
+        index.size = info["size"]
+        alive = index._alive[:index.size].tolist()
+        index.row_of = {nct_id: row for row, nct_id in enumerate(index.ids) if alive[row]}
+        index.nprobe = info["nprobe"]
+        if info["ivf"]:
+            index.centroids = np.load(os.path.join(index_dir, "centroids.npy"))
+            index._assignments = np.load(os.path.join(index_dir, "assignments.npy"), mmap_mode='r')
+        else:
+            index._assignments = np.full(index.size, -1, dtype=np.int32)
+        return index
+
+def build_from_store(store, index=None):
+    """Add every vector of an embedding_store.EmbeddingStore, shard by shard, to an index."""
+    nct_ids = store.metadata.column("NCTId").to_pylist()
+    index = index or VectorIndex(store.dim)
+    start = 0
+    for shard in range(len(store.shards)):
+        vectors = store.shard_vectors(shard, np.float32)
+        index.add(nct_ids[start:start + len(vectors)], vectors)
+        start += len(vectors)
+    return index
+
+if __name__ == "__main__":
+    from embedding_store import open_embedding_store
+
+    parser = argparse.ArgumentParser(description='Build or query the local vector index over trial embeddings.')
+    parser.add_argument('--store_dir', nargs='*', default=[], help='Embedding stores written by create_embeddings.py to add to the index.')
+    parser.add_argument('--index_dir', default=DEFAULT_INDEX_DIR, help='Directory of the saved index.')
+    parser.add_argument('--ivf', type=int, nargs='?', const=0, default=None, help='Train an IVF index with this many lists (default ~4*sqrt(n)).')
+    parser.add_argument('--nprobe', type=int, default=DEFAULT_NPROBE, help='Lists scanned per IVF query.')
+    parser.add_argument('--delete', nargs='*', default=[], help='NCTIds to remove from the index.')
+    parser.add_argument('--query', help='Text to search for (embedded through the embedding cache).')
+    parser.add_argument('--k', type=int, default=10, help='Number of results.')
+    args = parser.parse_args()
+
+    index = VectorIndex.load(args.index_dir) if os.path.exists(os.path.join(args.index_dir, INDEX_INFO_FILE)) else None
+    for store_dir in args.store_dir:
+        index = build_from_store(open_embedding_store(store_dir), index)
+        print(f"\033[92mAdded {store_dir}; {len(index)} trials indexed\033[0m")
+    if index is None:
+        raise SystemExit(f"No index at {args.index_dir}; pass --store_dir to build one.")
+    if args.delete:
+        print(f"\033[92mDeleted {index.delete(args.delete)} trials\033[0m")
+    if args.ivf is not None:
+        index.train_ivf(args.ivf or None, args.nprobe)
+        print(f"\033[92mTrained {len(index.centroids)} IVF lists\033[0m")
+    if args.store_dir or args.delete or args.ivf is not None:
+        index.save(args.index_dir)
+
+    if args.query:
+        from embedding_cache import EmbeddingCache
+        from embedding_engine import EmbeddingEngine
+        engine = EmbeddingEngine()
+        query_vector = EmbeddingCache().embed([args.query], engine.embed, engine.model)[0]
+        if query_vector is None:
+            raise SystemExit("Could not embed the query.")
+        start_time = time.perf_counter()
+        results = index.search(query_vector, args.k, args.nprobe)
+        print(f"\033[92mTop {len(results)} in {(time.perf_counter() - start_time) * 1000:.1f} ms\033[0m")
+        for nct_id, score in results:
+            print(f"{nct_id}\t{score:.4f}")